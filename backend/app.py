@@ -3,17 +3,26 @@ AI Dungeon Master - Backend API
 FastAPI server with rule engine and OpenAI integration
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple
 import openai
 import os
-import json
-import random
+import asyncio
+import sys
+import time
+import uuid
 from datetime import datetime
+from enum import Enum
 from pathlib import Path
+import numpy as np
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from functools import lru_cache, partial
+from hashlib import blake2b
 
 # Load environment variables from .env file if it exists
 env_path = Path(__file__).parent.parent / ".env"
@@ -30,7 +39,23 @@ if env_path.exists():
 else:
     print(f"⚠️  No .env file found at {env_path}. Using environment variables or defaults.")
 
-app = FastAPI(title="AI Dungeon Master API")
+# Local modules read their settings from the environment on import, so they come after .env
+from eventlog import create_event_log
+from extraction import extract_entities
+from failover import FailoverChain, reserved_provider
+from intents import classify, items_used
+from metrics import CONTENT_TYPE, REGISTRY, SIZE_BUCKETS, Counter, Gauge, Histogram
+from prompt import SUMMARY_PROMPT, PromptBuilder, PromptSection, build_summary_prompt
+from providers import ProviderRegistry
+from responses import FastJSONResponse, dumps, fragment_cache
+from rules import MONSTER_TYPES, Character, Monster, Record, RuleEngine, attack_odds, check_odds
+from scheduler import (BACKGROUND, INTERACTIVE, LLM_BACKGROUND_QUEUE_TIMEOUT, LLM_QUEUE_TIMEOUT,
+                       SchedulerRejected, create_llm_scheduler)
+from sessions import SessionLocks, SharedSessionStore, VersionConflict, create_session_store
+from tracing import SERVER_TIMING, TracedRoute, bind, finish_trace, span, start_trace
+
+app = FastAPI(title="AI Dungeon Master API", default_response_class=FastJSONResponse)
+app.router.route_class = TracedRoute  # Times endpoints apart from request/response validation
 
 # CORS middleware
 app.add_middleware(
@@ -43,11 +68,19 @@ app.add_middleware(
 
 # AI Provider Configuration (loaded after .env)
 AI_PROVIDER = os.getenv("AI_PROVIDER", "openai").lower()  # openai, groq, huggingface, ollama, together
+# Ordered fallback chain, e.g. "groq,openai,ollama" (defaults to just AI_PROVIDER)
+AI_PROVIDERS = [name.strip().lower() for name in os.getenv("AI_PROVIDERS", AI_PROVIDER).split(",") if name.strip()]
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
-TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+LLM_WARMUP = os.getenv("LLM_WARMUP", "false").lower() in ("1", "true", "yes")
+
+# Provider clients are built once and reuse pooled keep-alive connections
+provider_registry = ProviderRegistry()
+
+# Caps in-flight LLM requests per provider; turns queue for a slot on the provider that will serve them
+llm_scheduler = create_llm_scheduler()
+
+# Narratives go through the chain: broken providers are skipped, slow ones optionally hedged
+narrative_chain = FailoverChain(provider_registry, AI_PROVIDERS, scheduler=llm_scheduler)
 
 # Set OpenAI API key for the openai library
 if OPENAI_API_KEY:
@@ -57,125 +90,122 @@ else:
     print("⚠️  OPENAI_API_KEY not set in .env or environment")
 
 
-# ==================== RULE ENGINE ====================
+# ==================== GAME STATE ====================
 
-class RuleEngine:
-    """Game rules engine - all game mechanics are determined by code, not AI"""
-    
-    @staticmethod
-    def roll_dice(sides: int, count: int = 1) -> List[int]:
-        """Roll dice: returns list of results"""
-        return [random.randint(1, sides) for _ in range(count)]
-    
-    @staticmethod
-    def roll_d20() -> int:
-        """Roll a d20"""
-        return random.randint(1, 20)
-    
-    @staticmethod
-    def roll_d6(count: int = 1) -> int:
-        """Roll d6s and return sum"""
-        return sum(RuleEngine.roll_dice(6, count))
+# Turns kept in memory per session (the full history is in the event log)
+GAME_HISTORY_SIZE = 10
+
+# Notes kept in each session's journal
+NOTES_SIZE = 50
+
+
+def _timestamp(iso: Optional[str]) -> float:
+    return datetime.fromisoformat(iso).timestamp() if iso else time.time()
+
+
+@lru_cache(maxsize=8192)
+def _isoformat(timestamp: float) -> str:
+    """ISO time for a stored timestamp (cached for active sessions, which re-render theirs on every commit)"""
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+class NoteCategory(str, Enum):
+    """Journal note categories"""
+    EVENT = "Event"
+    COMBAT = "Combat"
+    ITEM = "Item"
+    COMPANION = "Companion"
+    ALLIANCE = "Alliance"
+
+
+class Note(Record):
+    """Journal entry"""
+    __slots__ = ("title", "description", "category", "turn", "timestamp")
     
-    @staticmethod
-    def calculate_modifier(ability_score: int) -> int:
-        """Calculate ability modifier from score"""
-        return (ability_score - 10) // 2
+    def __init__(self, title: str, description: str, category: NoteCategory, turn: int,
+                 timestamp: Optional[float] = None):
+        self.title = title
+        self.description = description
+        self.category = category
+        self.turn = turn
+        self.timestamp = time.time() if timestamp is None else timestamp
     
-    @staticmethod
-    def attack_roll(attacker_level: int, attacker_modifier: int, 
-                   defender_ac: int, advantage: bool = False) -> Dict[str, Any]:
-        """Perform an attack roll"""
-        roll1 = RuleEngine.roll_d20()
-        roll2 = RuleEngine.roll_d20() if advantage else None
-        
-        roll_used = max(roll1, roll2) if advantage else roll1
-        total = roll_used + attacker_modifier + (attacker_level // 4)  # Proficiency bonus
-        
-        hit = total >= defender_ac
-        critical = roll_used == 20
-        
-        return {
-            "roll": roll_used,
-            "modifier": attacker_modifier,
-            "total": total,
-            "hit": hit,
-            "critical": critical,
-            "advantage_roll": roll2 if advantage else None
-        }
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Note":
+        return cls(data["title"], data["description"], NoteCategory(data.get("category", "Event")),
+                   data.get("turn", 0), _timestamp(data.get("timestamp")))
     
-    @staticmethod
-    def damage_roll(dice_count: int, dice_sides: int, modifier: int = 0, 
-                   critical: bool = False) -> Dict[str, Any]:
-        """Calculate damage"""
-        multiplier = 2 if critical else 1
-        rolls = RuleEngine.roll_dice(dice_sides, dice_count * multiplier)
-        total = sum(rolls) + (modifier * multiplier)
-        
+    def to_dict(self) -> Dict:
+        """Convert to dictionary"""
         return {
-            "rolls": rolls,
-            "modifier": modifier,
-            "total": total,
-            "critical": critical
+            "title": self.title,
+            "description": self.description,
+            "category": self.category.value,
+            "turn": self.turn,
+            "timestamp": _isoformat(self.timestamp)
         }
+
+
+class TurnType(str, Enum):
+    """What a game history entry records"""
+    ACTION = "action"
+    DICE = "dice"
+
+
+class HistoryEntry(Record):
+    """One finished turn in the game history (`action` is the roll type for dice turns)"""
+    __slots__ = ("turn", "type", "action", "events", "narrative", "timestamp")
     
-    @staticmethod
-    def skill_check(ability_modifier: int, proficiency_bonus: int = 0,
-                   difficulty_class: int = 10, advantage: bool = False) -> Dict[str, Any]:
-        """Perform a skill check"""
-        roll1 = RuleEngine.roll_d20()
-        roll2 = RuleEngine.roll_d20() if advantage else None
-        
-        roll_used = max(roll1, roll2) if advantage else roll1
-        total = roll_used + ability_modifier + proficiency_bonus
-        
-        success = total >= difficulty_class
-        
-        return {
-            "roll": roll_used,
-            "modifier": ability_modifier,
-            "proficiency": proficiency_bonus,
-            "total": total,
-            "dc": difficulty_class,
-            "success": success,
-            "advantage_roll": roll2 if advantage else None
-        }
+    def __init__(self, turn: int, turn_type: TurnType, action: str, events: List[Dict], narrative: str,
+                 timestamp: Optional[float] = None):
+        self.turn = turn
+        self.type = turn_type
+        self.action = action
+        self.events = events
+        self.narrative = narrative
+        self.timestamp = time.time() if timestamp is None else timestamp
     
-    @staticmethod
-    def calculate_hp(max_hp: int, current_hp: int, damage: int) -> int:
-        """Apply damage/healing"""
-        return min(max_hp, max(0, current_hp - damage))
+    @classmethod
+    def from_dict(cls, data: Dict) -> "HistoryEntry":
+        action = data.get("action", "")
+        turn_type = TurnType.DICE if action.startswith("Dice roll: ") else TurnType.ACTION
+        if turn_type is TurnType.DICE:
+            action = sys.intern(action[len("Dice roll: "):])
+        return cls(data.get("turn", 0), turn_type, action, data.get("events", []), data.get("narrative", ""),
+                   _timestamp(data.get("timestamp")))
     
-    @staticmethod
-    def calculate_xp(monster_cr: int) -> int:
-        """Calculate XP reward based on monster CR"""
-        xp_table = {
-            0: 10, 1: 200, 2: 450, 3: 700, 4: 1100,
-            5: 1800, 6: 2300, 7: 2900, 8: 3900, 9: 5000
+    def to_dict(self) -> Dict:
+        """Convert to dictionary"""
+        return {
+            "turn": self.turn,
+            "action": f"Dice roll: {self.action}" if self.type is TurnType.DICE else self.action,
+            "events": self.events,
+            "narrative": self.narrative,
+            "timestamp": _isoformat(self.timestamp)
         }
-        return xp_table.get(min(monster_cr, 9), monster_cr * 1000)
 
 
-# ==================== GAME STATE ====================
-
-class Pet:
+class Pet(Record):
     """Pet/Assistant companion"""
-    def __init__(self, name: str = None, pet_type: str = None):
-        self.name = name or random.choice(["Shadow", "Spark", "Whisper", "Ember", "Fang", "Luna", "Rex", "Zephyr"])
-        self.type = pet_type or random.choice(["Wolf", "Owl", "Cat", "Raven", "Ferret", "Dragon Hatchling"])
+    __slots__ = ("name", "type", "level", "max_hp", "current_hp", "abilities", "bond")
+    
+    def __init__(self, name: str = None, pet_type: str = None,
+                 rng: Optional[np.random.Generator] = None):
+        self.name = name or RuleEngine.choice(["Shadow", "Spark", "Whisper", "Ember", "Fang", "Luna", "Rex", "Zephyr"], rng)
+        self.type = pet_type or RuleEngine.choice(["Wolf", "Owl", "Cat", "Raven", "Ferret", "Dragon Hatchling"], rng)
         self.level = 1
         self.max_hp = 10
         self.current_hp = 10
-        self.abilities = self._generate_abilities()
+        self.abilities = self._generate_abilities(rng)
         self.bond = 50  # Bond level (0-100)
     
-    def _generate_abilities(self) -> List[str]:
+    def _generate_abilities(self, rng: Optional[np.random.Generator] = None) -> List[str]:
         """Generate random abilities for the pet"""
         ability_pool = [
             "Scout", "Track", "Alert", "Fetch", "Distract", 
             "Heal", "Protect", "Illuminate", "Detect Magic", "Climb"
         ]
-        return random.sample(ability_pool, k=2)
+        return RuleEngine.sample(ability_pool, 2, rng)
     
     def to_dict(self) -> Dict:
         """Convert to dictionary"""
@@ -190,74 +220,38 @@ class Pet:
         }
 
 
-class Character:
-    """Player character"""
-    def __init__(self):
-        self.name = "Adventurer"
-        self.level = 1
-        self.max_hp = 20
-        self.current_hp = 20
-        self.ac = 15
-        self.strength = 15
-        self.dexterity = 14
-        self.constitution = 13
-        self.intelligence = 12
-        self.wisdom = 10
-        self.charisma = 8
-        self.xp = 0
-        self.xp_to_next_level = 300
-    
-    def get_modifier(self, ability: str) -> int:
-        """Get ability modifier"""
-        score = getattr(self, ability.lower(), 10)
-        return RuleEngine.calculate_modifier(score)
-    
-    def level_up(self):
-        """Level up character"""
-        self.level += 1
-        self.max_hp += RuleEngine.roll_d6(1) + RuleEngine.calculate_modifier(self.constitution)
-        self.current_hp = self.max_hp
-        self.xp_to_next_level = 300 * self.level
-    
-    def add_xp(self, amount: int):
-        """Add XP and check for level up"""
-        self.xp += amount
-        while self.xp >= self.xp_to_next_level:
-            self.level_up()
-    
-    def to_dict(self) -> Dict:
-        """Convert to dictionary"""
-        return {
-            "name": self.name,
-            "level": self.level,
-            "max_hp": self.max_hp,
-            "current_hp": self.current_hp,
-            "ac": self.ac,
-            "strength": self.strength,
-            "dexterity": self.dexterity,
-            "constitution": self.constitution,
-            "intelligence": self.intelligence,
-            "wisdom": self.wisdom,
-            "charisma": self.charisma,
-            "xp": self.xp,
-            "xp_to_next_level": self.xp_to_next_level
-        }
-
-
 class GameState:
-    """Manages game state"""
-    def __init__(self, starting_scenario=None):
+    """Manages game state
+    
+    Every random outcome in a session (scenario, rolls, encounters, pets) is
+    drawn from self.rng, seeded from self.seed, so a game can be replayed
+    exactly from its seed and the same sequence of actions.
+    """
+    def __init__(self, starting_scenario=None, seed: Optional[int] = None):
+        # Per-session random stream (a fresh random seed unless one is given,
+        # kept under 2**53 so it survives a round trip through JSON/JavaScript)
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy) % 2 ** 53
+        self.seed_sequence = np.random.SeedSequence(self.seed)
+        self.rng = np.random.default_rng(self.seed_sequence)
+        
         self.character = Character()
         self.pet = None  # Pet/Assistant companion
         self.inventory = []
-        self.game_history = []
+        self.game_history = []  # Last GAME_HISTORY_SIZE turns; older ones live in the event log
         self.monsters = []
         self.turn_count = 0
         self.conversation_history = []  # Track recent narrative/events for context
+        self.conversation_summary = ""  # Older conversation turns, folded into a running summary
         self.current_npcs = []  # Track NPCs currently interacting with
         self.notes = []  # Journal/notes system for important events
         self.allies = []  # Track allies/companions met
         
+        # Versioning: the version is bumped by every commit() that changes a field
+        self.state_id = uuid.uuid4().hex[:12]  # Distinguishes this game from earlier games in the session
+        self.version = 0
+        self.field_versions = {}  # JSON pointer path -> version in which it last changed
+        self._field_checksums = {}  # JSON pointer path -> digest of its committed JSON
+        
         # Random starting scenario
         if starting_scenario is None:
             starting_scenario = self._generate_starting_scenario()
@@ -273,6 +267,8 @@ class GameState:
             self.monsters = starting_scenario["monsters"]
         if "items" in starting_scenario:
             self.inventory.extend(starting_scenario["items"])
+        
+        self.commit()
     
     def _generate_starting_scenario(self) -> Dict:
         """Generate a random starting scenario"""
@@ -322,26 +318,35 @@ class GameState:
             {
                 "location": "A haunted graveyard",
                 "narrative": "You find yourself in an old graveyard as twilight falls. Ancient tombstones lean at odd angles, and mist swirls between the graves. Strange lights flicker in the distance, and you hear the sound of something moving among the headstones. The air grows cold despite the season.",
-                "monsters": [{"name": "Skeleton", "hp": 15, "max_hp": 15, "ac": 13, "cr": 0}],
+                "monsters": [Monster("Skeleton", hp=15, max_hp=15, ac=13, cr=0)],
                 "items": ["Holy Water", "Silver Coin"]
             }
         ]
-        return random.choice(scenarios)
+        return RuleEngine.choice(scenarios, self.rng)
     
-    def add_note(self, title: str, description: str, category: str = "Event"):
+    def spawn_seeds(self, count: int) -> List[np.random.SeedSequence]:
+        """Independent child seeds for work outside this session's stream
+        
+        Seeds pickle cheaply, so simulations can hand one to each worker
+        process (np.random.default_rng(seed) there) without touching self.rng.
+        Spawning again never repeats earlier children.
+        """
+        return self.seed_sequence.spawn(count)
+    
+    def add_note(self, title: str, description: str, category: NoteCategory = NoteCategory.EVENT):
         """Add a note to the journal"""
-        note = {
-            "title": title,
-            "description": description,
-            "category": category,
-            "turn": self.turn_count,
-            "timestamp": datetime.now().isoformat()
-        }
-        self.notes.append(note)
-        # Keep last 50 notes
-        if len(self.notes) > 50:
+        self.notes.append(Note(title, description, NoteCategory(category), self.turn_count))
+        # Keep last NOTES_SIZE notes
+        if len(self.notes) > NOTES_SIZE:
             self.notes.pop(0)
     
+    def add_history(self, entry: HistoryEntry):
+        """Record a finished turn in the game history"""
+        self.game_history.append(entry)
+        # A short list is far smaller than a deque, which allocates 64 slots at a time
+        if len(self.game_history) > GAME_HISTORY_SIZE:
+            self.game_history.pop(0)
+    
     def to_dict(self) -> Dict:
         """Convert to dictionary"""
         return {
@@ -349,18 +354,222 @@ class GameState:
             "pet": self.pet.to_dict() if self.pet else None,
             "location": self.location,
             "inventory": self.inventory,
-            "game_history": self.game_history[-10:],  # Last 10 events
-            "monsters": self.monsters,
+            "game_history": [entry.to_dict() for entry in self.game_history],  # Last GAME_HISTORY_SIZE turns
+            "monsters": [monster.to_dict() for monster in self.monsters],
             "turn_count": self.turn_count,
             "conversation_history": self.conversation_history[-5:],  # Last 5 narrative entries
             "current_npcs": self.current_npcs,
-            "notes": self.notes,
+            "notes": [note.to_dict() for note in self.notes],
             "allies": self.allies
         }
+    
+    def __setstate__(self, state: Dict):
+        # Sessions pickled before monsters, notes and history entries were records hold plain dicts
+        state["monsters"] = [Monster.from_dict(m) if isinstance(m, dict) else m for m in state["monsters"]]
+        state["notes"] = [Note.from_dict(n) if isinstance(n, dict) else n for n in state["notes"]]
+        state["game_history"] = [HistoryEntry.from_dict(e) if isinstance(e, dict) else e
+                                 for e in state["game_history"]]
+        self.__dict__.update(state)
+    
+    def commit(self) -> Dict:
+        """Snapshot the state after a turn, bumping the version if anything changed"""
+        with span("to_dict"):
+            state = self.to_dict()
+        changed = []
+        encoded = []
+        for path, value in _state_paths(state):
+            data = dumps(value)
+            checksum = blake2b(data, digest_size=8).digest()  # 64 bits: a collision would hide a change
+            if self._field_checksums.get(path) != checksum:
+                self._field_checksums[path] = checksum
+                changed.append(path)
+            if path in PREENCODED_FIELDS:
+                encoded.append((path, data))
+        if changed:
+            self.version += 1
+            for path in changed:
+                self.field_versions[path] = self.version
+        # The JSON just checksummed is reused by the turn's response (see encoded_state).
+        # The checksum is part of the key: two workers racing on a session can each commit a version
+        for path, data in encoded:
+            fragment_cache.put((self.state_id, path, self.field_versions[path], self._field_checksums[path]), data)
+        return state
+    
+    def delta_since(self, since_version: int, state_id: Optional[str],
+                    state: Dict) -> Optional[List[Dict]]:
+        """JSON-patch ops that bring a client's copy at since_version up to `state`
+        
+        `state` must be the dict returned by the latest commit(). Returns None
+        when the client's copy isn't from this game and needs the full state.
+        """
+        if state_id != self.state_id or not 0 <= since_version <= self.version:
+            return None
+        changed = {path for path, version in self.field_versions.items() if version > since_version}
+        ops = []
+        for path in sorted(changed):
+            if path.rsplit("/", 1)[0] in changed:
+                continue  # Whole parent object is already being replaced
+            value = state
+            for key in path.strip("/").split("/"):
+                value = value[key]
+            ops.append({"op": "replace", "path": path, "value": value})
+        return ops
+
+
+# Large state fields whose JSON, encoded by commit(), is spliced into responses as-is
+PREENCODED_FIELDS = frozenset(("/game_history", "/notes", "/conversation_history"))
+
+
+def encoded_state(game_state: GameState, state: Dict) -> Dict:
+    """The state dict from the latest commit(), with its large fields swapped for their encoded JSON"""
+    encoded = dict(state)
+    for path in PREENCODED_FIELDS:
+        fragment = fragment_cache.get((game_state.state_id, path, game_state.field_versions.get(path),
+                                       game_state._field_checksums.get(path)))
+        if fragment is not None:
+            encoded[path[1:]] = fragment
+    return encoded
+
+
+@lru_cache(maxsize=None)
+def _pointer(*keys: str) -> str:
+    """JSON pointer to a state field; one string shared by every session (the fields are fixed)"""
+    return "/" + "/".join(keys)
+
+
+def _state_paths(state: Dict):
+    """Yield (JSON pointer path, value) for each versioned part of a state dict"""
+    for key, value in state.items():
+        if isinstance(value, dict):
+            # Track the object's shape (so None -> object is seen) and each field separately
+            yield _pointer(key), tuple(value)
+            for sub_key, sub_value in value.items():
+                yield _pointer(key, sub_key), sub_value
+        else:
+            yield _pointer(key), value
+
+
+# Session storage: bounded in-memory cache, evicted sessions persisted to SQLite
+# (SESSION_STORE=shared keeps every session in SQLite, for several worker processes)
+session_store = create_session_store(in_use=lambda session_id: session_id in session_locks)
+WEB_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))  # Worker processes (uvicorn reads the same variable)
+if WEB_WORKERS > 1 and not isinstance(session_store, SharedSessionStore):
+    print(f"⚠️  {WEB_WORKERS} workers without SESSION_STORE=shared: each worker has its own sessions, "
+          f"so a turn that lands on another worker starts a new game")
+
+
+# Every finished turn is also appended to a per-session event log, with periodic snapshots
+event_log = create_event_log()
+
+
+def start_session(session_id: str, seed: Optional[int] = None) -> GameState:
+    """Start a new game in a session, beginning a fresh event log"""
+    game_state = GameState(seed=seed)
+    if event_log is not None:
+        event_log.start(session_id, {"type": "new_game", "seed": game_state.seed,
+                                     "timestamp": datetime.now().isoformat()})
+    session_store.put(session_id, game_state)
+    return game_state
+
+
+def load_session(session_id: str) -> Optional[GameState]:
+    """Get a session's game state, restoring it from the event log if the store lost it"""
+    game_state = session_store.get(session_id)
+    if game_state is None and event_log is not None and session_id in event_log:
+        game_state = restore_session(session_id)
+        if game_state is not None:
+            session_store.put(session_id, game_state)
+    return game_state
+
+
+def save_turn(session_id: str, game_state: GameState, event: Dict[str, Any]):
+    """Persist a finished turn: store the state, then append its event to the log (snapshotting when due)"""
+    # Stored first: a shared store rejects a turn that lost a race (VersionConflict), and it mustn't be logged
+    session_store.put(session_id, game_state)
+    if event_log is not None:
+        event = dict(event, turn=game_state.turn_count, timestamp=datetime.now().isoformat())
+        offset = event_log.append(session_id, event)
+        if event_log.snapshot_due(game_state.turn_count):
+            event_log.save_snapshot(session_id, game_state, game_state.turn_count, offset)
+    SESSION_HISTORY.observe(len(game_state.conversation_history))
+    SESSION_NOTES.observe(len(game_state.notes))
+
+
+def replay_event(event: Dict[str, Any], game_state: GameState):
+    """Re-run one logged turn through the rules, using its recorded narrative
+    
+    The session's seeded rng makes the rules draw the same dice as the first time.
+    """
+    if event["type"] == "action":
+        events, used_items = apply_action_rules(event["action"], game_state)
+        finish_action(event["action"], events, event["narrative"], used_items, game_state)
+    elif event["type"] == "dice":
+        events = apply_dice_rules(event["roll_type"], event.get("context"), game_state)
+        finish_dice_roll(event["roll_type"], events, event["narrative"], game_state)
+    elif event["type"] == "summary":
+        apply_summary(game_state, event["summary"], event["folded"])
+
+
+def restore_session(session_id: str, turn: Optional[int] = None) -> Optional[GameState]:
+    """Rebuild a session from its event log as of `turn` (default: the latest turn)
+    
+    Starts from the latest snapshot at or before `turn` and replays only the
+    events after it. Workers sharing a log can append finished turns out of
+    order, so events are replayed by turn number (a summary after its turn).
+    """
+    game_state, offset = event_log.load_snapshot(session_id, max_turn=turn) or (None, 0)
+    events = sorted(event_log.read(session_id, offset),
+                    key=lambda event: (event.get("turn", 0), event["type"] == "summary"))
+    for event in events:
+        if event["type"] == "new_game":
+            game_state = GameState(seed=event["seed"])
+        elif game_state is not None:
+            if turn is not None and game_state.turn_count >= turn:
+                break
+            replay_event(event, game_state)
+    return game_state
+
+
+# Turns within a session are serialized; blocking work runs on a bounded thread pool
+session_locks = SessionLocks()
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", str(min(32, (os.cpu_count() or 1) + 4))))
+worker_pool = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="game-worker")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run blocking game logic or storage I/O on the worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(worker_pool, partial(bind(func), *args, **kwargs))
+
+
+def rejected(error: SchedulerRejected) -> HTTPException:
+    """429/503 telling the client to back off and retry"""
+    return HTTPException(status_code=error.status_code, detail=str(error),
+                         headers={"Retry-After": str(error.retry_after)})
 
 
-# Global game state (in production, use database or session management)
-game_states: Dict[str, GameState] = {}
+def conflicted(error: VersionConflict) -> HTTPException:
+    """409 telling the client its turn raced another one on the same session"""
+    return HTTPException(status_code=409, detail=str(error))
+
+
+@asynccontextmanager
+async def narrative_slot():
+    """Hold an interactive slot for a whole turn on the provider the chain will start on
+
+    Taken before any rules run, so a rejected turn leaves the game untouched.
+    Failover and hedge calls take their own slots on the providers they use.
+    """
+    try:
+        provider = await narrative_chain.reserve(INTERACTIVE, LLM_QUEUE_TIMEOUT)
+    except SchedulerRejected as e:
+        raise rejected(e)
+    token = reserved_provider.set(provider)
+    try:
+        yield
+    finally:
+        reserved_provider.reset(token)
+        narrative_chain.release(provider)
 
 
 # ==================== API MODELS ====================
@@ -368,6 +577,8 @@ game_states: Dict[str, GameState] = {}
 class ActionRequest(BaseModel):
     action: str
     session_id: str = "default"
+    since_version: Optional[int] = None  # Client's state version: respond with a delta from it
+    state_id: Optional[str] = None  # Game the client's state version belongs to
 
 
 class GameStateResponse(BaseModel):
@@ -379,304 +590,243 @@ class GameStateResponse(BaseModel):
     turn_count: int
 
 
-# ==================== AI INTEGRATION ====================
-
-def get_dm_prompt() -> str:
-    """Get the Dungeon Master system prompt"""
-    return """You are a creative and immersive Dungeon Master for a D&D-style game. Your storytelling should be vivid, engaging, and full of personality.
-
-CRITICAL RULES:
-
-1. **Be Creative and Vivid** - Use rich descriptions, sensory details, and atmospheric storytelling. Make the world feel alive with:
-   - Vivid imagery (sights, sounds, smells, textures)
-   - Dynamic environments that react to the player
-   - Memorable NPCs and creatures with personality
-   - Atmospheric tension and mood
-   - Creative problem-solving opportunities
-
-2. **Treat player input as an action** - Every action must have immediate, meaningful results.
+# Response schemas below document the API; the routes using them return a
+# FastJSONResponse built from server-side state, so they aren't re-validated
 
-3. **Always provide consequences** - Every action must trigger at least ONE of:
-   - Discovery of something (item, clue, location feature, secret)
-   - Interaction with NPC, creature, or the player's pet/assistant
-   - Obstacle, trap, or hazard
-   - Environmental change or world-building detail
-   - Combat event or social encounter
+class TurnResponse(BaseModel):
+    narrative: str
+    events: List[Dict[str, Any]]
+    game_state: Optional[Dict[str, Any]] = None  # Full state, unless a delta was sent instead
+    game_state_delta: Optional[Dict[str, Any]] = None  # JSON-patch ops from the client's since_version
+    state_id: str
+    version: int
 
-4. **Include actionable next steps** - After describing the result, suggest 2-3 specific, interesting actions the player can take next.
 
-5. **Incorporate pets/assistants** - If the player has a pet or assistant, mention them naturally in the narrative. They can help, react, or provide commentary. Make them feel like part of the adventure.
+class NewGameResponse(BaseModel):
+    message: str
+    game_state: Dict[str, Any]
+    state_id: str
+    version: int
+    seed: int
 
-6. **Respond to game events creatively** - Incorporate dice rolls, combat results, and skill checks into your narrative in interesting ways. A low roll might be "Your sword glances off the goblin's shield with a metallic clang" while a high roll could be "Your blade finds a gap in the creature's armor with surgical precision."
 
-7. **Keep it engaging** - 3-5 sentences for the main description, plus 2-3 actionable options. Balance detail with pacing.
-
-8. **Format your response:**
-   - First: Vivid, creative description of the immediate result with sensory details
-   - Include: Pet/assistant reactions if applicable
-   - Then: Suggest 2-3 specific, interesting next actions
-   - Integrate: Game events (dice rolls, combat) naturally and creatively
-
-EXAMPLE GOOD RESPONSE (with continuity):
-"As you search along the cliff edge, your torch casts dancing shadows that reveal a narrow path hidden behind overgrown shrubs. The air grows cooler here, carrying the faint scent of damp earth and something metallic. Your companion [pet name] sniffs the air nervously, ears perked toward the darkness ahead. A faint draft and the distant sound of dripping water suggest a cave system beyond. You could approach the path carefully while your pet scouts ahead, inspect the shrubs for traps or hidden dangers, or call out to test the acoustics and see if anything responds from within."
-
-EXAMPLE GOOD RESPONSE (continuing conversation):
-"The goblin's yellow eyes widen slightly at your thanks, and he lets out a gruff chuckle. 'Polite one, aren't ya?' he grumbles, but his stance relaxes a bit. 'Most adventurers just swing first. What brings you to these parts?' He seems curious rather than immediately hostile. You could continue the conversation to learn more about the dungeon, offer to trade or share information, or cautiously ask about safe passage through the area."
-
-EXAMPLE BAD RESPONSE (ignoring context):
-"You are in a dark forest. The trees are tall." (This ignores previous conversation!)
+# ==================== AI INTEGRATION ====================
 
-CRITICAL: Always check the RECENT CONVERSATION/CONTEXT section. If the player is continuing an interaction with an NPC or creature mentioned there, respond as if that conversation is ongoing. Do NOT reset the scene or treat it as a new encounter.
+# Static system prompt is compiled once; turn prompts are packed under PROMPT_TOKEN_BUDGET
+prompt_builder = PromptBuilder()
 
-Remember: Be CREATIVE, VIVID, and ENGAGING. MAINTAIN CONTINUITY with previous interactions. Every action must have CONSEQUENCES and lead to NEW OPTIONS. Make the world feel alive and responsive."""
+# Turns of conversation history offered to the prompt (trimmed oldest-first to fit the budget)
+PROMPT_HISTORY_TURNS = int(os.getenv("PROMPT_HISTORY_TURNS", "3"))
 
 
-def generate_narrative(player_action: str, game_events: List[Dict], 
-                       game_state: GameState) -> str:
+def get_dm_prompt() -> str:
+    """Get the Dungeon Master system prompt (identical on every turn)"""
+    return prompt_builder.system_prompt
+
+
+def build_narrative_prompt(player_action: str, game_events: List[Dict],
+                           game_state: GameState) -> str:
+    """Build the per-turn user prompt sent alongside the DM system prompt"""
+    character = game_state.character
+    situation = [
+        f"- Location: {game_state.location}",
+        f"- HP: {character.current_hp}/{character.max_hp}",
+        f"- Level: {character.level}",
+    ]
+    
+    pet_info = []
+    if game_state.pet:
+        pet_info.append(f"- Companion: {game_state.pet.name} the {game_state.pet.type} (HP: {game_state.pet.current_hp}/{game_state.pet.max_hp}, Bond: {game_state.pet.bond}%, Abilities: {', '.join(game_state.pet.abilities)})")
+    
+    enemies = []
+    for m in game_state.monsters:
+        odds = attack_odds(character, m)
+        enemies.append(f"{m.name} (HP: {m.hp}, {odds['hit_chance']:.0%} to hit, ~{odds['expected_damage']:.1f} damage per attack)")
+    
+    history = game_state.conversation_history[-PROMPT_HISTORY_TURNS:] if PROMPT_HISTORY_TURNS else []
+    summary = [game_state.conversation_summary] if game_state.conversation_summary else []
+    
+    safe_context = []
+    if classify(player_action).safe_destination:
+        safe_context.append("⚠️ IMPORTANT: The player is traveling to a SAFE location (home/town/village). Do NOT generate hostile encounters, dangerous situations, or monsters. Describe a peaceful journey or safe arrival. This is a safe trip, not an adventure.")
+    
+    return prompt_builder.build([
+        PromptSection([f"PLAYER ACTION: {player_action}"]),
+        PromptSection([f"- {e.get('description', str(e))}" for e in game_events],
+                      header="GAME EVENTS (incorporate these creatively into your response):"),
+        PromptSection(situation, header="CURRENT SITUATION:"),
+        PromptSection([f"- Enemies: {', '.join(enemies)}"] if enemies else [], blank_before=False),
+        PromptSection(pet_info, priority=1, blank_before=False),
+        PromptSection([f"- Currently interacting with: {', '.join(game_state.current_npcs)}"] if game_state.current_npcs else [],
+                      priority=1, blank_before=False),
+        PromptSection([f"- Inventory: {', '.join(game_state.inventory) if game_state.inventory else 'Empty'}"],
+                      priority=2, blank_before=False),
+        PromptSection(summary, header="STORY SO FAR:", priority=2),
+        # Oldest conversation turns are the first thing dropped when over budget
+        PromptSection([f"{i}. {entry}" for i, entry in enumerate(history, 1)],
+                      header="RECENT CONVERSATION/CONTEXT (IMPORTANT - use this to maintain continuity):",
+                      priority=3, keep="last"),
+        PromptSection(safe_context),
+    ])
+
+
+def fallback_narrative(player_action: str, error: Exception) -> str:
+    """Narrative used when the AI provider fails"""
+    return f"You {player_action.lower()}. The world responds to your actions, though the details are unclear. (Error: {str(error)})"
+
+
+async def generate_narrative(player_action: str, game_events: List[Dict], 
+                             game_state: GameState) -> str:
     """Generate narrative from AI provider"""
     try:
-        events_text = "\n".join([f"- {e.get('description', str(e))}" for e in game_events])
-        
-        # Build rich context for AI
-        monsters_info = ""
-        if game_state.monsters:
-            monsters_info = "\n- Enemies: " + ", ".join([f"{m.get('name', 'Monster')} (HP: {m.get('hp', 0)})" for m in game_state.monsters])
-        
-        # Build conversation history context
-        conversation_context = ""
-        if game_state.conversation_history:
-            conversation_context = "\n\nRECENT CONVERSATION/CONTEXT (IMPORTANT - use this to maintain continuity):\n"
-            for i, entry in enumerate(game_state.conversation_history[-3:], 1):  # Last 3 entries
-                conversation_context += f"{i}. {entry}\n"
-        
-        npc_context = ""
-        if game_state.current_npcs:
-            npc_context = f"\n- Currently interacting with: {', '.join(game_state.current_npcs)}"
-        
-        pet_info = ""
-        if game_state.pet:
-            pet_info = f"\n- Companion: {game_state.pet.name} the {game_state.pet.type} (HP: {game_state.pet.current_hp}/{game_state.pet.max_hp}, Bond: {game_state.pet.bond}%, Abilities: {', '.join(game_state.pet.abilities)})"
-        
-        # Check if player is going to safe location
-        is_safe_journey = any(word in player_action.lower() for word in ["home", "hometown", "town", "village", "return", "back"])
-        safe_context = ""
-        if is_safe_journey:
-            safe_context = "\n\n⚠️ IMPORTANT: The player is traveling to a SAFE location (home/town/village). Do NOT generate hostile encounters, dangerous situations, or monsters. Describe a peaceful journey or safe arrival. This is a safe trip, not an adventure."
-        
-        context = f"""PLAYER ACTION: {player_action}
-
-GAME EVENTS (incorporate these creatively into your response):
-{events_text}
-
-CURRENT SITUATION:
-- Location: {game_state.location}
-- HP: {game_state.character.current_hp}/{game_state.character.max_hp}
-- Level: {game_state.character.level}
-- Inventory: {', '.join(game_state.inventory) if game_state.inventory else 'Empty'}{pet_info}{monsters_info}{npc_context}{conversation_context}{safe_context}
-
-CRITICAL: You MUST maintain continuity with the conversation history above. If the player is thanking or talking to an NPC/creature that was mentioned in recent context, respond as if that conversation is ongoing. Do NOT reset to the beginning or treat it as a new encounter.
-
-CRITICAL CONTEXT RULES:
-- If the player is going HOME, TOWN, or VILLAGE, they are traveling to a SAFE location. Do NOT generate hostile encounters or dangerous situations. Describe a peaceful journey or arrival at a safe place.
-- If the player is in a DANGEROUS area (dungeon, cave, forest, etc.), encounters are appropriate.
-- If the player is going to a SAFE location (home, town, village), describe the journey as safe and peaceful, or arriving at the destination.
-- MATCH THE SETTING: If the player is on a mountain, encounters should be mountain-appropriate. If in a graveyard, encounters should be undead-themed. If going home, it should be peaceful.
-- DICE ROLLS: If there are dice roll events in GAME EVENTS, WAIT for the dice result before describing the outcome. Reference the dice roll result in your narrative. For example: "You roll the dice... [wait for result]... With a roll of [X], you [succeed/fail]..." The dice roll determines what happens, so describe the outcome based on the roll result.
-
-INSTRUCTIONS:
-1. Be CREATIVE and VIVID - Use rich descriptions, sensory details, and atmospheric storytelling
-2. MAINTAIN CONTINUITY - Reference recent events and conversations. If the player is continuing a conversation, respond appropriately.
-3. RESPECT CONTEXT - If player is going to a safe location (home/town), describe a peaceful journey or safe arrival. Do NOT add hostile encounters.
-4. MATCH THE SETTING - Encounters and events must be appropriate for the current location and context.
-5. Describe the IMMEDIATE RESULT of the player's action with engaging detail
-6. If the player has a pet/companion, mention them naturally - they can help, react, or provide commentary
-7. Include any discoveries, obstacles, NPC reactions, or environmental changes (but only if contextually appropriate)
-8. End with 2-3 specific, interesting actionable options for what the player can do next
-9. Integrate the game events (dice rolls, combat) creatively into your narrative
-10. Keep it engaging (3-5 sentences + options) with vivid imagery and personality
-
-Remember: Be CREATIVE, make the world feel ALIVE, MAINTAIN CONTINUITY, RESPECT CONTEXT (safe places = safe journeys), and always provide CONSEQUENCES and next steps."""
-        
-        provider = AI_PROVIDER
-        
-        # OpenAI
-        if provider == "openai":
-            api_key = os.getenv("OPENAI_API_KEY") or openai.api_key
-            if not api_key:
-                raise ValueError("OPENAI_API_KEY not set. Check your .env file or environment variables.")
-            client = openai.OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4"),
-                messages=[
-                    {"role": "system", "content": get_dm_prompt()},
-                    {"role": "user", "content": context}
-                ],
-                temperature=0.8,
-                max_tokens=300
-            )
-            return response.choices[0].message.content.strip()
-        
-        # Groq (FREE - Very Fast!)
-        elif provider == "groq":
-            if not GROQ_API_KEY:
-                raise ValueError("GROQ_API_KEY not set")
-            try:
-                from groq import Groq
-                client = Groq(api_key=GROQ_API_KEY)
-                response = client.chat.completions.create(
-                    model="llama-3.1-70b-versatile",  # Free and fast!
-                    messages=[
-                        {"role": "system", "content": get_dm_prompt()},
-                        {"role": "user", "content": context}
-                    ],
-                    temperature=0.8,
-                    max_tokens=300
-                )
-                return response.choices[0].message.content.strip()
-            except ImportError:
-                raise ImportError("groq package not installed. Run: pip install groq")
-        
-        # Hugging Face (FREE)
-        elif provider == "huggingface":
-            if not HUGGINGFACE_API_KEY:
-                raise ValueError("HUGGINGFACE_API_KEY not set")
-            try:
-                import requests
-                model = os.getenv("HF_MODEL", "mistralai/Mistral-7B-Instruct-v0.2")
-                headers = {"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"}
-                payload = {
-                    "inputs": f"{get_dm_prompt()}\n\nUser: {context}\nAssistant:",
-                    "parameters": {"max_new_tokens": 300, "temperature": 0.8}
-                }
-                response = requests.post(
-                    f"https://api-inference.huggingface.co/models/{model}",
-                    headers=headers,
-                    json=payload,
-                    timeout=30
-                )
-                result = response.json()
-                if isinstance(result, list) and len(result) > 0:
-                    return result[0].get("generated_text", "").split("Assistant:")[-1].strip()
-                return result.get("generated_text", "").strip()
-            except Exception as e:
-                raise Exception(f"Hugging Face API error: {str(e)}")
-        
-        # Together AI (FREE tier available)
-        elif provider == "together":
-            if not TOGETHER_API_KEY:
-                raise ValueError("TOGETHER_API_KEY not set")
-            try:
-                import requests
-                headers = {
-                    "Authorization": f"Bearer {TOGETHER_API_KEY}",
-                    "Content-Type": "application/json"
-                }
-                payload = {
-                    "model": os.getenv("TOGETHER_MODEL", "mistralai/Mixtral-8x7B-Instruct-v0.1"),
-                    "messages": [
-                        {"role": "system", "content": get_dm_prompt()},
-                        {"role": "user", "content": context}
-                    ],
-                    "temperature": 0.8,
-                    "max_tokens": 300
-                }
-                response = requests.post(
-                    "https://api.together.xyz/v1/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=30
-                )
-                result = response.json()
-                return result["choices"][0]["message"]["content"].strip()
-            except Exception as e:
-                raise Exception(f"Together AI API error: {str(e)}")
-        
-        # Ollama (LOCAL - Completely FREE, no API key needed!)
-        elif provider == "ollama":
-            try:
-                import requests
-                model = os.getenv("OLLAMA_MODEL", "llama3.2")
-                payload = {
-                    "model": model,
-                    "messages": [
-                        {"role": "system", "content": get_dm_prompt()},
-                        {"role": "user", "content": context}
-                    ],
-                    "stream": False,
-                    "options": {"temperature": 0.8, "num_predict": 300}
-                }
-                response = requests.post(
-                    f"{OLLAMA_BASE_URL}/api/chat",
-                    json=payload,
-                    timeout=60
-                )
-                result = response.json()
-                return result["message"]["content"].strip()
-            except Exception as e:
-                raise Exception(f"Ollama error: {str(e)}. Make sure Ollama is running: ollama serve")
-        
-        # Fallback if provider not recognized
-        else:
-            raise ValueError(f"Unknown AI provider: {provider}. Use: openai, groq, ollama, huggingface, or together")
+        with span("prompt"):
+            context = build_narrative_prompt(player_action, game_events, game_state)
+        with span("llm"):
+            narrative = await narrative_chain.complete(get_dm_prompt(), context)
+        NARRATIVES.inc(mode="complete", fallback="false")
+        return narrative
     
     except Exception as e:
         # Fallback narrative if AI fails
-        return f"You {player_action.lower()}. The world responds to your actions, though the details are unclear. (Error: {str(e)})"
+        NARRATIVES.inc(mode="complete", fallback="true")
+        return fallback_narrative(player_action, e)
+
+
+async def stream_narrative(player_action: str, game_events: List[Dict],
+                           game_state: GameState) -> AsyncIterator[str]:
+    """Generate narrative from AI provider, yielding text as it arrives"""
+    sent_any = False
+    try:
+        with span("prompt"):
+            context = build_narrative_prompt(player_action, game_events, game_state)
+        with span("llm"):
+            async for chunk in narrative_chain.stream(get_dm_prompt(), context):
+                sent_any = True
+                yield chunk
+        NARRATIVES.inc(mode="stream", fallback="false")
+    
+    except Exception as e:
+        # Fallback narrative if AI fails before producing any text
+        NARRATIVES.inc(mode="stream", fallback="true")
+        if not sent_any:
+            yield fallback_narrative(player_action, e)
+
+
+# Background compaction: turns older than the last PROMPT_HISTORY_TURNS are folded
+# into the session's running summary by a (cheaper) summary model
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+SUMMARY_PROVIDER = os.getenv("SUMMARY_PROVIDER", AI_PROVIDER)
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL")  # None = the provider's default model
+SUMMARY_BATCH = int(os.getenv("SUMMARY_BATCH", "3"))  # Turns folded per summary update
+summary_tasks: Dict[str, asyncio.Task] = {}  # session_id -> running compaction
+
+
+def schedule_summary(session_id: str, game_state: GameState):
+    """Start folding old turns into the summary in the background (call while holding the session lock)"""
+    if not SUMMARY_ENABLED or session_id in summary_tasks:
+        return
+    old_turns = len(game_state.conversation_history) - PROMPT_HISTORY_TURNS
+    if old_turns < SUMMARY_BATCH:
+        return
+    task = asyncio.create_task(summarize_conversation(
+        session_id, game_state.state_id, game_state.conversation_summary,
+        game_state.conversation_history[:old_turns]
+    ))
+    summary_tasks[session_id] = task
+    task.add_done_callback(lambda _: summary_tasks.pop(session_id, None))
+
+
+async def summarize_conversation(session_id: str, state_id: str, summary: str, turns: List[str]):
+    """Merge `turns` into the session's summary without holding up its next turn"""
+    try:
+        provider = provider_registry.get(SUMMARY_PROVIDER, SUMMARY_MODEL)
+        # Background work: queued behind (and bumped by) interactive turns
+        async with llm_scheduler.slot(SUMMARY_PROVIDER, BACKGROUND, LLM_BACKGROUND_QUEUE_TIMEOUT):
+            new_summary = await provider.complete(SUMMARY_PROMPT, build_summary_prompt(summary, turns))
+    except Exception as e:
+        print(f"⚠️  Conversation summary failed: {e}")
+        return
+    
+    async with session_locks.hold(session_id):
+        game_state = await run_blocking(session_store.get, session_id)
+        # Turns taken meanwhile only append, so the folded turns are still first unless the game changed
+        if (game_state is None or game_state.state_id != state_id
+                or game_state.conversation_history[:len(turns)] != turns):
+            return
+        try:
+            await run_blocking(save_summary, session_id, game_state, new_summary.strip(), len(turns))
+        except VersionConflict:
+            pass  # Another worker took a turn meanwhile; a later turn schedules the summary again
+
+
+def apply_summary(game_state: GameState, summary: str, folded: int):
+    """Replace the summary and drop the turns it now covers"""
+    game_state.conversation_summary = summary
+    del game_state.conversation_history[:folded]
+    game_state.commit()  # So delta clients see the folded history
+
+
+def save_summary(session_id: str, game_state: GameState, summary: str, folded: int):
+    """Apply a summary update and persist it (logged, so replays reproduce it)"""
+    apply_summary(game_state, summary, folded)
+    session_store.put(session_id, game_state)
+    if event_log is not None:
+        event_log.append(session_id, {"type": "summary", "summary": summary, "folded": folded,
+                                      "turn": game_state.turn_count, "timestamp": datetime.now().isoformat()})
 
 
 # ==================== ACTION PROCESSOR ====================
 
-def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
-    """Process player action and apply rules"""
-    action_lower = action.lower()
+def apply_action_rules(action: str, game_state: GameState) -> Tuple[List[Dict], List[str]]:
+    """Apply the rule engine to a player action; returns (events, used_items)"""
+    with span("intent"):
+        intent = classify(action)
     events = []
-    narrative = ""
     
     # Check for item usage and remove from inventory
-    used_items = []
-    for item in game_state.inventory[:]:  # Copy list to avoid modification during iteration
-        item_lower = item.lower()
-        # Check if action mentions using, giving, offering, presenting, or consuming the item
-        if any(word in action_lower for word in ["use", "give", "offer", "present", "consume", "drink", "eat", "throw", "drop", "hand", "show"]):
-            if item_lower in action_lower:
-                used_items.append(item)
-                game_state.inventory.remove(item)
-                game_state.add_note("Item Used", f"Used {item} during an action", "Item")
-                events.append({
-                    "type": "item_used",
-                    "description": f"Used: {item}",
-                    "item": item
-                })
+    used_items = items_used(intent, game_state.inventory)
+    for item in used_items:
+        game_state.inventory.remove(item)
+        game_state.add_note("Item Used", f"Used {item} during an action", NoteCategory.ITEM)
+        events.append({
+            "type": "item_used",
+            "description": f"Used: {item}",
+            "item": item
+        })
     
     # Combat actions
-    if any(word in action_lower for word in ["attack", "strike", "hit", "fight", "combat"]):
+    if intent.name == "combat":
         if game_state.monsters:
             monster = game_state.monsters[0]
+            odds = attack_odds(game_state.character, monster)
             attack_result = RuleEngine.attack_roll(
                 game_state.character.level,
                 game_state.character.get_modifier("strength"),
-                monster.get("ac", 12)
+                monster.ac,
+                rng=game_state.rng
             )
             
             # Add attack roll event (will show dice animation)
             events.append({
                 "type": "combat",
-                "description": f"Attack roll: {attack_result['roll']} + {attack_result['modifier']} = {attack_result['total']} {'(CRITICAL!)' if attack_result['critical'] else ''}",
+                "description": f"Attack roll ({odds['hit_chance']:.0%} to hit): {attack_result['roll']} + {attack_result['modifier']} = {attack_result['total']} {'(CRITICAL!)' if attack_result['critical'] else ''}",
                 "roll": attack_result['roll'],
                 "modifier": attack_result['modifier'],
                 "total": attack_result['total'],
                 "hit": attack_result["hit"],
-                "critical": attack_result.get("critical", False)
+                "critical": attack_result.get("critical", False),
+                "hit_chance": odds["hit_chance"],
+                "expected_damage": odds["expected_damage"]
             })
             
             if attack_result["hit"]:
                 damage_result = RuleEngine.damage_roll(
                     1, 6, game_state.character.get_modifier("strength"),
-                    attack_result["critical"]
+                    attack_result["critical"], rng=game_state.rng
                 )
-                monster["hp"] = RuleEngine.calculate_hp(
-                    monster.get("max_hp", 20),
-                    monster["hp"],
+                monster.hp = RuleEngine.calculate_hp(
+                    monster.max_hp,
+                    monster.hp,
                     damage_result["total"]
                 )
                 
@@ -684,14 +834,13 @@ def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
                     "type": "damage",
                     "description": f"Damage roll: {damage_result['rolls']} + {damage_result['modifier']} = {damage_result['total']} damage",
                     "damage": damage_result["total"],
-                    "monster_hp": monster["hp"]
+                    "monster_hp": monster.hp
                 })
                 
-                if monster["hp"] <= 0:
-                    xp_gain = RuleEngine.calculate_xp(monster.get("cr", 1))
-                    game_state.character.add_xp(xp_gain)
-                    monster_name = monster.get("name", "Monster")
-                    game_state.add_note("Victory", f"Defeated {monster_name} and gained {xp_gain} XP", "Combat")
+                if monster.hp <= 0:
+                    xp_gain = RuleEngine.calculate_xp(monster.cr)
+                    game_state.character.add_xp(xp_gain, game_state.rng)
+                    game_state.add_note("Victory", f"Defeated {monster.name} and gained {xp_gain} XP", NoteCategory.COMBAT)
                     game_state.monsters.remove(monster)
                     events.append({
                         "type": "victory",
@@ -701,7 +850,7 @@ def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
             else:
                 events.append({
                     "type": "miss",
-                    "description": f"Attack missed! Needed {monster.get('ac', 12)} to hit"
+                    "description": f"Attack missed! Needed {monster.ac} to hit"
                 })
         else:
             events.append({
@@ -710,28 +859,32 @@ def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
             })
     
     # Skill checks - require manual dice roll
-    elif any(word in action_lower for word in ["climb", "jump", "acrobatics", "lockpick", "pick lock"]):
+    elif intent.name == "skill_dexterity":
+        success_chance = check_odds(game_state.character, "dexterity", 12)
         events.append({
             "type": "skill_check_pending",
-            "description": "Dexterity check required. Click 'Roll Dice' to attempt!",
+            "description": f"Dexterity check required ({success_chance:.0%} to succeed). Click 'Roll Dice' to attempt!",
             "ability": "dexterity",
             "dc": 12,
+            "success_chance": success_chance,
             "requires_dice": True
         })
     
-    elif any(word in action_lower for word in ["search", "investigate", "perception", "detect", "spot"]):
+    elif intent.name == "skill_wisdom":
+        success_chance = check_odds(game_state.character, "wisdom", 10)
         events.append({
             "type": "skill_check_pending",
-            "description": "Wisdom/Perception check required. Click 'Roll Dice' to attempt!",
+            "description": f"Wisdom/Perception check required ({success_chance:.0%} to succeed). Click 'Roll Dice' to attempt!",
             "ability": "wisdom",
             "dc": 10,
+            "success_chance": success_chance,
             "requires_dice": True
         })
     
     # Movement and location changes
-    elif any(word in action_lower for word in ["move", "go", "walk", "run", "travel", "head", "proceed", "north", "south", "east", "west", "home", "hometown", "town", "village", "return", "back"]):
+    elif intent.name == "movement":
         # Update location based on action
-        if any(word in action_lower for word in ["home", "hometown", "town", "village", "return", "back"]):
+        if intent.safe_destination:
             # Going to a safe location - no random encounters
             game_state.location = "Your hometown"
             events.append({
@@ -741,100 +894,74 @@ def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
             # Clear monsters when reaching safe location
             if game_state.monsters:
                 game_state.monsters = []
-        elif any(word in action_lower for word in ["north", "south", "east", "west"]):
-            # Directional movement
-            direction = next((word for word in ["north", "south", "east", "west"] if word in action_lower), "forward")
+        elif intent.direction:
+            # Directional movement - random encounters are possible away from safe places
+            direction = intent.direction
             game_state.location = f"Moving {direction} from {game_state.location}"
             events.append({
                 "type": "movement",
                 "description": f"You move {direction}"
             })
-            # Only random encounters in dangerous areas, not when going home
-            if "home" not in action_lower and "town" not in action_lower and "village" not in action_lower:
-                if random.random() < 0.2 and not game_state.monsters:
-                    # Roll dice to determine encounter outcome
-                    encounter_check = RuleEngine.skill_check(
-                        game_state.character.get_modifier("wisdom"),
-                        game_state.character.level // 4,
-                        12  # DC 12 to avoid or detect encounter
-                    )
+            if RuleEngine.chance(0.2, game_state.rng) and not game_state.monsters:
+                # Roll dice to determine encounter outcome
+                encounter_check = RuleEngine.skill_check(
+                    game_state.character.get_modifier("wisdom"),
+                    game_state.character.level // 4,
+                    12,  # DC 12 to avoid or detect encounter
+                    rng=game_state.rng
+                )
+                events.append({
+                    "type": "skill_check",
+                    "description": f"Perception check: {encounter_check['roll']} + {encounter_check['modifier']} = {encounter_check['total']} {'(Success - you avoid the encounter!)' if encounter_check['success'] else '(Failed - encounter occurs!)'}",
+                    "success": encounter_check["success"],
+                    "roll": encounter_check['roll'],
+                    "modifier": encounter_check['modifier'],
+                    "total": encounter_check['total']
+                })
+                    
+                # Only spawn monster if perception check failed
+                if not encounter_check["success"]:
+                    monster = RuleEngine.choice(MONSTER_TYPES, game_state.rng).copy()
+                    game_state.monsters.append(monster)
+                    game_state.add_note("Encounter", f"Met a {monster.name} while traveling", NoteCategory.COMBAT)
                     events.append({
-                        "type": "skill_check",
-                        "description": f"Perception check: {encounter_check['roll']} + {encounter_check['modifier']} = {encounter_check['total']} {'(Success - you avoid the encounter!)' if encounter_check['success'] else '(Failed - encounter occurs!)'}",
-                        "success": encounter_check["success"],
-                        "roll": encounter_check['roll'],
-                        "modifier": encounter_check['modifier'],
-                        "total": encounter_check['total']
+                        "type": "encounter",
+                        "description": f"Encountered: {monster.name}",
+                        "monster": monster.to_dict()
                     })
-                    
-                    # Only spawn monster if perception check failed
-                    if not encounter_check["success"]:
-                        monster_types = [
-                            {"name": "Goblin", "hp": 10, "max_hp": 10, "ac": 12, "cr": 0},
-                            {"name": "Orc", "hp": 15, "max_hp": 15, "ac": 13, "cr": 1},
-                            {"name": "Skeleton", "hp": 13, "max_hp": 13, "ac": 13, "cr": 0.25},
-                            {"name": "Wolf", "hp": 11, "max_hp": 11, "ac": 13, "cr": 0.25}
-                        ]
-                        monster = random.choice(monster_types)
-                        game_state.monsters.append(monster)
-                        game_state.add_note("Encounter", f"Met a {monster['name']} while traveling", "Combat")
-                        events.append({
-                            "type": "encounter",
-                            "description": f"Encountered: {monster['name']}",
-                            "monster": monster
-                        })
         else:
-            # General movement
+            # General movement - random encounters are possible away from safe places
             events.append({
                 "type": "movement",
                 "description": "You move forward"
             })
-            # Only random encounters if not going to safe places
-            if "home" not in action_lower and "town" not in action_lower and "village" not in action_lower:
-                if random.random() < 0.2 and not game_state.monsters:
-                    # Encounter occurs - player needs to roll dice
-                    monster_types = [
-                        {"name": "Goblin", "hp": 10, "max_hp": 10, "ac": 12, "cr": 0},
-                        {"name": "Orc", "hp": 15, "max_hp": 15, "ac": 13, "cr": 1},
-                        {"name": "Skeleton", "hp": 13, "max_hp": 13, "ac": 13, "cr": 0.25}
-                    ]
-                    monster = random.choice(monster_types)
-                    game_state.monsters.append(monster)
-                    game_state.add_note("Encounter", f"Met a {monster['name']} while traveling", "Combat")
-                    events.append({
-                        "type": "encounter",
-                        "description": f"Encountered: {monster['name']}! Click 'Roll Dice' to attempt to detect or avoid!",
-                        "monster": monster,
-                        "requires_dice": True
-                    })
+            if RuleEngine.chance(0.2, game_state.rng) and not game_state.monsters:
+                # Encounter occurs - player needs to roll dice
+                monster = RuleEngine.choice(MONSTER_TYPES[:3], game_state.rng).copy()  # Goblin, Orc or Skeleton
+                game_state.monsters.append(monster)
+                game_state.add_note("Encounter", f"Met a {monster.name} while traveling", NoteCategory.COMBAT)
+                events.append({
+                    "type": "encounter",
+                    "description": f"Encountered: {monster.name}! Click 'Roll Dice' to attempt to detect or avoid!",
+                    "monster": monster.to_dict(),
+                    "requires_dice": True
+                })
     
     # Training/Practice - improves ability scores (no dice roll, just improves)
-    elif any(word in action_lower for word in ["train", "practice", "exercise", "workout", "drill"]):
+    elif intent.name == "training":
         # Determine which ability to improve based on training focus
-        improved_ability = None
+        improved_ability = intent.ability
         
-        if any(word in action_lower for word in ["strength", "strength", "lift", "punch", "strike"]):
-            improved_ability = "strength"
-        elif any(word in action_lower for word in ["dexterity", "agility", "speed", "dodge", "acrobatics"]):
-            improved_ability = "dexterity"
-        elif any(word in action_lower for word in ["constitution", "endurance", "stamina", "health"]):
-            improved_ability = "constitution"
-        elif any(word in action_lower for word in ["intelligence", "study", "learn", "read", "knowledge"]):
-            improved_ability = "intelligence"
-        elif any(word in action_lower for word in ["wisdom", "perception", "awareness", "insight"]):
-            improved_ability = "wisdom"
-        elif any(word in action_lower for word in ["charisma", "social", "persuade", "charm"]):
-            improved_ability = "charisma"
-        else:
+        if improved_ability is None:
             # Default: improve physical abilities
             abilities = ["strength", "dexterity", "constitution"]
-            improved_ability = random.choice(abilities)
+            improved_ability = RuleEngine.choice(abilities, game_state.rng)
         
         # Apply improvement (always succeeds with training)
         current_score = getattr(game_state.character, improved_ability)
         if current_score < 20:  # Cap at 20
             setattr(game_state.character, improved_ability, current_score + 1)
-            game_state.add_note("Training", f"Improved {improved_ability.capitalize()} through training! ({current_score} → {current_score + 1})", "Event")
+            game_state.add_note("Training", f"Improved {improved_ability.capitalize()} through training! ({current_score} → {current_score + 1})")
             events.append({
                 "type": "training",
                 "description": f"Training successful! {improved_ability.capitalize()} increased by 1 ({current_score} → {current_score + 1})",
@@ -850,8 +977,8 @@ def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
             })
     
     # Rest/heal
-    elif any(word in action_lower for word in ["rest", "heal", "sleep"]):
-        heal_amount = RuleEngine.roll_d6(1) + game_state.character.level
+    elif intent.name == "rest":
+        heal_amount = RuleEngine.roll_d6(1, game_state.rng) + game_state.character.level
         old_hp = game_state.character.current_hp
         game_state.character.current_hp = min(
             game_state.character.max_hp,
@@ -864,12 +991,12 @@ def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
         })
     
     # Pet/Assistant actions
-    elif any(word in action_lower for word in ["pet", "companion", "assistant", "summon", "call pet", "tame"]):
+    elif intent.name == "pet":
         if not game_state.pet:
             # Summon/create a pet
-            game_state.pet = Pet()
+            game_state.pet = Pet(rng=game_state.rng)
             pet_note = f"Tamed {game_state.pet.name}, a {game_state.pet.type} with abilities: {', '.join(game_state.pet.abilities)}"
-            game_state.add_note("Pet Tamed", pet_note, "Companion")
+            game_state.add_note("Pet Tamed", pet_note, NoteCategory.COMPANION)
             events.append({
                 "type": "pet_summoned",
                 "description": f"A {game_state.pet.type} named {game_state.pet.name} appears and bonds with you!",
@@ -881,14 +1008,15 @@ def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
                 "description": f"You interact with {game_state.pet.name}. Bond: {game_state.pet.bond}%"
             })
     
-    elif any(word in action_lower for word in ["pet help", "pet scout", "pet track", "pet fetch"]):
+    elif intent.name == "pet_ability":
         if game_state.pet:
             # Pet uses an ability
-            ability = random.choice(game_state.pet.abilities)
+            ability = RuleEngine.choice(game_state.pet.abilities, game_state.rng)
             check = RuleEngine.skill_check(
                 game_state.pet.level + 2,  # Pet's skill level
                 0,
-                10
+                10,
+                rng=game_state.rng
             )
             if check["success"]:
                 game_state.pet.bond = min(100, game_state.pet.bond + 5)
@@ -918,253 +1046,554 @@ def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
             "description": f"Attempted: {action}"
         })
     
-    # Generate narrative from AI
-    narrative = generate_narrative(action, events, game_state)
-    
+    return events, used_items
+
+
+def finish_action(action: str, events: List[Dict], narrative: str,
+                  used_items: List[str], game_state: GameState) -> Dict[str, Any]:
+    """Apply narrative-driven state updates once the AI response is complete"""
     # Update conversation history for context continuity
     game_state.conversation_history.append(f"Player: {action} | Response: {narrative}")
     if len(game_state.conversation_history) > 10:  # Keep last 10 entries
         game_state.conversation_history.pop(0)
     
+    # One scan of the narrative finds item usage, NPC interactions and new allies
+    entities = extract_entities(narrative, game_state.inventory, game_state.current_npcs, game_state.allies)
+    
     # If items were used but not already tracked, check narrative for item usage
     if not used_items:
-        narrative_lower = narrative.lower()
-        for item in game_state.inventory[:]:
-            item_lower = item.lower()
-            # Check if narrative mentions the item being used/given/consumed
-            if any(word in narrative_lower for word in ["used", "gave", "offered", "presented", "consumed", "handed", "showed"]):
-                if item_lower in narrative_lower:
-                    # Check if it's actually being used (not just mentioned)
-                    item_context = narrative_lower[narrative_lower.find(item_lower):narrative_lower.find(item_lower)+len(item_lower)+50]
-                    if any(word in item_context for word in ["use", "give", "offer", "present", "hand", "show", "pull", "hold"]):
-                        used_items.append(item)
-                        game_state.inventory.remove(item)
-                        game_state.add_note("Item Used", f"Used {item} during an action", "Item")
+        for item in entities.used_items:
+            used_items.append(item)
+            game_state.inventory.remove(item)
+            game_state.add_note("Item Used", f"Used {item} during an action", NoteCategory.ITEM)
     
-    # Extract and track NPCs mentioned in narrative
-    # Simple extraction - look for common NPC indicators
-    npc_keywords = ["goblin", "orc", "merchant", "guard", "wizard", "dragon", "knight", "villager", "npc", "ally", "companion", "friend"]
-    mentioned_npcs = []
-    narrative_lower = narrative.lower()
-    for keyword in npc_keywords:
-        if keyword in narrative_lower and keyword not in [npc.lower() for npc in game_state.current_npcs]:
-            # Check if it's a current interaction (not just mentioned)
-            if any(word in narrative_lower for word in ["talks", "says", "responds", "replies", "conversation", "speaks", "thanks", "thank", "joins", "allies", "befriends"]):
-                mentioned_npcs.append(keyword.capitalize())
-                # Check if it's an ally (friendly NPC)
-                if any(word in narrative_lower for word in ["joins", "allies", "befriends", "friend", "companion", "helps"]):
-                    if keyword.capitalize() not in game_state.allies:
-                        game_state.allies.append(keyword.capitalize())
-                        game_state.add_note("New Ally", f"Met and befriended {keyword.capitalize()}", "Alliance")
+    # Track NPCs the player is interacting with, and any who became allies
+    for ally in entities.allies:
+        game_state.allies.append(ally)
+        game_state.add_note("New Ally", f"Met and befriended {ally}", NoteCategory.ALLIANCE)
     
-    if mentioned_npcs:
-        game_state.current_npcs = list(set(game_state.current_npcs + mentioned_npcs))
+    if entities.npcs:
+        game_state.current_npcs = list(set(game_state.current_npcs + entities.npcs))
     
     # Clear NPCs if player moves away or ends interaction
-    if any(word in action_lower for word in ["leave", "go", "move", "walk", "run", "flee", "exit"]):
+    if classify(action).leaving:
         game_state.current_npcs = []
     
     game_state.turn_count += 1
-    game_state.game_history.append({
-        "turn": game_state.turn_count,
-        "action": action,
-        "events": events,
+    game_state.add_history(HistoryEntry(game_state.turn_count, TurnType.ACTION, action, events, narrative))
+    
+    return {
         "narrative": narrative,
-        "timestamp": datetime.now().isoformat()
-    })
+        "events": events,
+        "game_state": game_state.commit()
+    }
+
+
+async def process_action(action: str, game_state: GameState) -> Dict[str, Any]:
+    """Process player action and apply rules"""
+    ACTION_INTENTS.inc(intent=classify(action).name)
+    with span("rules"):
+        events, used_items = await run_blocking(apply_action_rules, action, game_state)
+    narrative = await generate_narrative(action, events, game_state)
+    with span("postprocess"):
+        return await run_blocking(finish_action, action, events, narrative, used_items, game_state)
+
+
+def apply_dice_rules(roll_type: str, context: Optional[Dict],
+                     game_state: GameState) -> List[Dict]:
+    """Resolve a manual dice roll with the rule engine; returns the events"""
+    events = []
+    
+    if roll_type == "attack":
+        # Attack roll
+        if not game_state.monsters:
+            raise HTTPException(status_code=400, detail="No monsters to attack")
+        
+        monster = game_state.monsters[0]
+        odds = attack_odds(game_state.character, monster)
+        attack_result = RuleEngine.attack_roll(
+            game_state.character.level,
+            game_state.character.get_modifier("strength"),
+            monster.ac,
+            rng=game_state.rng
+        )
+        
+        events.append({
+            "type": "combat",
+            "description": f"Attack roll ({odds['hit_chance']:.0%} to hit): {attack_result['roll']} + {attack_result['modifier']} = {attack_result['total']} {'(CRITICAL!)' if attack_result['critical'] else ''}",
+            "roll": attack_result['roll'],
+            "modifier": attack_result['modifier'],
+            "total": attack_result['total'],
+            "hit": attack_result["hit"],
+            "critical": attack_result.get("critical", False),
+            "hit_chance": odds["hit_chance"],
+            "expected_damage": odds["expected_damage"]
+        })
+        
+        if attack_result["hit"]:
+            # Auto-roll damage
+            damage_result = RuleEngine.damage_roll(
+                1, 6, game_state.character.get_modifier("strength"),
+                attack_result["critical"], rng=game_state.rng
+            )
+            monster.hp = RuleEngine.calculate_hp(
+                monster.max_hp,
+                monster.hp,
+                damage_result["total"]
+            )
+            
+            events.append({
+                "type": "damage",
+                "description": f"Damage roll: {damage_result['rolls']} + {damage_result['modifier']} = {damage_result['total']} damage",
+                "damage": damage_result["total"],
+                "monster_hp": monster.hp
+            })
+            
+            if monster.hp <= 0:
+                xp_gain = RuleEngine.calculate_xp(monster.cr)
+                game_state.character.add_xp(xp_gain, game_state.rng)
+                game_state.add_note("Victory", f"Defeated {monster.name} and gained {xp_gain} XP", NoteCategory.COMBAT)
+                game_state.monsters.remove(monster)
+                events.append({
+                    "type": "victory",
+                    "description": f"Monster defeated! Gained {xp_gain} XP",
+                    "xp": xp_gain
+                })
+        else:
+            events.append({
+                "type": "miss",
+                "description": f"Attack missed! Needed {monster.ac} to hit"
+            })
+    
+    elif roll_type == "skill_check":
+        # Skill check
+        context = context or {}
+        ability = context.get("ability", "dexterity")
+        dc = context.get("dc", 10)
+        
+        check = RuleEngine.skill_check(
+            game_state.character.get_modifier(ability),
+            game_state.character.level // 4,
+            dc,
+            rng=game_state.rng
+        )
+        
+        events.append({
+            "type": "skill_check",
+            "description": f"{ability.capitalize()} check: {check['roll']} + {check['modifier']} = {check['total']} {'(Success!)' if check['success'] else '(Failed)'}",
+            "success": check["success"],
+            "roll": check['roll'],
+            "modifier": check['modifier'],
+            "total": check['total']
+        })
+    
+    elif roll_type == "encounter":
+        # Encounter detection/avoidance
+        if game_state.monsters:
+            encounter_check = RuleEngine.skill_check(
+                game_state.character.get_modifier("wisdom"),
+                game_state.character.level // 4,
+                12,  # DC 12 to avoid or detect encounter
+                rng=game_state.rng
+            )
+            
+            events.append({
+                "type": "skill_check",
+                "description": f"Perception check: {encounter_check['roll']} + {encounter_check['modifier']} = {encounter_check['total']} {'(Success - you avoid the encounter!)' if encounter_check['success'] else '(Failed - encounter occurs!)'}",
+                "success": encounter_check["success"],
+                "roll": encounter_check['roll'],
+                "modifier": encounter_check['modifier'],
+                "total": encounter_check['total']
+            })
+            
+            # If successful, remove the monster
+            if encounter_check["success"] and game_state.monsters:
+                game_state.monsters = []
+    
+    return events
+
+
+def finish_dice_roll(roll_type: str, events: List[Dict], narrative: str,
+                     game_state: GameState) -> Dict[str, Any]:
+    """Record a dice roll turn once its narrative is complete"""
+    game_state.turn_count += 1
+    game_state.add_history(HistoryEntry(game_state.turn_count, TurnType.DICE, sys.intern(roll_type),
+                                        events, narrative))
     
     return {
         "narrative": narrative,
         "events": events,
-        "game_state": game_state.to_dict()
+        "game_state": game_state.commit()
     }
 
 
+# ==================== METRICS ====================
+
+HTTP_REQUESTS = Counter("http_requests", "HTTP requests by route and status", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds",
+                         "Time until the response starts (streams keep running after)", ["method", "route"])
+NARRATIVES = Counter("narratives", "Narratives generated, by whether the fallback text was used",
+                     ["mode", "fallback"])
+ACTION_INTENTS = Counter("action_intents", "Player actions by classified intent", ["intent"])
+SESSION_HISTORY = Histogram("session_history_turns", "Conversation turns kept per session after a turn",
+                            buckets=SIZE_BUCKETS)
+SESSION_NOTES = Histogram("session_notes", "Journal notes per session after a turn", buckets=SIZE_BUCKETS)
+Gauge("sessions_active", "Sessions in the session store", collect=lambda: len(session_store))
+Counter("sessions_evicted", "Sessions pushed out of memory",
+        collect=lambda: getattr(session_store, "evicted_count", None))
+Counter("session_conflicts", "Turns rejected because another worker saved the session first",
+        collect=lambda: getattr(session_store, "conflict_count", None))
+Counter("llm_hedged_requests", "Slow LLM requests duplicated on the next provider",
+        collect=lambda: narrative_chain.hedged_count)
+Gauge("llm_circuit_open", "1 while a provider is being skipped after repeated failures", ["provider"],
+      collect=lambda: {(s["provider"],): int(s["state"] == "open") for s in narrative_chain.stats()})
+Gauge("llm_slots_active", "LLM requests in flight per provider", ["provider"],
+      collect=lambda: {(s["provider"],): s["active"] for s in llm_scheduler.stats()})
+Gauge("llm_slots_queued", "LLM requests waiting for a slot per provider", ["provider"],
+      collect=lambda: {(s["provider"],): s["queued"] for s in llm_scheduler.stats()})
+Counter("llm_slots_rejected", "LLM requests turned away (queue full or deadline passed)", ["provider", "reason"],
+        collect=lambda: {key: value for s in llm_scheduler.stats()
+                         for key, value in (((s["provider"], "busy"), s["rejected"]),
+                                            ((s["provider"], "timeout"), s["timed_out"]))})
+Counter("response_fragment_lookups", "Pre-encoded state fields found (or not) when encoding a turn response", ["result"],
+        collect=lambda: {("hit",): fragment_cache.hits, ("miss",): fragment_cache.misses})
+
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """Time the request's phases; reported in Server-Timing, and logged/profiled when picked"""
+    trace = start_trace(request.method, request.url.path, request.headers)
+    try:
+        response = await call_next(request)
+    except Exception:
+        finish_trace(trace, 500)
+        raise
+    route = request.scope.get("route")
+    if route is not None:
+        trace.route = route.path
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = trace.server_timing()
+    if trace.sampled or trace.profiles is not None:
+        response.headers["X-Trace-Id"] = trace.id
+    
+    # Streamed bodies keep running after the headers: finish the trace once the body is sent
+    body = response.body_iterator
+    
+    async def traced_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finish_trace(trace, response.status_code)
+    response.body_iterator = traced_body()
+    return response
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, so /api/game-state/{session_id} is one series
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUESTS.inc(method=request.method, route=path, status=str(status))
+        HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method, route=path)
+
+
+# Sticky-session hint for a load balancer in front of several nodes: responses name the node
+# in a header and a cookie, which the balancer can route on so a session stays on one node
+SESSION_NODE = os.getenv("SESSION_NODE", "")  # "" = no hint
+SESSION_AFFINITY_COOKIE = os.getenv("SESSION_AFFINITY_COOKIE", "dm_node")
+
+if SESSION_NODE:
+    @app.middleware("http")
+    async def session_affinity(request: Request, call_next):
+        response = await call_next(request)
+        response.headers["X-Session-Node"] = SESSION_NODE
+        if SESSION_AFFINITY_COOKIE and request.cookies.get(SESSION_AFFINITY_COOKIE) != SESSION_NODE:
+            response.set_cookie(SESSION_AFFINITY_COOKIE, SESSION_NODE, httponly=True, samesite="lax")
+        return response
+
+
 # ==================== API ROUTES ====================
 
+@app.on_event("startup")
+async def startup():
+    await provider_registry.start(AI_PROVIDERS, warmup=LLM_WARMUP)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in list(summary_tasks.values()):
+        task.cancel()
+    await provider_registry.aclose()
+    session_store.close()
+    worker_pool.shutdown(wait=False)
+
+
 @app.get("/")
 def root():
     return {"message": "AI Dungeon Master API"}
 
 
-@app.post("/api/action", response_model=Dict[str, Any])
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.post("/api/action", response_model=TurnResponse)
 async def process_player_action(request: ActionRequest):
     """Process a player action"""
     session_id = request.session_id
     
-    # Get or create game state
-    if session_id not in game_states:
-        game_states[session_id] = GameState()
+    async with session_locks.hold(session_id):
+        # Sessions are only created by /api/new-game, so stray requests can't pile up games
+        game_state = await run_blocking(load_session, session_id)
+        if game_state is None:
+            raise HTTPException(status_code=404, detail="Game session not found")
+        
+        async with narrative_slot():
+            try:
+                result = await process_action(request.action, game_state)
+                await run_blocking(save_turn, session_id, game_state,
+                                   {"type": "action", "action": request.action, "narrative": result["narrative"]})
+                schedule_summary(session_id, game_state)
+                return FastJSONResponse(with_state_version(result, game_state, request.since_version,
+                                                           request.state_id))
+            except VersionConflict as e:
+                raise conflicted(e)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+
+
+def with_state_version(result: Dict[str, Any], game_state: GameState,
+                       since_version: Optional[int], state_id: Optional[str]) -> Dict[str, Any]:
+    """Tag a turn result with the state version, swapping the full state for a delta when possible"""
+    ops = None
+    if since_version is not None:
+        ops = game_state.delta_since(since_version, state_id, result["game_state"])
+    if ops is not None:
+        result = {key: value for key, value in result.items() if key != "game_state"}
+        result["game_state_delta"] = {"base_version": since_version, "ops": ops}
+    else:
+        result = dict(result, game_state=encoded_state(game_state, result["game_state"]))
+    result["state_id"] = game_state.state_id
+    result["version"] = game_state.version
+    return result
+
+
+def state_etag(game_state: GameState) -> str:
+    """ETag identifying a game state version"""
+    return f'"{game_state.state_id}-{game_state.version}"'
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+
+def save_interrupted_turn(session_id: str, action: str, events: List[Dict], narrative: str,
+                          used_items: List[str], game_state: GameState):
+    """Finish and persist a streamed turn whose client disconnected, with the narrative sent so far"""
+    finish_action(action, events, narrative, used_items, game_state)
+    with suppress(VersionConflict):
+        save_turn(session_id, game_state, {"type": "action", "action": action, "narrative": narrative})
+
+
+@app.post("/api/action/stream")
+async def stream_player_action(request: ActionRequest):
+    """Process a player action, streaming the narrative as server-sent events
     
-    game_state = game_states[session_id]
+    Emits `events` (rule engine results) immediately, then one `token` event
+    per narrative chunk, then `done` with the same payload as /api/action.
+    """
+    session_id = request.session_id
     
+    # The session lock and the provider slot are held until the stream finishes
+    await session_locks.acquire(session_id)
+    try:
+        game_state = await run_blocking(load_session, session_id)
+        if game_state is None:
+            raise HTTPException(status_code=404, detail="Game session not found")
+        provider = await narrative_chain.reserve(INTERACTIVE, LLM_QUEUE_TIMEOUT)
+    except BaseException as e:
+        session_locks.release(session_id)
+        if isinstance(e, SchedulerRejected):
+            raise rejected(e)
+        raise
     try:
-        result = process_action(request.action, game_state)
-        return result
+        ACTION_INTENTS.inc(intent=classify(request.action).name)
+        with span("rules"):
+            events, used_items = await run_blocking(apply_action_rules, request.action, game_state)
     except Exception as e:
+        narrative_chain.release(provider)
+        session_locks.release(session_id)
         raise HTTPException(status_code=500, detail=str(e))
+    
+    async def event_stream():
+        chunks = []
+        reserved_provider.set(provider)  # The response runs in its own task: the chain sees the slot from here
+        try:
+            try:
+                yield sse_event("events", events)
+                async for chunk in stream_narrative(request.action, events, game_state):
+                    chunks.append(chunk)
+                    yield sse_event("token", {"text": chunk})
+            except (asyncio.CancelledError, GeneratorExit):
+                # Client went away mid-stream: still record the turn with what we have. Shielded,
+                # so a second cancellation can't stop it halfway through writing the turn
+                narrative = "".join(chunks).strip()
+                await asyncio.shield(run_blocking(save_interrupted_turn, session_id, request.action,
+                                                  events, narrative, used_items, game_state))
+                raise
+            narrative = "".join(chunks).strip()
+            with span("postprocess"):
+                result = await run_blocking(finish_action, request.action, events,
+                                            narrative, used_items, game_state)
+            try:
+                await run_blocking(save_turn, session_id, game_state,
+                                   {"type": "action", "action": request.action, "narrative": narrative})
+            except VersionConflict as e:
+                # Headers are long gone: report the conflict in the stream instead of a 409
+                yield sse_event("error", {"status": 409, "detail": str(e)})
+                return
+            schedule_summary(session_id, game_state)
+            yield sse_event("done", with_state_version(result, game_state, request.since_version, request.state_id))
+        finally:
+            narrative_chain.release(provider)
+            session_locks.release(session_id)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 class DiceRollRequest(BaseModel):
     session_id: str = "default"
     roll_type: str  # "attack", "skill_check", "encounter", "damage"
     context: Optional[Dict] = None  # Additional context (monster, ability, DC, etc.)
+    since_version: Optional[int] = None
+    state_id: Optional[str] = None
 
 
-@app.post("/api/roll-dice", response_model=Dict[str, Any])
+@app.post("/api/roll-dice", response_model=TurnResponse)
 async def roll_dice(request: DiceRollRequest):
     """Handle manual dice rolls"""
     session_id = request.session_id
     
-    if session_id not in game_states:
-        raise HTTPException(status_code=404, detail="Game session not found")
-    
-    game_state = game_states[session_id]
-    events = []
-    
-    try:
-        if request.roll_type == "attack":
-            # Attack roll
-            if not game_state.monsters:
-                raise HTTPException(status_code=400, detail="No monsters to attack")
-            
-            monster = game_state.monsters[0]
-            attack_result = RuleEngine.attack_roll(
-                game_state.character.level,
-                game_state.character.get_modifier("strength"),
-                monster.get("ac", 12)
-            )
-            
-            events.append({
-                "type": "combat",
-                "description": f"Attack roll: {attack_result['roll']} + {attack_result['modifier']} = {attack_result['total']} {'(CRITICAL!)' if attack_result['critical'] else ''}",
-                "roll": attack_result['roll'],
-                "modifier": attack_result['modifier'],
-                "total": attack_result['total'],
-                "hit": attack_result["hit"],
-                "critical": attack_result.get("critical", False)
-            })
-            
-            if attack_result["hit"]:
-                # Auto-roll damage
-                damage_result = RuleEngine.damage_roll(
-                    1, 6, game_state.character.get_modifier("strength"),
-                    attack_result["critical"]
-                )
-                monster["hp"] = RuleEngine.calculate_hp(
-                    monster.get("max_hp", 20),
-                    monster["hp"],
-                    damage_result["total"]
-                )
-                
-                events.append({
-                    "type": "damage",
-                    "description": f"Damage roll: {damage_result['rolls']} + {damage_result['modifier']} = {damage_result['total']} damage",
-                    "damage": damage_result["total"],
-                    "monster_hp": monster["hp"]
-                })
-                
-                if monster["hp"] <= 0:
-                    xp_gain = RuleEngine.calculate_xp(monster.get("cr", 1))
-                    game_state.character.add_xp(xp_gain)
-                    monster_name = monster.get("name", "Monster")
-                    game_state.add_note("Victory", f"Defeated {monster_name} and gained {xp_gain} XP", "Combat")
-                    game_state.monsters.remove(monster)
-                    events.append({
-                        "type": "victory",
-                        "description": f"Monster defeated! Gained {xp_gain} XP",
-                        "xp": xp_gain
-                    })
-            else:
-                events.append({
-                    "type": "miss",
-                    "description": f"Attack missed! Needed {monster.get('ac', 12)} to hit"
-                })
-        
-        elif request.roll_type == "skill_check":
-            # Skill check
-            context = request.context or {}
-            ability = context.get("ability", "dexterity")
-            dc = context.get("dc", 10)
-            
-            check = RuleEngine.skill_check(
-                game_state.character.get_modifier(ability),
-                game_state.character.level // 4,
-                dc
-            )
-            
-            events.append({
-                "type": "skill_check",
-                "description": f"{ability.capitalize()} check: {check['roll']} + {check['modifier']} = {check['total']} {'(Success!)' if check['success'] else '(Failed)'}",
-                "success": check["success"],
-                "roll": check['roll'],
-                "modifier": check['modifier'],
-                "total": check['total']
-            })
+    async with session_locks.hold(session_id):
+        game_state = await run_blocking(load_session, session_id)
+        if game_state is None:
+            raise HTTPException(status_code=404, detail="Game session not found")
         
-        elif request.roll_type == "encounter":
-            # Encounter detection/avoidance
-            if game_state.monsters:
-                encounter_check = RuleEngine.skill_check(
-                    game_state.character.get_modifier("wisdom"),
-                    game_state.character.level // 4,
-                    12  # DC 12 to avoid or detect encounter
-                )
+        async with narrative_slot():
+            try:
+                with span("rules"):
+                    events = await run_blocking(apply_dice_rules, request.roll_type, request.context, game_state)
                 
-                events.append({
-                    "type": "skill_check",
-                    "description": f"Perception check: {encounter_check['roll']} + {encounter_check['modifier']} = {encounter_check['total']} {'(Success - you avoid the encounter!)' if encounter_check['success'] else '(Failed - encounter occurs!)'}",
-                    "success": encounter_check["success"],
-                    "roll": encounter_check['roll'],
-                    "modifier": encounter_check['modifier'],
-                    "total": encounter_check['total']
-                })
+                # Generate narrative from AI
+                narrative = await generate_narrative("Dice roll result", events, game_state)
                 
-                # If successful, remove the monster
-                if encounter_check["success"] and game_state.monsters:
-                    game_state.monsters = []
-        
-        # Generate narrative from AI
-        narrative = generate_narrative("Dice roll result", events, game_state)
-        
-        # Update game state
-        game_state.turn_count += 1
-        game_state.game_history.append({
-            "turn": game_state.turn_count,
-            "action": f"Dice roll: {request.roll_type}",
-            "events": events,
-            "narrative": narrative,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        return {
-            "narrative": narrative,
-            "events": events,
-            "game_state": game_state.to_dict()
-        }
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+                # Update game state
+                with span("postprocess"):
+                    result = await run_blocking(finish_dice_roll, request.roll_type, events, narrative, game_state)
+                await run_blocking(save_turn, session_id, game_state,
+                                   {"type": "dice", "roll_type": request.roll_type,
+                                    "context": request.context, "narrative": narrative})
+                return FastJSONResponse(with_state_version(result, game_state, request.since_version,
+                                                           request.state_id))
+            
+            except HTTPException:
+                raise
+            except VersionConflict as e:
+                raise conflicted(e)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/game-state/{session_id}", response_model=GameStateResponse)
-async def get_game_state(session_id: str):
-    """Get current game state"""
-    if session_id not in game_states:
-        game_states[session_id] = GameState()
+async def get_game_state(session_id: str, if_none_match: Optional[str] = Header(None)):
+    """Get current game state (supports If-None-Match with the returned ETag)"""
+    state = await run_blocking(load_session, session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Game session not found")
     
-    state = game_states[session_id]
+    etag = state_etag(state)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    data = state.to_dict()
+    return FastJSONResponse({field: data[field] for field in GameStateResponse.model_fields}, headers={"ETag": etag})
+
+
+@app.post("/api/new-game/{session_id}", response_model=NewGameResponse)
+async def new_game(session_id: str, seed: Optional[int] = None):
+    """Start a new game (pass ?seed= to replay a previous game's dice exactly)"""
+    if seed is not None and seed < 0:
+        raise HTTPException(status_code=400, detail="Seed must be non-negative")
+    async with session_locks.hold(session_id):
+        game_state = await run_blocking(start_session, session_id, seed)
+        return FastJSONResponse({
+            "message": "New game started",
+            "game_state": game_state.to_dict(),
+            "state_id": game_state.state_id,
+            "version": game_state.version,
+            "seed": game_state.seed
+        })
+
+
+@app.get("/api/replay/{session_id}", response_model=GameStateResponse)
+async def replay_game_state(session_id: str, turn: int):
+    """Game state as it was right after a given turn, rebuilt from the event log"""
+    if event_log is None:
+        raise HTTPException(status_code=404, detail="Event log is disabled")
+    if session_id not in event_log:
+        raise HTTPException(status_code=404, detail="Game session not found")
+    # Replaying a session's log while it takes a turn would race on the log file
+    async with session_locks.hold(session_id):
+        state = await run_blocking(restore_session, session_id, turn)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Game session not found")
     return GameStateResponse(**state.to_dict())
 
 
-@app.post("/api/new-game/{session_id}")
-async def new_game(session_id: str):
-    """Start a new game"""
-    game_states[session_id] = GameState()
-    return {"message": "New game started", "game_state": game_states[session_id].to_dict()}
+class SimulateRequest(BaseModel):
+    levels: List[int] = [1]
+    monsters: List[str] = ["Goblin"]
+    trials: int = 10000
+    stats: Optional[Dict[str, int]] = None  # Character stat overrides, e.g. {"strength": 16}
+    seed: Optional[int] = None
+
+
+SIMULATE_MAX_COMBATS = int(os.getenv("SIMULATE_MAX_COMBATS", "2000000"))
+
+
+@app.post("/api/simulate")
+async def simulate(request: SimulateRequest):
+    """Monte Carlo encounter balance: win rate, rounds, HP lost and XP/min per level"""
+    from simulate import sweep
+    
+    if request.trials < 1 or not request.levels or not request.monsters:
+        raise HTTPException(status_code=400, detail="Need at least one level, monster and trial")
+    if request.trials * len(request.levels) > SIMULATE_MAX_COMBATS:
+        raise HTTPException(status_code=400, detail=f"At most {SIMULATE_MAX_COMBATS} combats per request")
+    try:
+        results = await run_blocking(sweep, request.levels, request.monsters, request.trials,
+                                     request.stats, request.seed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"results": results}
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Import by name so pickled sessions reference `app.GameState`, not `__main__.GameState`
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=WEB_WORKERS)
 
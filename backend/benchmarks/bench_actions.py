@@ -0,0 +1,60 @@
+"""
+AI Dungeon Master - Action pipeline benchmarks
+process_action through every intent branch, with the stub provider
+"""
+
+import pytest
+
+
+# One action per branch of apply_action_rules
+ACTIONS = {
+    "combat": "attack the goblin",
+    "skill_dexterity": "climb the wall",
+    "skill_wisdom": "search the room",
+    "movement": "go north",
+    "movement_home": "return to town",
+    "training": "train strength",
+    "rest": "rest by the fire",
+    "pet_summon": "summon a companion",
+    "pet_ability": "pet scout ahead",
+    "item": "use the torch",
+    "default": "say hello to the merchant",
+}
+
+
+def fresh_state(app_module, intent: str):
+    """A seeded game with whatever the branch needs (a monster to fight, a pet to command)"""
+    game_state = app_module.GameState(seed=1234)
+    game_state.monsters = [app_module.MONSTER_TYPES[1].copy()]
+    if intent == "pet_ability":
+        game_state.pet = app_module.Pet(rng=game_state.rng)
+    if "Torch" not in game_state.inventory:
+        game_state.inventory.append("Torch")
+    return game_state
+
+
+@pytest.mark.parametrize("intent", list(ACTIONS))
+def bench_process_action(benchmark, app_module, run, intent):
+    action = ACTIONS[intent]
+
+    def setup():
+        return (action, fresh_state(app_module, intent)), {}
+
+    benchmark.pedantic(lambda *args: run(app_module.process_action(*args)),
+                       setup=setup, rounds=200, warmup_rounds=10)
+
+
+@pytest.mark.parametrize("intent", ["combat", "movement", "default"])
+def bench_apply_action_rules(benchmark, app_module, intent):
+    action = ACTIONS[intent]
+
+    def setup():
+        return (action, fresh_state(app_module, intent)), {}
+
+    benchmark.pedantic(app_module.apply_action_rules, setup=setup, rounds=500, warmup_rounds=10)
+
+
+def bench_build_narrative_prompt(benchmark, app_module):
+    game_state = fresh_state(app_module, "combat")
+    events, _ = app_module.apply_action_rules(ACTIONS["combat"], game_state)
+    benchmark(app_module.build_narrative_prompt, ACTIONS["combat"], events, game_state)
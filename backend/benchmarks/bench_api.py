@@ -0,0 +1,52 @@
+"""
+AI Dungeon Master - Request path benchmarks
+Full FastAPI round trips through the in-process test client
+"""
+
+import itertools
+
+import pytest
+
+
+@pytest.fixture
+def session(client):
+    session_id = "bench"
+    client.post(f"/api/new-game/{session_id}?seed=7")
+    return session_id
+
+
+def bench_action_request(benchmark, client, session):
+    actions = itertools.cycle(["search the room", "go north", "rest", "say hello"])
+
+    def request():
+        response = client.post("/api/action", json={"action": next(actions), "session_id": session})
+        assert response.status_code == 200
+    benchmark(request)
+
+
+def bench_action_request_delta(benchmark, client, session):
+    state = client.get(f"/api/game-state/{session}")
+    version, state_id = state.json().get("version"), state.json().get("state_id")
+
+    def request():
+        response = client.post("/api/action", json={"action": "look around", "session_id": session,
+                                                    "since_version": version, "state_id": state_id})
+        assert response.status_code == 200
+    benchmark(request)
+
+
+def bench_game_state_request(benchmark, client, session):
+    benchmark(client.get, f"/api/game-state/{session}")
+
+
+def bench_game_state_not_modified(benchmark, client, session):
+    etag = client.get(f"/api/game-state/{session}").headers["etag"]
+
+    def request():
+        response = client.get(f"/api/game-state/{session}", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+    benchmark(request)
+
+
+def bench_new_game_request(benchmark, client):
+    benchmark(client.post, "/api/new-game/bench-new")
@@ -0,0 +1,62 @@
+"""
+AI Dungeon Master - RuleEngine benchmarks
+"""
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def bench_roll_d20(benchmark, app_module, rng):
+    benchmark(app_module.RuleEngine.roll_d20, rng)
+
+
+def bench_roll_dice_4d6(benchmark, app_module, rng):
+    benchmark(app_module.RuleEngine.roll_dice, 6, 4, rng)
+
+
+def bench_attack_roll(benchmark, app_module, rng):
+    benchmark(app_module.RuleEngine.attack_roll, 5, 3, 13, rng=rng)
+
+
+def bench_attack_roll_advantage(benchmark, app_module, rng):
+    benchmark(app_module.RuleEngine.attack_roll, 5, 3, 13, advantage=True, rng=rng)
+
+
+def bench_damage_roll_critical(benchmark, app_module, rng):
+    benchmark(app_module.RuleEngine.damage_roll, 2, 6, 3, critical=True, rng=rng)
+
+
+def bench_skill_check(benchmark, app_module, rng):
+    benchmark(app_module.RuleEngine.skill_check, 2, 2, 15, rng=rng)
+
+
+def bench_attack_roll_batch_10k(benchmark, app_module, rng):
+    levels = np.full(10_000, 5)
+    benchmark(app_module.RuleEngine.attack_roll_batch, levels, 3, 13, rng=rng)
+
+
+def bench_damage_roll_batch_10k(benchmark, app_module, rng):
+    critical = rng.random(10_000) < 0.05
+    benchmark(app_module.RuleEngine.damage_roll_batch, 1, 8, 3, critical=critical, rng=rng)
+
+
+def bench_hit_probability(benchmark, app_module):
+    benchmark(app_module.RuleEngine.hit_probability, 5, 3, 13)
+
+
+def bench_damage_distribution_uncached(benchmark, app_module):
+    rules = app_module.RuleEngine
+
+    def compute():
+        rules.damage_distribution.cache_clear()
+        return rules.damage_distribution(4, 6, 2, True)
+    benchmark(compute)
+
+
+def bench_calculate_xp(benchmark, app_module):
+    benchmark(app_module.RuleEngine.calculate_xp, 1)
@@ -0,0 +1,34 @@
+"""
+AI Dungeon Master - GameState benchmarks
+"""
+
+
+def played_state(app_module, turns: int = 20):
+    """A game a few turns in, so histories and notes aren't empty"""
+    game_state = app_module.GameState(seed=99)
+    for turn in range(turns):
+        action = ("search the room", "go north", "rest", "train dexterity")[turn % 4]
+        events, used_items = app_module.apply_action_rules(action, game_state)
+        app_module.finish_action(action, events, "You carry on.", used_items, game_state)
+    return game_state
+
+
+def bench_game_state_new(benchmark, app_module):
+    benchmark(app_module.GameState)
+
+
+def bench_game_state_new_seeded(benchmark, app_module):
+    benchmark(app_module.GameState, seed=42)
+
+
+def bench_to_dict(benchmark, app_module):
+    benchmark(played_state(app_module).to_dict)
+
+
+def bench_commit(benchmark, app_module):
+    benchmark(played_state(app_module).commit)
+
+
+def bench_serialize_state(benchmark, app_module):
+    from sessions import serialize_state
+    benchmark(serialize_state, played_state(app_module))
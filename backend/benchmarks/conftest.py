@@ -0,0 +1,46 @@
+"""
+AI Dungeon Master - Benchmark fixtures
+Runs the game fully offline: the stub provider answers instantly, and no
+event log, session spill file or trace log is written
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+os.environ.update(AI_PROVIDER="stub", AI_PROVIDERS="stub", SUMMARY_ENABLED="false", EVENT_LOG="false",
+                  SESSION_STORE="memory", SESSION_SPILL="false", TRACE_LOG="", LLM_WARMUP="false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as game  # noqa: E402
+from failover import FailoverChain  # noqa: E402
+from sessions import MemorySessionStore  # noqa: E402
+
+# A .env file is loaded with override=True, so pin the offline setup on the module too
+game.AI_PROVIDERS[:] = ["stub"]
+game.narrative_chain = FailoverChain(game.provider_registry, ["stub"])
+game.SUMMARY_ENABLED = False
+game.event_log = None
+game.session_store = MemorySessionStore()
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    return game
+
+
+@pytest.fixture(scope="session")
+def run():
+    """Run a coroutine to completion on a long-lived event loop"""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    with TestClient(game.app) as test_client:
+        yield test_client
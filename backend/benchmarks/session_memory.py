@@ -0,0 +1,81 @@
+"""
+AI Dungeon Master - Session memory benchmark
+Plays many sessions a few turns each, keeps them all in memory and reports
+the memory held per session (offline, with the benchmark suite's setup)
+
+Usage:
+    python benchmarks/session_memory.py --sessions 100000 --turns 20
+    python benchmarks/session_memory.py --sessions 2000 --top 15   # Largest allocation sites
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from conftest import game  # noqa: E402  (offline environment, stub provider)
+from metrics import resident_memory_bytes  # noqa: E402
+
+
+# Action cycle: encounters and fights, notes, training, a pet, NPCs and allies
+ACTIONS = ("go north", "attack the monster", "search the room", "train strength",
+           "summon a companion", "talk to the merchant", "rest", "walk east")
+NARRATIVE = ("You press on through the gloom. Met Aldric the blacksmith, who offers to help. "
+             "Torchlight flickers across the old stone walls.")
+
+
+def play(seed: int, turns: int) -> "game.GameState":
+    """A seeded session a number of turns in, with dice rolls while monsters are around"""
+    game_state = game.GameState(seed=seed)
+    for turn in range(turns):
+        action = ACTIONS[turn % len(ACTIONS)]
+        events, used_items = game.apply_action_rules(action, game_state)
+        game.finish_action(action, events, NARRATIVE, used_items, game_state)
+        if game_state.monsters:
+            events = game.apply_dice_rules("attack", None, game_state)
+            game.finish_dice_roll("attack", events, "Steel rings against bone.", game_state)
+    return game_state
+
+
+def measure(sessions: int, turns: int, top: int = 0):
+    """Resident memory growth per session; with `top`, traced allocations instead (slower)"""
+    play(0, turns)  # Warm up caches and free lists before the baseline
+    gc.collect()
+    if top:
+        tracemalloc.start()
+        baseline = tracemalloc.take_snapshot()
+    before = tracemalloc.get_traced_memory()[0] if top else resident_memory_bytes()
+    started = time.perf_counter()
+
+    gc.disable()  # Full collections over a growing heap would dominate the run time
+    store = {f"session-{i}": play(i, turns) for i in range(sessions)}
+    gc.enable()
+    gc.collect()
+    held = (tracemalloc.get_traced_memory()[0] if top else resident_memory_bytes()) - before
+    elapsed = time.perf_counter() - started
+    print(f"{len(store):,} sessions x {turns} turns in {elapsed:.1f}s")
+    print(f"{held / 2 ** 20:,.1f} MiB {'traced' if top else 'resident'}, {held / sessions:,.0f} bytes per session")
+
+    if top:
+        stats = tracemalloc.take_snapshot().compare_to(baseline, "lineno")
+        print(f"\nTop {top} allocation sites (bytes per session):")
+        for stat in stats[:top]:
+            print(f"{stat.size_diff / sessions:>10,.0f}  {stat.traceback}")
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory held per game session")
+    parser.add_argument("--sessions", type=int, default=100_000, help="Sessions kept in memory")
+    parser.add_argument("--turns", type=int, default=20, help="Turns played in each session")
+    parser.add_argument("--top", type=int, default=0, help="Trace allocations and list the N largest sites")
+    args = parser.parse_args()
+    measure(args.sessions, args.turns, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+AI Dungeon Master - Narrative Cassettes
+Prompts, responses and latencies recorded from a real provider, played back
+by the "replay" provider for offline, reproducible load tests
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "replay").lower()  # replay or record
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                        "cassettes", "narratives.jsonl"))
+CASSETTE_PROVIDER = os.getenv("CASSETTE_PROVIDER", "openai")  # Real provider recorded from
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", "1"))  # 0 = replay without delays
+
+# Used for unseen prompts until something has been recorded
+FALLBACK_SENTENCES = (
+    "The air grows still as you take in your surroundings.",
+    "Somewhere in the distance, something stirs.",
+    "Shadows shift at the edge of your torchlight.",
+    "You feel the weight of unseen eyes upon you.",
+    "A cold draft carries the scent of old stone and damp earth.",
+    "The path ahead forks, both ways swallowed by darkness.",
+)
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+ACTION_LINE = re.compile(r"^PLAYER ACTION: (.+)$", re.MULTILINE)
+
+
+class Recording(NamedTuple):
+    """One recorded (or synthesized) completion"""
+    response: str
+    latency: float  # Seconds until the whole response was received
+    first_chunk: Optional[float] = None  # Seconds until the first chunk, for streamed recordings
+    chunks: int = 1
+
+
+def prompt_key(system_prompt: str, user_prompt: str) -> str:
+    return hashlib.sha1(f"{system_prompt}\x00{user_prompt}".encode()).hexdigest()
+
+
+class Cassette:
+    """JSONL file of recordings keyed by prompt
+
+    Playback returns the recording for a prompt seen before. For a new prompt
+    it makes up a response from recorded sentences, with a latency drawn from
+    the recorded ones; the draw is seeded by the prompt, so runs repeat.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.recordings: Dict[str, Recording] = {}
+        self._timings: List[Recording] = []  # Every recording, for sampling timings
+        self._sentences: List[str] = []
+        self._sentence_counts: List[int] = []
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Torn final line from an interrupted recording
+                    self._add(entry["key"], Recording(entry["response"], entry["latency"],
+                                                      entry.get("first_chunk"), entry.get("chunks", 1)))
+
+    def __len__(self) -> int:
+        return len(self.recordings)
+
+    def _add(self, key: str, recording: Recording):
+        self.recordings[key] = recording
+        self._timings.append(recording)
+        sentences = [s for s in SENTENCE_END.split(recording.response.strip()) if s]
+        self._sentences.extend(sentences)
+        self._sentence_counts.append(len(sentences))
+
+    def record(self, key: str, prompt: str, recording: Recording, provider: str = "", model: str = ""):
+        """Store a real completion, in memory and on disk"""
+        entry = {"key": key, "prompt": prompt, "provider": provider, "model": model,
+                 "recorded_at": datetime.now().isoformat(), **recording._asdict()}
+        with self._lock:
+            self._add(key, recording)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def playback(self, key: str, prompt: str) -> Recording:
+        """The recording for this prompt, or a synthetic one"""
+        recording = self.recordings.get(key)
+        if recording is not None:
+            return recording
+        rng = np.random.default_rng(int(key[:16], 16))
+        sentences = self._sentences or FALLBACK_SENTENCES
+        count = int(rng.choice(self._sentence_counts)) if self._sentence_counts else 3
+        text = " ".join(rng.choice(sentences, size=max(count, 1)))
+        action = ACTION_LINE.search(prompt)
+        if action:
+            text = f"You {action.group(1).strip().rstrip('.').lower()}. {text}"
+        if not self._timings:
+            return Recording(text, 0.0)
+        timing = self._timings[rng.integers(len(self._timings))]
+        return Recording(text, timing.latency, timing.first_chunk, timing.chunks)
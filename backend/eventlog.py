@@ -0,0 +1,150 @@
+"""
+AI Dungeon Master - Event Log
+Append-only per-session turn log (JSONL) with periodic state snapshots, so a
+session can be restored from its latest snapshot plus the turns after it
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sessions import deserialize_state, serialize_state
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: appends are only serialized within one process
+
+
+class EventLog:
+    """Turn events and snapshots for every session, stored under one directory
+
+    Each session has `<name>.jsonl` (one JSON event per line, oldest first)
+    and a `<name>.snapshots/` directory with the pickled state after every
+    snapshot_every-th turn, each with the log offset just past that turn.
+    Every snapshot is kept, so rebuilding the state as of any turn replays
+    at most snapshot_every turns; they cost one pickled state (a few KB)
+    per snapshot_every turns played. Starting a new game truncates the log
+    and drops the snapshots.
+
+    Appends take an exclusive file lock (where the platform has fcntl), so
+    worker processes sharing the directory never interleave their lines.
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = 50, fsync: bool = False):
+        self.directory = directory
+        self.snapshot_every = snapshot_every  # 0 = never snapshot (restore replays everything)
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _base_path(self, session_id: str) -> str:
+        # Session ids come from clients: keep a readable prefix, but make the name safe and unique
+        safe = re.sub(r"[^A-Za-z0-9_-]", "_", session_id)[:40]
+        digest = hashlib.sha1(session_id.encode()).hexdigest()[:10]
+        return os.path.join(self.directory, f"{safe}-{digest}")
+
+    def _write(self, file, data: bytes):
+        file.write(data)
+        file.flush()
+        if self.fsync:
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def _lock_file(file):
+        """Hold an exclusive lock on an open file until it is closed (no-op without fcntl)"""
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+    def _snapshots(self, base: str) -> List[Tuple[int, str]]:
+        """(turn, path) of a session's snapshots, oldest first"""
+        directory = base + ".snapshots"
+        if not os.path.isdir(directory):
+            return []
+        return sorted((int(name[:-len(".snapshot")]), os.path.join(directory, name))
+                      for name in os.listdir(directory) if name.endswith(".snapshot"))
+
+    def start(self, session_id: str, event: Dict[str, Any]):
+        """Begin a fresh log (e.g. with a new_game event), discarding the old one"""
+        base = self._base_path(session_id)
+        with self._lock:
+            for _, path in self._snapshots(base):
+                os.remove(path)
+            with open(base + ".jsonl", "ab") as f:
+                self._lock_file(f)
+                f.truncate(0)
+                self._write(f, json.dumps(event).encode() + b"\n")
+
+    def append(self, session_id: str, event: Dict[str, Any]) -> int:
+        """Append one event; returns the log offset just past it"""
+        with self._lock:
+            with open(self._base_path(session_id) + ".jsonl", "ab") as f:
+                self._lock_file(f)
+                self._write(f, json.dumps(event).encode() + b"\n")
+                return f.tell()
+
+    def read(self, session_id: str, offset: int = 0) -> Iterator[Dict[str, Any]]:
+        """Yield the events from a log offset onwards"""
+        path = self._base_path(session_id) + ".jsonl"
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break  # Torn final line from an interrupted write
+
+    def snapshot_due(self, turn: int) -> bool:
+        return bool(self.snapshot_every) and turn > 0 and turn % self.snapshot_every == 0
+
+    def save_snapshot(self, session_id: str, state: Any, turn: int, offset: int):
+        """Store the state as of `turn`, whose event ends at log `offset`"""
+        directory = self._base_path(session_id) + ".snapshots"
+        path = os.path.join(directory, f"{turn:08d}.snapshot")
+        data = serialize_state({"turn": turn, "offset": offset, "state": serialize_state(state)})
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            # Write then rename, so a crash never leaves a half-written snapshot
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                self._write(f, data)
+            os.replace(temp_path, path)
+
+    def load_snapshot(self, session_id: str, max_turn: Optional[int] = None) -> Optional[Tuple[Any, int]]:
+        """Latest snapshot as (state, log offset), if one exists at or before max_turn"""
+        for turn, path in reversed(self._snapshots(self._base_path(session_id))):
+            if max_turn is None or turn <= max_turn:
+                with open(path, "rb") as f:
+                    snapshot = deserialize_state(f.read())
+                return deserialize_state(snapshot["state"]), snapshot["offset"]
+        return None
+
+    def __contains__(self, session_id: str) -> bool:
+        return os.path.exists(self._base_path(session_id) + ".jsonl")
+
+    def delete(self, session_id: str):
+        base = self._base_path(session_id)
+        with self._lock:
+            for _, path in self._snapshots(base):
+                os.remove(path)
+            if os.path.isdir(base + ".snapshots"):
+                os.rmdir(base + ".snapshots")
+            if os.path.exists(base + ".jsonl"):
+                os.remove(base + ".jsonl")
+
+
+def create_event_log() -> Optional[EventLog]:
+    """Create the event log configured by the EVENT_LOG* environment variables (None if disabled)"""
+    if os.getenv("EVENT_LOG", "true").lower() not in ("1", "true", "yes"):
+        return None
+    directory = os.getenv("EVENT_LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "eventlog"))
+    return EventLog(
+        directory,
+        snapshot_every=int(os.getenv("EVENT_LOG_SNAPSHOT_EVERY", "50")),
+        fsync=os.getenv("EVENT_LOG_FSYNC", "false").lower() in ("1", "true", "yes")
+    )
@@ -0,0 +1,161 @@
+"""
+AI Dungeon Master - Narrative Entity Extraction
+Finds inventory items, NPCs, allies and cue verbs in a generated narrative
+with one regex scan
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Set, Tuple
+
+
+# Creature/person words that mark an NPC the player may be interacting with
+NPC_KEYWORDS = ("goblin", "orc", "merchant", "guard", "wizard", "dragon", "knight",
+                "villager", "npc", "ally", "companion", "friend")
+
+# Cue words: tags say what each one signals. Stems also match longer forms
+# ("hold" matches "holding"); everything else must be a whole word.
+CUE_WORDS: Dict[str, Tuple[str, ...]] = {
+    # An item was used somewhere in the narrative
+    "used": ("item_used", "item_context"),
+    "gave": ("item_used",),
+    "offered": ("item_used", "item_context"),
+    "presented": ("item_used", "item_context"),
+    "consumed": ("item_used",),
+    "handed": ("item_used", "item_context"),
+    "showed": ("item_used", "item_context"),
+    # The item right before it is really being used (not just mentioned)
+    "use": ("item_context",),
+    "give": ("item_context",),
+    "offer": ("item_context",),
+    "present": ("item_context",),
+    "hand": ("item_context",),
+    "show": ("item_context",),
+    "pull": ("item_context",),
+    "hold": ("item_context",),
+    # The player is talking with someone
+    "talks": ("interaction",),
+    "says": ("interaction",),
+    "responds": ("interaction",),
+    "replies": ("interaction",),
+    "conversation": ("interaction",),
+    "speaks": ("interaction",),
+    "thanks": ("interaction",),
+    "thank": ("interaction",),
+    "joins": ("interaction", "friendly"),
+    "allies": ("interaction", "friendly"),
+    "befriends": ("interaction", "friendly"),
+    # Someone is friendly
+    "helps": ("friendly",),
+}
+CUE_STEMS = frozenset(["use", "give", "offer", "present", "hand", "show", "pull", "hold"])
+
+# How far past an item mention an item_context cue may appear
+ITEM_CONTEXT_WINDOW = 50
+
+
+class Mention(NamedTuple):
+    """One match in the scanned text"""
+    name: str  # Canonical name (original item casing, capitalized NPC keyword, or cue word)
+    tags: FrozenSet[str]
+    start: int
+    end: int
+
+
+class EntityMatcher:
+    """Compiled matcher over a fixed set of items, NPC names and ally names"""
+
+    def __init__(self, items: Iterable[str] = (), npcs: Iterable[str] = (),
+                 allies: Iterable[str] = ()):
+        terms: Dict[str, Set[str]] = {}
+        names: Dict[str, str] = {}
+
+        def add(term: str, name: str, *tags: str):
+            key = term.lower()
+            terms.setdefault(key, set()).update(tags)
+            names.setdefault(key, name)
+
+        for word, tags in CUE_WORDS.items():
+            add(word, word, *tags)
+        for keyword in NPC_KEYWORDS:
+            add(keyword, keyword.capitalize(), "npc")
+        for npc in npcs:
+            add(npc, npc, "npc", "known_npc")
+        for ally in allies:
+            add(ally, ally, "npc", "ally")
+        for item in items:
+            add(item, item, "item")
+        # Some cue words are also NPC keywords ("companion", "friend")
+        for word in ("friend", "companion"):
+            terms[word].add("friendly")
+
+        self._tags = {term: frozenset(tags) for term, tags in terms.items()}
+        self._names = names
+        alternation = "|".join(re.escape(t) for t in sorted(self._tags, key=len, reverse=True))
+        self._pattern = re.compile(r"\b(" + alternation + r")(\w*)")
+
+    def scan(self, text: str) -> List[Mention]:
+        """Return every known term in the text, in order, with its position"""
+        mentions = []
+        for match in self._pattern.finditer(text.lower()):
+            term, suffix = match.group(1), match.group(2)
+            tags = self._tags[term]
+            # Whole words only, except cue stems and plural NPC/item names
+            if suffix and term not in CUE_STEMS and not (suffix == "s" and "item" not in tags):
+                continue
+            mentions.append(Mention(self._names[term], tags, match.start(), match.end()))
+        return mentions
+
+
+@lru_cache(maxsize=1024)
+def _matcher_for(items: FrozenSet[str], npcs: FrozenSet[str],
+                 allies: FrozenSet[str]) -> EntityMatcher:
+    return EntityMatcher(items, npcs, allies)
+
+
+def matcher_for(items: Iterable[str], npcs: Iterable[str], allies: Iterable[str]) -> EntityMatcher:
+    """Get a matcher for these sets, only compiling a new one when they change"""
+    return _matcher_for(frozenset(items), frozenset(npcs), frozenset(allies))
+
+
+class NarrativeEntities(NamedTuple):
+    """Entities extracted from one narrative"""
+    used_items: List[str]  # Inventory items the narrative shows being used
+    npcs: List[str]  # NPC keywords the player is interacting with
+    allies: List[str]  # NPC keywords that befriended the player
+
+
+def extract_entities(narrative: str, inventory: List[str], current_npcs: List[str],
+                     allies: List[str]) -> NarrativeEntities:
+    """Scan a narrative once and work out item usage, NPC interactions and new allies"""
+    mentions = matcher_for(inventory, current_npcs, allies).scan(narrative)
+    tags_seen = set()
+    for mention in mentions:
+        tags_seen.update(mention.tags)
+
+    used_items = []
+    if "item_used" in tags_seen:
+        context_starts = [m.start for m in mentions if "item_context" in m.tags]
+        seen_items = set()
+        for mention in mentions:
+            if "item" not in mention.tags or mention.name in seen_items:
+                continue
+            seen_items.add(mention.name)  # Only the first mention of each item counts
+            window_end = mention.end + ITEM_CONTEXT_WINDOW
+            if any(mention.start <= start < window_end for start in context_starts):
+                used_items.append(mention.name)
+
+    npcs = []
+    new_allies = []
+    if "interaction" in tags_seen:
+        known = {npc.lower() for npc in current_npcs}
+        for mention in mentions:
+            if "npc" not in mention.tags or mention.name.lower() in known or mention.name in npcs:
+                continue
+            if mention.name.lower() not in NPC_KEYWORDS:
+                continue
+            npcs.append(mention.name)
+            if "friendly" in tags_seen and mention.name not in allies and mention.name not in new_allies:
+                new_allies.append(mention.name)
+
+    return NarrativeEntities(used_items, npcs, new_allies)
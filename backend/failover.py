@@ -0,0 +1,344 @@
+"""
+AI Dungeon Master - Provider Failover
+Ordered provider chain with per-provider circuit breakers, rolling latency
+percentiles and optional hedged requests
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metrics import Counter, Histogram
+from prompt import count_tokens
+from providers import NarrativeProvider, ProviderRegistry
+from scheduler import INTERACTIVE, LLM_QUEUE_TIMEOUT, LLMScheduler, SchedulerRejected
+
+
+AI_HEDGE = os.getenv("AI_HEDGE", "false").lower() in ("1", "true", "yes")
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "95"))
+AI_HEDGE_MIN_SAMPLES = int(os.getenv("AI_HEDGE_MIN_SAMPLES", "20"))  # Latencies needed before hedging
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "3"))  # Consecutive failures that open a breaker
+AI_BREAKER_RESET = float(os.getenv("AI_BREAKER_RESET", "30"))  # Seconds before an open breaker allows a retry
+LATENCY_WINDOW = 200  # Recent latencies kept per provider
+
+LLM_REQUESTS = Counter("llm_requests", "LLM calls by outcome (success, error, cancelled, rejected)",
+                       ["provider", "model", "outcome"])
+LLM_LATENCY = Histogram("llm_request_duration_seconds",
+                        "LLM call latency (to the full reply, or to the first chunk for streams)",
+                        ["provider", "model", "kind"])
+LLM_TOKENS = Counter("llm_tokens", "Prompt and completion tokens (estimated without tiktoken)",
+                     ["provider", "model", "direction"])
+
+
+# Provider whose scheduler slot the current turn already holds (see FailoverChain.reserve)
+reserved_provider: ContextVar[Optional[str]] = ContextVar("reserved_provider", default=None)
+
+
+class ProvidersUnavailable(Exception):
+    """Every provider in the chain failed or has its circuit open"""
+
+
+class CircuitBreaker:
+    """Stops sending requests to a provider after repeated failures
+
+    After `failure_threshold` consecutive failures the breaker opens and the
+    provider is skipped. Once `reset_timeout` seconds have passed, one trial
+    request is let through (half-open): success closes the breaker, failure
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = AI_BREAKER_FAILURES,
+                 reset_timeout: float = AI_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now (claims the trial slot when half-open)"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Give back a claimed trial slot without a verdict (e.g. a cancelled hedge)"""
+        self._trial_running = False
+
+
+class LatencyWindow:
+    """Rolling window of recent latencies, in seconds"""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """The p-th percentile, or None with no samples"""
+        if not self._samples:
+            return None
+        return float(np.percentile(self._samples, p))
+
+
+class FailoverChain:
+    """Calls providers in order of preference, skipping broken ones
+
+    Exposes the same complete/stream interface as a single provider. With
+    hedging on, a request still running after the provider's p95 latency
+    (time to first chunk, for streams) is duplicated on the next healthy
+    provider, and whichever answers first wins; the other is cancelled.
+
+    With a scheduler, every attempt holds a slot on its own provider (for a
+    stream, until the stream is closed), so failover and hedge calls count
+    against the provider that serves them.
+    """
+
+    def __init__(self, registry: ProviderRegistry, names: Sequence[str], hedge: bool = AI_HEDGE,
+                 hedge_percentile: float = AI_HEDGE_PERCENTILE,
+                 hedge_min_samples: int = AI_HEDGE_MIN_SAMPLES,
+                 scheduler: Optional[LLMScheduler] = None):
+        self.registry = registry
+        self.names = list(names)
+        self.scheduler = scheduler
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breakers = {name: CircuitBreaker() for name in self.names}
+        # (provider, "complete" or "first_chunk") -> latencies
+        self.latency: Dict[Tuple[str, str], LatencyWindow] = {
+            (name, metric): LatencyWindow() for name in self.names for metric in ("complete", "first_chunk")
+        }
+        self.hedged_count = 0
+
+    def hedge_delay(self, name: str, metric: str) -> Optional[float]:
+        """How long to wait on a provider before hedging (None = not enough data yet)"""
+        window = self.latency[(name, metric)]
+        if not self.hedge or len(window) < self.hedge_min_samples:
+            return None
+        return window.percentile(self.hedge_percentile)
+
+    async def reserve(self, priority: int = INTERACTIVE, timeout: Optional[float] = LLM_QUEUE_TIMEOUT) -> Optional[str]:
+        """Take a slot ahead of time on the provider a call would start on now
+
+        Lets a turn be rejected (SchedulerRejected) before any of its work is
+        done. Attempts made while `reserved_provider` is set to the returned
+        name use this slot instead of taking another; free it with release().
+        Returns None (nothing held) without a scheduler or with every breaker open.
+        """
+        if self.scheduler is None:
+            return None
+        for name in self.names:
+            if self.breakers[name].state != "open":
+                await self.scheduler.acquire(name, priority, timeout)
+                return name
+        return None
+
+    def release(self, name: Optional[str]):
+        """Free a slot taken by reserve()"""
+        self._free_slot(name, name is not None)
+
+    async def _take_slot(self, name: str) -> bool:
+        """Take a slot on a provider for one attempt, unless the turn already holds one there"""
+        if self.scheduler is None or reserved_provider.get() == name:
+            return False
+        await self.scheduler.acquire(name, INTERACTIVE, LLM_QUEUE_TIMEOUT)
+        return True
+
+    def _free_slot(self, name: str, taken: bool):
+        if taken:
+            self.scheduler.release(name)
+
+    async def _attempt(self, name: str, call: Callable[[NarrativeProvider], Awaitable[Any]],
+                       metric: str, hold: bool = False) -> Tuple[str, Any, bool]:
+        """Call one provider inside a scheduler slot for it
+
+        Returns (name, result, whether a slot is still held): with `hold`, the
+        slot outlives a successful attempt (for streams) and must be freed by
+        the caller with _free_slot.
+        """
+        breaker = self.breakers[name]
+        model = ""
+        taken = False
+        try:
+            # Looked up inside the try: if this raises, the breaker still gets a verdict
+            # (a half-open breaker would otherwise keep its trial slot claimed forever)
+            provider = self.registry.get(name)
+            model = self._model(name)
+            taken = await self._take_slot(name)
+            started = time.perf_counter()
+            result = await call(provider)
+        except asyncio.CancelledError:
+            self._free_slot(name, taken)
+            breaker.release()  # Lost a hedge race: not the provider's fault
+            LLM_REQUESTS.inc(provider=name, model=model, outcome="cancelled")
+            raise
+        except SchedulerRejected:
+            breaker.release()  # Saturated, not broken
+            LLM_REQUESTS.inc(provider=name, model=model, outcome="rejected")
+            raise
+        except Exception:
+            self._free_slot(name, taken)
+            breaker.record_failure()
+            LLM_REQUESTS.inc(provider=name, model=model, outcome="error")
+            raise
+        elapsed = time.perf_counter() - started
+        if not hold:
+            self._free_slot(name, taken)
+            taken = False
+        breaker.record_success()
+        self.latency[(name, metric)].add(elapsed)
+        LLM_LATENCY.observe(elapsed, provider=name, model=model, kind=metric)
+        if metric == "complete":
+            LLM_REQUESTS.inc(provider=name, model=model, outcome="success")
+        return name, result, taken
+
+    def _model(self, name: str) -> str:
+        return getattr(self.registry.get(name), "model", "") or ""
+
+    def _count_tokens(self, name: str, system_prompt: str, user_prompt: str, completion: str):
+        model = self._model(name)
+        LLM_TOKENS.inc(count_tokens(system_prompt) + count_tokens(user_prompt),
+                       provider=name, model=model, direction="prompt")
+        LLM_TOKENS.inc(count_tokens(completion), provider=name, model=model, direction="completion")
+
+    async def _run(self, call: Callable[[NarrativeProvider], Awaitable[Any]], metric: str,
+                   discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+                   hold: bool = False) -> Tuple[str, Any, bool]:
+        """Run `call` on the first healthy provider, failing over (and hedging) as needed
+
+        Returns the winning _attempt's (name, result, slot held); `discard`
+        gets the whole tuple of any other attempt that also succeeded.
+        """
+        candidates = iter(self.names)
+        pending: Dict[asyncio.Task, str] = {}
+        errors = []
+        exhausted = False
+
+        def launch() -> bool:
+            # Breakers are only asked when a provider is actually about to be used,
+            # so a half-open breaker's single trial slot isn't claimed for nothing
+            for name in candidates:
+                if self.breakers[name].allow():
+                    pending[asyncio.create_task(self._attempt(name, call, metric, hold))] = name
+                    return True
+            return False
+
+        if not launch():
+            raise ProvidersUnavailable("All AI providers are unavailable (circuit open)")
+        winner = None
+        try:
+            while pending and winner is None:
+                timeout = None
+                if len(pending) == 1 and not exhausted:
+                    timeout = self.hedge_delay(next(iter(pending.values())), metric)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Slower than its usual p95: race the next healthy provider
+                    if launch():
+                        self.hedged_count += 1
+                    else:
+                        exhausted = True
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is not None:
+                        errors.append(f"{name}: {task.exception()}")
+                    elif winner is None:
+                        winner = task.result()
+                    elif discard is not None:
+                        await discard(task.result())  # Both finished at once: drop the extra
+                if winner is None and not pending and not launch():
+                    break  # Nothing left to fail over to
+        finally:
+            for task in pending:
+                # A task that finished while we were busy can't be cancelled: drop its result instead
+                if not task.cancel() and not task.cancelled() and task.exception() is None and discard is not None:
+                    await discard(task.result())
+        if winner is None:
+            raise ProvidersUnavailable("All AI providers failed: " + "; ".join(errors))
+        return winner
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        name, text, _ = await self._run(lambda provider: provider.complete(system_prompt, user_prompt), "complete")
+        self._count_tokens(name, system_prompt, user_prompt, text)
+        return text
+
+    async def stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """Stream from the first provider to produce a chunk; fails over only before any text is sent"""
+        async def first_chunk(provider: NarrativeProvider):
+            chunks = provider.stream(system_prompt, user_prompt).__aiter__()
+            try:
+                return chunks, await chunks.__anext__()
+            except StopAsyncIteration:
+                return chunks, ""
+            except asyncio.CancelledError:
+                await chunks.aclose()  # Lost a hedge race before its first chunk
+                raise
+
+        async def close(attempt):
+            name, (chunks, _), held = attempt
+            await chunks.aclose()
+            self._free_slot(name, held)
+
+        name, (chunks, chunk), held = await self._run(first_chunk, "first_chunk", discard=close, hold=True)
+        text = [chunk]
+        try:
+            if chunk:
+                yield chunk
+            async for chunk in chunks:
+                text.append(chunk)
+                yield chunk
+        except Exception:
+            self.breakers[name].record_failure()
+            LLM_REQUESTS.inc(provider=name, model=self._model(name), outcome="error")
+            raise
+        finally:
+            await chunks.aclose()
+            self._free_slot(name, held)
+        LLM_REQUESTS.inc(provider=name, model=self._model(name), outcome="success")
+        self._count_tokens(name, system_prompt, user_prompt, "".join(text))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Breaker state and latency percentiles per provider"""
+        return [{
+            "provider": name,
+            "state": self.breakers[name].state,
+            "failures": self.breakers[name].failures,
+            "p50": self.latency[(name, "complete")].percentile(50),
+            "p95": self.latency[(name, "complete")].percentile(95),
+            "first_chunk_p50": self.latency[(name, "first_chunk")].percentile(50),
+            "first_chunk_p95": self.latency[(name, "first_chunk")].percentile(95),
+        } for name in self.names]
@@ -0,0 +1,250 @@
+"""
+AI Dungeon Master - Intent Classifier
+Maps a free-text player action to a rule engine intent in a single regex pass
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+
+# Intents in priority order: when an action matches several, the first wins
+INTENT_PRIORITY: Tuple[str, ...] = (
+    "combat",
+    "skill_dexterity",
+    "skill_wisdom",
+    "movement",
+    "training",
+    "rest",
+    "pet_ability",
+    "pet",
+)
+
+DIRECTIONS = ("north", "south", "east", "west")
+
+# Training focus, checked in this order when several abilities are mentioned
+ABILITIES = ("strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma")
+
+# Vocabulary: keyword -> tags. Intent tags use INTENT_PRIORITY names; the rest are
+# arguments (direction:*, ability:*) or flags (item_use, safe_destination, leaving).
+VOCABULARY: Dict[str, Tuple[str, ...]] = {
+    # Combat
+    "attack": ("combat",),
+    "strike": ("combat", "ability:strength"),
+    "hit": ("combat",),
+    "fight": ("combat",),
+    "combat": ("combat",),
+    # Skill checks
+    "climb": ("skill_dexterity",),
+    "jump": ("skill_dexterity",),
+    "acrobatics": ("skill_dexterity", "ability:dexterity"),
+    "lockpick": ("skill_dexterity",),
+    "pick lock": ("skill_dexterity",),
+    "search": ("skill_wisdom",),
+    "investigate": ("skill_wisdom",),
+    "perception": ("skill_wisdom", "ability:wisdom"),
+    "detect": ("skill_wisdom",),
+    "spot": ("skill_wisdom",),
+    # Movement
+    "move": ("movement", "leaving"),
+    "go": ("movement", "leaving"),
+    "walk": ("movement", "leaving"),
+    "run": ("movement", "leaving"),
+    "travel": ("movement",),
+    "head": ("movement",),
+    "proceed": ("movement",),
+    "north": ("movement", "direction:north"),
+    "south": ("movement", "direction:south"),
+    "east": ("movement", "direction:east"),
+    "west": ("movement", "direction:west"),
+    "home": ("movement", "safe_destination"),
+    "hometown": ("movement", "safe_destination"),
+    "town": ("movement", "safe_destination"),
+    "village": ("movement", "safe_destination"),
+    "return": ("movement", "safe_destination"),
+    "back": ("movement", "safe_destination"),
+    "leave": ("leaving",),
+    "flee": ("leaving",),
+    "exit": ("leaving",),
+    # Training
+    "train": ("training",),
+    "practice": ("training",),
+    "exercise": ("training",),
+    "workout": ("training",),
+    "drill": ("training",),
+    "strength": ("ability:strength",),
+    "lift": ("ability:strength",),
+    "punch": ("ability:strength",),
+    "dexterity": ("ability:dexterity",),
+    "agility": ("ability:dexterity",),
+    "speed": ("ability:dexterity",),
+    "dodge": ("ability:dexterity",),
+    "constitution": ("ability:constitution",),
+    "endurance": ("ability:constitution",),
+    "stamina": ("ability:constitution",),
+    "health": ("ability:constitution",),
+    "intelligence": ("ability:intelligence",),
+    "study": ("ability:intelligence",),
+    "learn": ("ability:intelligence",),
+    "read": ("ability:intelligence",),
+    "knowledge": ("ability:intelligence",),
+    "wisdom": ("ability:wisdom",),
+    "awareness": ("ability:wisdom",),
+    "insight": ("ability:wisdom",),
+    "charisma": ("ability:charisma",),
+    "social": ("ability:charisma",),
+    "persuade": ("ability:charisma",),
+    "charm": ("ability:charisma",),
+    # Rest
+    "rest": ("rest",),
+    "heal": ("rest",),
+    "sleep": ("rest",),
+    # Pet/Assistant
+    "pet": ("pet",),
+    "companion": ("pet",),
+    "assistant": ("pet",),
+    "summon": ("pet",),
+    "call pet": ("pet",),
+    "tame": ("pet",),
+    "pet help": ("pet_ability",),
+    "pet scout": ("pet_ability",),
+    "pet track": ("pet_ability",),
+    "pet fetch": ("pet_ability",),
+    # Item usage
+    "use": ("item_use",),
+    "give": ("item_use",),
+    "offer": ("item_use",),
+    "present": ("item_use",),
+    "consume": ("item_use",),
+    "drink": ("item_use",),
+    "eat": ("item_use",),
+    "throw": ("item_use",),
+    "drop": ("item_use",),
+    "hand": ("item_use",),
+    "show": ("item_use",),
+}
+
+_VOWELS = "aeiou"
+
+
+def _inflections(word: str) -> Tuple[str, ...]:
+    """A word plus its regular -s, -ed and -ing forms ("move" -> "moves", "moved", "moving")"""
+    forms = [word]
+    if word.endswith(("s", "x", "z", "ch", "sh")):
+        forms.append(word + "es")
+    elif word.endswith("y") and word[-2:-1] not in _VOWELS:
+        forms.append(word[:-1] + "ies")
+    else:
+        forms.append(word + "s")
+    if word.endswith("e"):
+        forms += [word + "d", word[:-1] + "ing"]  # Dropped "e": "practicing"
+    elif word.endswith("y") and word[-2:-1] not in _VOWELS:
+        forms += [word[:-1] + "ied", word + "ing"]
+    else:
+        forms += [word + "ed", word + "ing"]
+        if (len(word) >= 3 and word[-1] not in _VOWELS + "wxy" and word[-2] in _VOWELS
+                and word[-3] not in _VOWELS):
+            # Doubled final consonant: "hitting", "dropped" (only some words double, the rest never occur)
+            forms += [word + word[-1] + "ed", word + word[-1] + "ing"]
+    return tuple(forms)
+
+
+# Every form of every keyword -> the keyword. Multi-word keywords inflect their last word
+# ("pet helping"); a form that is itself a keyword keeps its own meaning.
+_FORMS: Dict[str, str] = {}
+for _keyword in VOCABULARY:
+    _head, _, _last = _keyword.rpartition(" ")
+    for _form in _inflections(_last):
+        _FORMS.setdefault(f"{_head} {_form}" if _head else _form, _keyword)
+for _keyword in VOCABULARY:
+    _FORMS[_keyword] = _keyword
+
+# Whole words only (so "go" doesn't match "goblin"). Longest forms first so "pet help"
+# wins over "pet" at the same position.
+_KEYWORD_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(form) for form in sorted(_FORMS, key=len, reverse=True)) + r")\b"
+)
+
+# Object of an item-use verb: up to a preposition or the end of the clause ("throw the dagger at ...")
+_OBJECT_START = re.compile(r"^(?:over|up|out|away|down)\b\s*")
+_OBJECT_END = re.compile(r"\s+(?:to|at|on|onto|into|in|with|for|from|toward|towards|against|and|then)\b|[.,;:!?]")
+# Determiners and pronouns start a new noun phrase: "give [the merchant] [my torch]"
+_NOUN_PHRASE_BREAK = re.compile(
+    r"\b(?:the|a|an|my|your|his|her|their|our|its|some|this|that|these|those|him|them|me|us|it)\b"
+)
+
+
+def _object_phrase(text: str) -> Optional[str]:
+    """The thing acted on in the text after an item-use verb
+
+    With two noun phrases ("give the merchant my torch"), the second is the
+    item handed over; a lone pronoun ("drop it") names no item.
+    """
+    text = _OBJECT_START.sub("", text.strip())
+    end = _OBJECT_END.search(text)
+    if end is not None:
+        text = text[:end.start()]
+    phrases = [phrase.strip() for phrase in _NOUN_PHRASE_BREAK.split(text)]
+    return next((phrase for phrase in reversed(phrases) if phrase), None)
+
+
+class Intent(NamedTuple):
+    """Classified player action"""
+    name: str  # One of INTENT_PRIORITY, or "action" when nothing matched
+    direction: Optional[str] = None
+    ability: Optional[str] = None
+    item: Optional[str] = None  # Object of an item-use verb ("drink the potion" -> "potion")
+    item_text: Optional[str] = None  # Everything after the first item-use verb
+    safe_destination: bool = False
+    leaving: bool = False
+
+
+@lru_cache(maxsize=4096)
+def classify(action: str) -> Intent:
+    """Classify an action in a single scan over its text"""
+    text = action.lower()
+    tags = set()
+    direction = None
+    ability_rank = None
+    item = item_text = None
+    for match in _KEYWORD_PATTERN.finditer(text):
+        for tag in VOCABULARY[_FORMS[match.group(1)]]:
+            if tag.startswith("direction:"):
+                direction = direction or tag[len("direction:"):]
+            elif tag.startswith("ability:"):
+                rank = ABILITIES.index(tag[len("ability:"):])
+                ability_rank = rank if ability_rank is None else min(ability_rank, rank)
+            elif tag == "item_use" and item_text is None:
+                item_text = text[match.end():]
+                item = _object_phrase(item_text)
+            tags.add(tag)
+
+    name = next((intent for intent in INTENT_PRIORITY if intent in tags), "action")
+    return Intent(
+        name=name,
+        direction=direction,
+        ability=ABILITIES[ability_rank] if ability_rank is not None else None,
+        item=item,
+        item_text=item_text,
+        safe_destination="safe_destination" in tags,
+        leaving="leaving" in tags,
+    )
+
+
+def _contains_phrase(text: str, phrase: str) -> bool:
+    return re.search(r"(?<!\w)" + re.escape(phrase) + r"(?!\w)", text) is not None
+
+
+def items_used(intent: Intent, inventory: Sequence[str]) -> List[str]:
+    """Inventory items an item-use action refers to
+
+    Whole inventory names after the verb win, so names with "and" or "the" in
+    them work ("use the flint and steel"). Failing that, the parsed object
+    is looked up in the names ("drink the potion" -> "Healing Potion").
+    """
+    if intent.item_text is None:
+        return []
+    named = [item for item in inventory if _contains_phrase(intent.item_text, item.lower())]
+    if named or not intent.item:
+        return named
+    return [item for item in inventory if _contains_phrase(item.lower(), intent.item)][:1]
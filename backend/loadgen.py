@@ -0,0 +1,216 @@
+"""
+AI Dungeon Master - Load Generator
+Simulates many concurrent players against a running server and reports
+throughput, per-route latency percentiles, error rates and memory growth
+
+Start the server with an offline provider first (AI_PROVIDER=stub or replay).
+
+Usage:
+    python loadgen.py --url http://localhost:8000 --players 100,500,1000 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+
+# Weighted action mix, covering every intent the rule engine handles
+ACTION_MIX = [
+    (25, ["attack the monster", "strike with my sword", "fight"]),
+    (20, ["go north", "walk east", "head south", "travel west", "return to town"]),
+    (15, ["search the room", "investigate the noise", "climb the wall", "pick lock"]),
+    (10, ["train strength", "practice dexterity", "study ancient texts"]),
+    (10, ["rest", "sleep by the fire"]),
+    (10, ["summon a companion", "pet scout ahead", "pet help"]),
+    (10, ["look around", "talk to the merchant", "use the torch"]),
+]
+ACTION_WEIGHTS = np.array([weight for weight, _ in ACTION_MIX], dtype=float) / sum(w for w, _ in ACTION_MIX)
+
+RSS_METRIC = re.compile(r"^process_resident_memory_bytes (\S+)$", re.MULTILINE)
+
+
+class Stats:
+    """Latencies and outcomes per route"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.player_errors: Dict[str, int] = defaultdict(int)  # Exception name -> players it stopped
+
+    def add(self, route: str, seconds: float, status: str):
+        self.latencies[route].append(seconds)
+        self.statuses[route][status] += 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            statuses = self.statuses[route]
+            total = sum(statuses.values())
+            ok = statuses.get("200", 0)
+            rejected = statuses.get("429", 0) + statuses.get("503", 0)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            routes[route] = {
+                "requests": total,
+                "throughput": total / elapsed,
+                "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+                "error_rate": (total - ok - rejected) / total,
+                "rejected_rate": rejected / total,  # Backpressure (429/503), not failures
+                "statuses": dict(statuses),
+            }
+        return routes
+
+
+async def timed(client: httpx.AsyncClient, stats: Stats, route: str, method: str, url: str,
+                **kwargs) -> Optional[Dict[str, Any]]:
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        status = str(response.status_code)
+    except httpx.HTTPError as e:
+        stats.add(route, time.perf_counter() - started, type(e).__name__)
+        return None
+    stats.add(route, time.perf_counter() - started, status)
+    return response.json() if response.status_code == 200 else None
+
+
+async def player(client: httpx.AsyncClient, stats: Stats, session_id: str, rng: np.random.Generator,
+                 deadline: float, think: float, seed: int):
+    """One virtual player: start a game, then act (and roll when asked) until the deadline"""
+    await timed(client, stats, "/api/new-game", "POST", f"/api/new-game/{session_id}", params={"seed": seed})
+    while time.monotonic() < deadline:
+        await asyncio.sleep(rng.exponential(think) if think else 0)
+        options = ACTION_MIX[rng.choice(len(ACTION_MIX), p=ACTION_WEIGHTS)][1]
+        action = options[rng.integers(len(options))]
+        result = await timed(client, stats, "/api/action", "POST", "/api/action",
+                             json={"action": action, "session_id": session_id})
+        if result is None:
+            continue
+
+        # Pending skill checks, encounters and live monsters lead to a dice round trip, as in the UI
+        pending = next((e for e in result.get("events", []) if e.get("requires_dice")), None)
+        if pending is not None and "ability" in pending and "dc" in pending:
+            roll = {"roll_type": "skill_check", "context": {"ability": pending["ability"], "dc": pending["dc"]}}
+        elif pending is not None and pending.get("type") == "encounter":
+            roll = {"roll_type": "encounter", "context": {}}
+        elif result.get("game_state", {}).get("monsters") and rng.random() < 0.5:
+            roll = {"roll_type": "attack"}
+        else:
+            continue
+        await asyncio.sleep(rng.exponential(think) if think else 0)
+        await timed(client, stats, "/api/roll-dice", "POST", "/api/roll-dice",
+                    json=dict(roll, session_id=session_id))
+
+
+async def server_memory(client: httpx.AsyncClient) -> Optional[float]:
+    """Server resident memory from /metrics, in MiB"""
+    try:
+        response = await client.get("/metrics")
+        match = RSS_METRIC.search(response.text)
+    except httpx.HTTPError:
+        return None
+    return float(match.group(1)) / 2 ** 20 if match else None
+
+
+async def run_stage(url: str, players: int, duration: float, think: float, ramp: float,
+                    connections: int, seed: int) -> Dict[str, Any]:
+    """Run `players` concurrent players for `duration` seconds"""
+    stats = Stats()
+    run_id = uuid.uuid4().hex[:8]
+    streams = np.random.SeedSequence(seed).spawn(players)
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        memory_before = await server_memory(client)
+        memory_peak = memory_before
+        started = time.monotonic()
+        deadline = started + duration
+
+        async def start(i: int):
+            await asyncio.sleep(ramp * i / players)  # Spread arrivals over the ramp-up
+            try:
+                await player(client, stats, f"load-{run_id}-{i}", np.random.default_rng(streams[i]),
+                             deadline, think, seed + i)
+            except Exception as e:
+                # One broken player is counted, not allowed to abort the whole stage
+                stats.player_errors[type(e).__name__] += 1
+
+        tasks = asyncio.gather(*[start(i) for i in range(players)])
+        while not tasks.done():
+            await asyncio.wait([tasks], timeout=2)
+            memory = await server_memory(client)
+            if memory is not None and (memory_peak is None or memory > memory_peak):
+                memory_peak = memory
+        await tasks
+        elapsed = time.monotonic() - started
+        memory_after = await server_memory(client)
+
+    routes = stats.report(elapsed)
+    total = sum(r["requests"] for r in routes.values())
+    return {
+        "players": players,
+        "elapsed_s": elapsed,
+        "requests": total,
+        "throughput": total / elapsed,
+        "routes": routes,
+        "player_errors": dict(stats.player_errors),
+        "memory_mib": {"before": memory_before, "peak": memory_peak, "after": memory_after,
+                       "growth": (memory_after - memory_before) if memory_before and memory_after else None},
+    }
+
+
+def print_stage(stage: Dict[str, Any]):
+    print(f"\n{stage['players']} players, {stage['elapsed_s']:.1f}s: "
+          f"{stage['requests']:,} requests, {stage['throughput']:.1f} req/s")
+    print(f"{'Route':<16} {'Reqs':>8} {'Req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'Errors':>7} {'Reject':>7}")
+    for route, r in stage["routes"].items():
+        print(f"{route:<16} {r['requests']:>8} {r['throughput']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['p99_ms']:>8.1f} {r['error_rate'] * 100:>6.1f}% {r['rejected_rate'] * 100:>6.1f}%")
+    if stage["player_errors"]:
+        errors = ", ".join(f"{name} x{count}" for name, count in stage["player_errors"].items())
+        print(f"Players stopped by errors: {errors}")
+    memory = stage["memory_mib"]
+    if memory["before"] is not None:
+        print(f"Server memory: {memory['before']:.0f} -> {memory['after']:.0f} MiB "
+              f"(peak {memory['peak']:.0f}, growth {memory['growth']:+.0f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent player load generator")
+    parser.add_argument("--url", default="http://localhost:8000", help="Server base URL")
+    parser.add_argument("--players", default="100", help='Concurrent players; a list like "100,500,1000" runs stages')
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per stage")
+    parser.add_argument("--think", type=float, default=1.0, help="Mean seconds a player waits between requests")
+    parser.add_argument("--ramp", type=float, default=5, help="Seconds over which players join")
+    parser.add_argument("--connections", type=int, default=500, help="Max open HTTP connections")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for player behaviour and games")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    stages = []
+    for players in (int(p) for p in args.players.split(",")):
+        stage = asyncio.run(run_stage(args.url, players, args.duration, args.think, args.ramp,
+                                      args.connections, args.seed))
+        stages.append(stage)
+        if not args.json:
+            print_stage(stage)
+
+    if args.json:
+        print(json.dumps(stages, indent=2))
+    elif len(stages) > 1:
+        # Capacity summary: throughput stops growing (and p95 climbs) past the saturation point
+        print(f"\n{'Players':>8} {'Req/s':>8} {'Action p95 ms':>14} {'Errors':>7}")
+        for stage in stages:
+            action = stage["routes"].get("/api/action", {})
+            errors = sum(r["error_rate"] * r["requests"] for r in stage["routes"].values()) / max(stage["requests"], 1)
+            print(f"{stage['players']:>8} {stage['throughput']:>8.1f} {action.get('p95_ms', 0):>14.1f} {errors * 100:>6.1f}%")
+
+
+if __name__ == "__main__":
+    main()
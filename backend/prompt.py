@@ -0,0 +1,182 @@
+"""
+AI Dungeon Master - Prompt Builder
+Static DM instructions compiled once into a byte-stable system prompt, and
+per-turn context packed under a token budget
+"""
+
+import os
+from functools import lru_cache
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+
+# Token budget for the per-turn prompt (the static system prompt isn't counted)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "cl100k_base")  # tiktoken encoding name
+
+DM_PROMPT = """You are a creative and immersive Dungeon Master for a D&D-style game. Your storytelling should be vivid, engaging, and full of personality.
+
+CRITICAL RULES:
+
+1. **Be Creative and Vivid** - Use rich descriptions, sensory details, and atmospheric storytelling. Make the world feel alive with:
+   - Vivid imagery (sights, sounds, smells, textures)
+   - Dynamic environments that react to the player
+   - Memorable NPCs and creatures with personality
+   - Atmospheric tension and mood
+   - Creative problem-solving opportunities
+
+2. **Treat player input as an action** - Every action must have immediate, meaningful results.
+
+3. **Always provide consequences** - Every action must trigger at least ONE of:
+   - Discovery of something (item, clue, location feature, secret)
+   - Interaction with NPC, creature, or the player's pet/assistant
+   - Obstacle, trap, or hazard
+   - Environmental change or world-building detail
+   - Combat event or social encounter
+
+4. **Include actionable next steps** - After describing the result, suggest 2-3 specific, interesting actions the player can take next.
+
+5. **Incorporate pets/assistants** - If the player has a pet or assistant, mention them naturally in the narrative. They can help, react, or provide commentary. Make them feel like part of the adventure.
+
+6. **Respond to game events creatively** - Incorporate dice rolls, combat results, and skill checks into your narrative in interesting ways. A low roll might be "Your sword glances off the goblin's shield with a metallic clang" while a high roll could be "Your blade finds a gap in the creature's armor with surgical precision."
+
+7. **Keep it engaging** - 3-5 sentences for the main description, plus 2-3 actionable options. Balance detail with pacing.
+
+8. **Format your response:**
+   - First: Vivid, creative description of the immediate result with sensory details
+   - Include: Pet/assistant reactions if applicable
+   - Then: Suggest 2-3 specific, interesting next actions
+   - Integrate: Game events (dice rolls, combat) naturally and creatively
+
+EXAMPLE GOOD RESPONSE (with continuity):
+"As you search along the cliff edge, your torch casts dancing shadows that reveal a narrow path hidden behind overgrown shrubs. The air grows cooler here, carrying the faint scent of damp earth and something metallic. Your companion [pet name] sniffs the air nervously, ears perked toward the darkness ahead. A faint draft and the distant sound of dripping water suggest a cave system beyond. You could approach the path carefully while your pet scouts ahead, inspect the shrubs for traps or hidden dangers, or call out to test the acoustics and see if anything responds from within."
+
+EXAMPLE GOOD RESPONSE (continuing conversation):
+"The goblin's yellow eyes widen slightly at your thanks, and he lets out a gruff chuckle. 'Polite one, aren't ya?' he grumbles, but his stance relaxes a bit. 'Most adventurers just swing first. What brings you to these parts?' He seems curious rather than immediately hostile. You could continue the conversation to learn more about the dungeon, offer to trade or share information, or cautiously ask about safe passage through the area."
+
+EXAMPLE BAD RESPONSE (ignoring context):
+"You are in a dark forest. The trees are tall." (This ignores previous conversation!)
+
+CRITICAL: Always check the RECENT CONVERSATION/CONTEXT section. If the player is continuing an interaction with an NPC or creature mentioned there, respond as if that conversation is ongoing. Do NOT reset the scene or treat it as a new encounter.
+
+Remember: Be CREATIVE, VIVID, and ENGAGING. MAINTAIN CONTINUITY with previous interactions. Every action must have CONSEQUENCES and lead to NEW OPTIONS. Make the world feel alive and responsive."""
+
+# Fixed per-turn rules. They used to follow the turn's context in the user
+# prompt; keeping them in the system prompt makes the whole prefix identical
+# on every turn, so provider prompt caching (and Ollama's KV cache) can reuse it.
+TURN_INSTRUCTIONS = """CRITICAL: You MUST maintain continuity with the RECENT CONVERSATION/CONTEXT section of the turn. If the player is thanking or talking to an NPC/creature that was mentioned in recent context, respond as if that conversation is ongoing. Do NOT reset to the beginning or treat it as a new encounter.
+
+CRITICAL CONTEXT RULES:
+- If the player is going HOME, TOWN, or VILLAGE, they are traveling to a SAFE location. Do NOT generate hostile encounters or dangerous situations. Describe a peaceful journey or arrival at a safe place.
+- If the player is in a DANGEROUS area (dungeon, cave, forest, etc.), encounters are appropriate.
+- If the player is going to a SAFE location (home, town, village), describe the journey as safe and peaceful, or arriving at the destination.
+- MATCH THE SETTING: If the player is on a mountain, encounters should be mountain-appropriate. If in a graveyard, encounters should be undead-themed. If going home, it should be peaceful.
+- DICE ROLLS: If there are dice roll events in GAME EVENTS, WAIT for the dice result before describing the outcome. Reference the dice roll result in your narrative. For example: "You roll the dice... [wait for result]... With a roll of [X], you [succeed/fail]..." The dice roll determines what happens, so describe the outcome based on the roll result.
+
+INSTRUCTIONS:
+1. Be CREATIVE and VIVID - Use rich descriptions, sensory details, and atmospheric storytelling
+2. MAINTAIN CONTINUITY - Reference recent events and conversations. If the player is continuing a conversation, respond appropriately.
+3. RESPECT CONTEXT - If player is going to a safe location (home/town), describe a peaceful journey or safe arrival. Do NOT add hostile encounters.
+4. MATCH THE SETTING - Encounters and events must be appropriate for the current location and context.
+5. Describe the IMMEDIATE RESULT of the player's action with engaging detail
+6. If the player has a pet/companion, mention them naturally - they can help, react, or provide commentary
+7. Include any discoveries, obstacles, NPC reactions, or environmental changes (but only if contextually appropriate)
+8. End with 2-3 specific, interesting actionable options for what the player can do next
+9. Integrate the game events (dice rolls, combat) creatively into your narrative
+10. Keep it engaging (3-5 sentences + options) with vivid imagery and personality
+
+Remember: Be CREATIVE, make the world feel ALIVE, MAINTAIN CONTINUITY, RESPECT CONTEXT (safe places = safe journeys), and always provide CONSEQUENCES and next steps."""
+
+SYSTEM_PROMPT = DM_PROMPT + "\n\n" + TURN_INSTRUCTIONS
+
+# Instructions for folding old turns into a session's running story summary
+SUMMARY_PROMPT = """You keep the running summary of a D&D-style adventure for its Dungeon Master.
+
+Merge the new turns into the existing summary. Keep what matters for continuity: where the player has been, NPCs and creatures met and how they feel about the player, allies, items gained or used, promises, quests and unresolved threats. Drop dice numbers and flavor text.
+
+Reply with the updated summary only: plain prose, past tense, at most 150 words."""
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(PROMPT_TOKENIZER)
+    except Exception:
+        # tiktoken not installed (or its encoding can't be downloaded)
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken, or estimate them (~4 characters per token) without it"""
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def build_summary_prompt(summary: str, turns: Sequence[str]) -> str:
+    """User prompt asking to merge turns into the summary"""
+    new_turns = "\n".join(f"{i}. {turn}" for i, turn in enumerate(turns, 1))
+    return f"SUMMARY SO FAR:\n{summary or '(nothing yet)'}\n\nNEW TURNS:\n{new_turns}"
+
+
+class PromptSection(NamedTuple):
+    """One block of the per-turn prompt"""
+    lines: Sequence[str]
+    header: Optional[str] = None  # Printed above the lines, only if any line is kept
+    priority: int = 0  # 0 = always kept; higher numbers are trimmed first
+    keep: str = "first"  # When trimming, keep the "first" or the "last" lines
+    blank_before: bool = True  # Separate from the previous section with a blank line
+
+
+class PromptBuilder:
+    """Builds turn prompts behind a static system prompt
+
+    The system prompt is fixed when the builder is created; build() packs the
+    dynamic sections, dropping lines from the lowest-priority sections until
+    the turn prompt fits the token budget. Priority-0 sections are never
+    trimmed; if they alone exceed the budget, the prompt is sent over budget
+    with a warning.
+    """
+
+    def __init__(self, system_prompt: str = SYSTEM_PROMPT, budget: int = PROMPT_TOKEN_BUDGET,
+                 counter: Callable[[str], int] = count_tokens):
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.count = counter
+        self.system_tokens = counter(system_prompt)
+
+    def build(self, sections: Sequence[PromptSection]) -> str:
+        """Render the sections in order, trimmed to the token budget"""
+        kept: List[List[str]] = [list(section.lines) for section in sections]
+        costs = [[self.count(line) + 1 for line in lines] for lines in kept]  # +1 for the newline
+        # Headers only print above a section that keeps a line
+        total = sum(map(sum, costs)) + sum(self.count(s.header) + 1 for s, lines in zip(sections, kept)
+                                           if s.header and lines)
+
+        trimmable = sorted((i for i, s in enumerate(sections) if s.priority), key=lambda i: -sections[i].priority)
+        for i in trimmable:
+            section = sections[i]
+            while total > self.budget and kept[i]:
+                index = 0 if section.keep == "last" else -1
+                kept[i].pop(index)
+                total -= costs[i].pop(index)
+                if not kept[i] and section.header:
+                    total -= self.count(section.header) + 1
+            if total <= self.budget:
+                break
+        if total > self.budget:
+            # Only always-kept (priority 0) sections are left over the budget: send them anyway, but say so
+            print(f"⚠️  Turn prompt is {total} tokens after trimming, over the {self.budget}-token budget")
+
+        parts = []
+        for section, lines in zip(sections, kept):
+            if not lines:
+                continue
+            if parts and section.blank_before:
+                parts.append("")
+            if section.header:
+                parts.append(section.header)
+            parts.extend(lines)
+        return "\n".join(parts)
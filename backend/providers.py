@@ -0,0 +1,456 @@
+"""
+AI Dungeon Master - Narrative Providers
+Async clients for every supported AI backend, so a slow completion never
+blocks the event loop serving other sessions
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from cassette import (CASSETTE_LATENCY_SCALE, CASSETTE_MODE, CASSETTE_PATH, CASSETTE_PROVIDER,
+                      Cassette, Recording, prompt_key)
+
+
+# Shared generation settings (same for every backend)
+TEMPERATURE = 0.8
+MAX_TOKENS = 300
+
+# Connection pool settings (shared by every provider's HTTP client)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # How long Ollama keeps the model loaded
+
+
+def make_http_client(timeout: float) -> httpx.AsyncClient:
+    """Create a pooled keep-alive HTTP client"""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_SIZE,
+            max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+        )
+    )
+
+
+def build_messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    """Build a chat message list"""
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+class NarrativeProvider:
+    """Base class for an async narrative backend"""
+    name = "base"
+    default_timeout = LLM_TIMEOUT
+    warmup_url: Optional[str] = None
+
+    def __init__(self, timeout: Optional[float] = None,
+                 http_client: Optional[httpx.AsyncClient] = None):
+        self.timeout = timeout or self.default_timeout
+        self._owns_client = http_client is None
+        self.http = http_client or make_http_client(self.timeout)
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        """Generate a full completion for the given prompts"""
+        raise NotImplementedError
+
+    async def stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """Yield the completion as text chunks (whole text if the API can't stream)"""
+        yield await self.complete(system_prompt, user_prompt)
+
+    async def warmup(self):
+        """Open a pooled connection (TCP + TLS) before the first turn needs it"""
+        if self.warmup_url:
+            await self.http.head(self.warmup_url)
+
+    async def aclose(self):
+        """Release any network resources held by the provider"""
+        if self._owns_client:
+            await self.http.aclose()
+
+
+class OpenAIProvider(NarrativeProvider):
+    """OpenAI chat completions"""
+    name = "openai"
+    warmup_url = "https://api.openai.com/v1/models"
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None,
+                 timeout: Optional[float] = None, http_client: Optional[httpx.AsyncClient] = None):
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not set. Check your .env file or environment variables.")
+        import openai
+        super().__init__(timeout, http_client)
+        self.model = model or os.getenv("OPENAI_MODEL", "gpt-4")
+        self.client = openai.AsyncOpenAI(api_key=api_key, timeout=self.timeout, http_client=self.http)
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=build_messages(system_prompt, user_prompt),
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS
+        )
+        return response.choices[0].message.content.strip()
+
+    async def stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=build_messages(system_prompt, user_prompt),
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class GroqProvider(NarrativeProvider):
+    """Groq (FREE - Very Fast!)"""
+    name = "groq"
+    warmup_url = "https://api.groq.com/openai/v1/models"
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None,
+                 timeout: Optional[float] = None, http_client: Optional[httpx.AsyncClient] = None):
+        api_key = api_key or os.getenv("GROQ_API_KEY")
+        if not api_key:
+            raise ValueError("GROQ_API_KEY not set")
+        try:
+            from groq import AsyncGroq
+        except ImportError:
+            raise ImportError("groq package not installed. Run: pip install groq")
+        super().__init__(timeout, http_client)
+        self.model = model or os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile")
+        self.client = AsyncGroq(api_key=api_key, timeout=self.timeout, http_client=self.http)
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=build_messages(system_prompt, user_prompt),
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS
+        )
+        return response.choices[0].message.content.strip()
+
+    async def stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=build_messages(system_prompt, user_prompt),
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class HTTPProvider(NarrativeProvider):
+    """Base class for providers spoken to over plain HTTP"""
+
+    async def _post_json(self, url: str, payload: Dict[str, Any],
+                         headers: Optional[Dict[str, str]] = None) -> Any:
+        response = await self.http.post(url, json=payload, headers=headers)
+        return response.json()
+
+
+class HuggingFaceProvider(HTTPProvider):
+    """Hugging Face Inference API (FREE)"""
+    name = "huggingface"
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None,
+                 timeout: Optional[float] = None, http_client: Optional[httpx.AsyncClient] = None):
+        api_key = api_key or os.getenv("HUGGINGFACE_API_KEY")
+        if not api_key:
+            raise ValueError("HUGGINGFACE_API_KEY not set")
+        super().__init__(timeout, http_client)
+        self.model = model or os.getenv("HF_MODEL", "mistralai/Mistral-7B-Instruct-v0.2")
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.warmup_url = f"https://api-inference.huggingface.co/models/{self.model}"
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        try:
+            payload = {
+                "inputs": f"{system_prompt}\n\nUser: {user_prompt}\nAssistant:",
+                "parameters": {"max_new_tokens": MAX_TOKENS, "temperature": TEMPERATURE}
+            }
+            result = await self._post_json(
+                f"https://api-inference.huggingface.co/models/{self.model}",
+                payload,
+                self.headers
+            )
+            if isinstance(result, list) and len(result) > 0:
+                return result[0].get("generated_text", "").split("Assistant:")[-1].strip()
+            return result.get("generated_text", "").strip()
+        except Exception as e:
+            raise Exception(f"Hugging Face API error: {str(e)}")
+
+
+class TogetherProvider(HTTPProvider):
+    """Together AI (FREE tier available)"""
+    name = "together"
+    warmup_url = "https://api.together.xyz/v1/models"
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None,
+                 timeout: Optional[float] = None, http_client: Optional[httpx.AsyncClient] = None):
+        api_key = api_key or os.getenv("TOGETHER_API_KEY")
+        if not api_key:
+            raise ValueError("TOGETHER_API_KEY not set")
+        super().__init__(timeout, http_client)
+        self.model = model or os.getenv("TOGETHER_MODEL", "mistralai/Mixtral-8x7B-Instruct-v0.1")
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        try:
+            payload = {
+                "model": self.model,
+                "messages": build_messages(system_prompt, user_prompt),
+                "temperature": TEMPERATURE,
+                "max_tokens": MAX_TOKENS
+            }
+            result = await self._post_json(
+                "https://api.together.xyz/v1/chat/completions",
+                payload,
+                self.headers
+            )
+            return result["choices"][0]["message"]["content"].strip()
+        except Exception as e:
+            raise Exception(f"Together AI API error: {str(e)}")
+
+    async def stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        payload = {
+            "model": self.model,
+            "messages": build_messages(system_prompt, user_prompt),
+            "temperature": TEMPERATURE,
+            "max_tokens": MAX_TOKENS,
+            "stream": True
+        }
+        try:
+            async with self.http.stream("POST", "https://api.together.xyz/v1/chat/completions",
+                                        json=payload, headers=self.headers) as response:
+                # Server-sent events: one "data: {...}" line per chunk
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)["choices"][0].get("delta", {})
+                    if delta.get("content"):
+                        yield delta["content"]
+        except Exception as e:
+            raise Exception(f"Together AI API error: {str(e)}")
+
+
+class OllamaProvider(HTTPProvider):
+    """Ollama (LOCAL - Completely FREE, no API key needed!)"""
+    name = "ollama"
+    default_timeout = float(os.getenv("OLLAMA_TIMEOUT", "60"))
+
+    def __init__(self, base_url: Optional[str] = None, model: Optional[str] = None,
+                 timeout: Optional[float] = None, http_client: Optional[httpx.AsyncClient] = None):
+        super().__init__(timeout, http_client)
+        self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        self.model = model or os.getenv("OLLAMA_MODEL", "llama3.2")
+
+    async def warmup(self):
+        """Preload the model into memory so the first turn skips the load time"""
+        await self.http.post(
+            f"{self.base_url}/api/generate",
+            json={"model": self.model, "keep_alive": OLLAMA_KEEP_ALIVE}
+        )
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        try:
+            payload = {
+                "model": self.model,
+                "messages": build_messages(system_prompt, user_prompt),
+                "stream": False,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
+                "options": {"temperature": TEMPERATURE, "num_predict": MAX_TOKENS}
+            }
+            result = await self._post_json(f"{self.base_url}/api/chat", payload)
+            return result["message"]["content"].strip()
+        except Exception as e:
+            raise Exception(f"Ollama error: {str(e)}. Make sure Ollama is running: ollama serve")
+
+    async def stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        payload = {
+            "model": self.model,
+            "messages": build_messages(system_prompt, user_prompt),
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {"temperature": TEMPERATURE, "num_predict": MAX_TOKENS}
+        }
+        try:
+            async with self.http.stream("POST", f"{self.base_url}/api/chat", json=payload) as response:
+                # Newline-delimited JSON: one message fragment per line
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("message", {}).get("content"):
+                        yield chunk["message"]["content"]
+                    if chunk.get("done"):
+                        break
+        except Exception as e:
+            raise Exception(f"Ollama error: {str(e)}. Make sure Ollama is running: ollama serve")
+
+
+class StubProvider(NarrativeProvider):
+    """Offline provider that answers instantly with a fixed narrative (benchmarks, load tests, local dev)"""
+    name = "stub"
+    NARRATIVE = ("You press on, torch held high. A hooded merchant steps out of the shadows, "
+                 "nods, and says the road ahead is dangerous.")
+
+    def __init__(self, model: Optional[str] = None, timeout: Optional[float] = None,
+                 http_client: Optional[httpx.AsyncClient] = None):
+        self.model = model or "stub"
+        self.timeout = timeout or self.default_timeout
+        self._owns_client = False
+        self.http = http_client  # Never used: nothing goes over the network
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        return self.NARRATIVE
+
+    async def stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        for word in self.NARRATIVE.split(" "):
+            yield word + " "
+
+
+class ReplayProvider(NarrativeProvider):
+    """Plays narratives back from a cassette file, with their recorded latencies
+
+    With CASSETTE_MODE=record it passes every request through to
+    CASSETTE_PROVIDER instead, recording prompt, response and timings.
+    """
+    name = "replay"
+
+    def __init__(self, model: Optional[str] = None, timeout: Optional[float] = None,
+                 http_client: Optional[httpx.AsyncClient] = None):
+        self.timeout = timeout or self.default_timeout
+        self._owns_client = False
+        self.http = http_client  # Replays never touch the network
+        self.cassette = Cassette(CASSETTE_PATH)
+        self.recorder = create_provider(CASSETTE_PROVIDER, model) if CASSETTE_MODE == "record" else None
+        self.model = getattr(self.recorder, "model", None) or model or "replay"
+        if self.recorder is None and not len(self.cassette):
+            print(f"⚠️  Cassette {CASSETTE_PATH} is empty: replaying synthetic narratives without delays")
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        key = prompt_key(system_prompt, user_prompt)
+        if self.recorder is not None:
+            started = time.perf_counter()
+            text = await self.recorder.complete(system_prompt, user_prompt)
+            # File append off the event loop, so recording doesn't stall other turns
+            await asyncio.to_thread(self.cassette.record, key, user_prompt,
+                                    Recording(text, time.perf_counter() - started), self.recorder.name, self.model)
+            return text
+        recording = self.cassette.playback(key, user_prompt)
+        await asyncio.sleep(recording.latency * CASSETTE_LATENCY_SCALE)
+        return recording.response
+
+    async def stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        key = prompt_key(system_prompt, user_prompt)
+        if self.recorder is not None:
+            started = time.perf_counter()
+            first_chunk = None
+            chunks = []
+            async for chunk in self.recorder.stream(system_prompt, user_prompt):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                chunks.append(chunk)
+                yield chunk
+            recording = Recording("".join(chunks), time.perf_counter() - started, first_chunk, len(chunks))
+            await asyncio.to_thread(self.cassette.record, key, user_prompt, recording,
+                                    self.recorder.name, self.model)
+            return
+        
+        recording = self.cassette.playback(key, user_prompt)
+        words = recording.response.split(" ")
+        first_chunk = recording.first_chunk if recording.first_chunk is not None else recording.latency
+        gap = max(recording.latency - first_chunk, 0) / max(len(words) - 1, 1)
+        await asyncio.sleep(first_chunk * CASSETTE_LATENCY_SCALE)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(gap * CASSETTE_LATENCY_SCALE)
+            yield word if i == len(words) - 1 else word + " "
+
+    async def warmup(self):
+        if self.recorder is not None:
+            await self.recorder.warmup()
+
+    async def aclose(self):
+        if self.recorder is not None:
+            await self.recorder.aclose()
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "groq": GroqProvider,
+    "huggingface": HuggingFaceProvider,
+    "together": TogetherProvider,
+    "ollama": OllamaProvider,
+    "stub": StubProvider,
+    "replay": ReplayProvider,
+}
+
+
+def create_provider(name: str, model: Optional[str] = None) -> NarrativeProvider:
+    """Instantiate the provider registered under the given name (optionally with a specific model)"""
+    provider_class = PROVIDERS.get(name)
+    if provider_class is None:
+        raise ValueError(f"Unknown AI provider: {name}. Use: {', '.join(PROVIDERS)}")
+    return provider_class(model=model) if model else provider_class()
+
+
+class ProviderRegistry:
+    """Builds each provider once and hands out the shared, pooled instance"""
+
+    def __init__(self):
+        self._providers: Dict[Tuple[str, Optional[str]], NarrativeProvider] = {}
+
+    def get(self, name: str, model: Optional[str] = None) -> NarrativeProvider:
+        """Get the provider for a name (and model override), building it on first use"""
+        provider = self._providers.get((name, model))
+        if provider is None:
+            provider = create_provider(name, model)
+            self._providers[(name, model)] = provider
+        return provider
+
+    async def start(self, names: Iterable[str], warmup: bool = False):
+        """Build providers up front and optionally warm their connections"""
+        started = []
+        for name in names:
+            try:
+                started.append(self.get(name))
+            except Exception as e:
+                print(f"⚠️  Could not initialize {name} provider: {e}")
+        if warmup and started:
+            results = await asyncio.gather(*[p.warmup() for p in started], return_exceptions=True)
+            for provider, result in zip(started, results):
+                if isinstance(result, Exception):
+                    print(f"⚠️  Warmup failed for {provider.name}: {result}")
+                else:
+                    print(f"✅ {provider.name} provider warmed up")
+
+    async def aclose(self):
+        """Close every provider's connection pool"""
+        for provider in self._providers.values():
+            await provider.aclose()
+        self._providers.clear()
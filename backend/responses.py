@@ -0,0 +1,116 @@
+"""
+AI Dungeon Master - JSON Responses
+orjson-backed encoding and response class, plus pre-encoded JSON fragments
+for parts of a game state that haven't changed since they were last encoded
+"""
+
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import numpy as np
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Falls back to the standard library (slower, same output)
+
+
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "4096"))  # Encoded state fields kept (0 = off)
+
+# Stands in for a fragment until it is spliced into the encoded output
+_MARK = f"fragment-{uuid.uuid4().hex}-"
+
+
+class Fragment:
+    """Already-encoded JSON, embedded as-is wherever it appears in a value passed to dumps()"""
+    __slots__ = ("contents",)
+
+    def __init__(self, contents: bytes):
+        self.contents = contents
+
+
+if orjson is not None and hasattr(orjson, "Fragment"):
+    Fragment = orjson.Fragment  # noqa: F811  (orjson >= 3.9 embeds fragments natively)
+
+
+_spliced = threading.local()  # Fragments met by the encoder in the current dumps() call
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Fragment):
+        # Encoded as a placeholder string that dumps() then replaces
+        fragments = _spliced.__dict__.setdefault("fragments", [])
+        fragments.append(obj.contents)
+        return f"{_MARK}{len(fragments) - 1}"
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    """Compact UTF-8 JSON for a response body (numpy scalars and arrays included)"""
+    try:
+        if orjson is not None:
+            data = orjson.dumps(value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        else:
+            data = json.dumps(value, default=_default, ensure_ascii=False, allow_nan=False,
+                              separators=(",", ":")).encode()
+    finally:
+        fragments = _spliced.__dict__.pop("fragments", None)
+    for i, contents in enumerate(fragments or ()):
+        data = data.replace(f'"{_MARK}{i}"'.encode(), contents, 1)
+    return data
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded with orjson
+
+    Returning one from an endpoint also skips FastAPI's response validation
+    and jsonable_encoder pass, so use it for content the server built itself.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class FragmentCache:
+    """Bounded LRU of encoded JSON, keyed so that a changed value gets a new key"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Fragment]:
+        with self._lock:
+            contents = self._entries.get(key)
+            if contents is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return Fragment(contents)
+
+    def put(self, key: Hashable, contents: bytes):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = contents
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+fragment_cache = FragmentCache(FRAGMENT_CACHE_SIZE)
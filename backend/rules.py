@@ -0,0 +1,462 @@
+"""
+AI Dungeon Master - Rule Engine
+Dice, combat and ability checks, plus the character and monster records
+they act on. Free of import side effects (no .env, providers or storage),
+so the simulator and its worker processes can load it on their own.
+"""
+
+import copyreg
+import operator
+import os
+import random
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+# Generator for batch rolls made without an explicit rng
+_batch_rng = np.random.default_rng()
+
+# Entries kept per memoized probability table
+PROBABILITY_CACHE_SIZE = int(os.getenv("PROBABILITY_CACHE_SIZE", "4096"))
+
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    """Freeze a cached array so callers can't corrupt the memoized table"""
+    array.flags.writeable = False
+    return array
+
+
+class DamageDistribution(NamedTuple):
+    """Exact distribution of a damage roll's total"""
+    totals: np.ndarray  # Every possible total, ascending
+    pmf: np.ndarray  # P(total == totals[i])
+    cdf: np.ndarray  # P(total <= totals[i])
+    mean: float
+    
+    def at_least(self, damage: int) -> float:
+        """P(total >= damage), e.g. the chance to finish off a monster"""
+        return float(self.pmf[self.totals >= damage].sum())
+
+
+class RuleEngine:
+    """Game rules engine - all game mechanics are determined by code, not AI
+    
+    Every roll takes an optional NumPy `rng` (np.random.Generator), normally the
+    session's GameState.rng; without one the module-level `random` is used. The
+    *_batch methods resolve many rolls at once as arrays and, given an
+    identically seeded rng, draw the same numbers as the scalar methods
+    (element by element, in C order).
+    """
+    
+    @staticmethod
+    def roll_dice(sides: int, count: int = 1, rng: Optional[np.random.Generator] = None) -> List[int]:
+        """Roll dice: returns list of results"""
+        if rng is None:
+            return [random.randint(1, sides) for _ in range(count)]
+        return rng.integers(1, sides + 1, size=count).tolist()
+    
+    @staticmethod
+    def roll_d20(rng: Optional[np.random.Generator] = None) -> int:
+        """Roll a d20"""
+        if rng is None:
+            return random.randint(1, 20)
+        return int(rng.integers(1, 21))
+    
+    @staticmethod
+    def roll_d6(count: int = 1, rng: Optional[np.random.Generator] = None) -> int:
+        """Roll d6s and return sum"""
+        return sum(RuleEngine.roll_dice(6, count, rng))
+    
+    @staticmethod
+    def choice(options: List[Any], rng: Optional[np.random.Generator] = None) -> Any:
+        """Pick one option at random"""
+        if rng is None:
+            return random.choice(options)
+        return options[int(rng.integers(len(options)))]
+    
+    @staticmethod
+    def sample(options: List[Any], k: int, rng: Optional[np.random.Generator] = None) -> List[Any]:
+        """Pick k distinct options at random"""
+        if rng is None:
+            return random.sample(options, k=k)
+        return [options[i] for i in rng.choice(len(options), size=k, replace=False)]
+    
+    @staticmethod
+    def chance(probability: float, rng: Optional[np.random.Generator] = None) -> bool:
+        """True with the given probability"""
+        return (random.random() if rng is None else rng.random()) < probability
+    
+    @staticmethod
+    def calculate_modifier(ability_score: int) -> int:
+        """Calculate ability modifier from score"""
+        return (ability_score - 10) // 2
+    
+    @staticmethod
+    def attack_roll(attacker_level: int, attacker_modifier: int, 
+                   defender_ac: int, advantage: bool = False,
+                   rng: Optional[np.random.Generator] = None) -> Dict[str, Any]:
+        """Perform an attack roll"""
+        roll1 = RuleEngine.roll_d20(rng)
+        roll2 = RuleEngine.roll_d20(rng) if advantage else None
+        
+        roll_used = max(roll1, roll2) if advantage else roll1
+        total = roll_used + attacker_modifier + (attacker_level // 4)  # Proficiency bonus
+        
+        hit = total >= defender_ac
+        critical = roll_used == 20
+        
+        return {
+            "roll": roll_used,
+            "modifier": attacker_modifier,
+            "total": total,
+            "hit": hit,
+            "critical": critical,
+            "advantage_roll": roll2 if advantage else None
+        }
+    
+    @staticmethod
+    def damage_roll(dice_count: int, dice_sides: int, modifier: int = 0, 
+                   critical: bool = False, rng: Optional[np.random.Generator] = None) -> Dict[str, Any]:
+        """Calculate damage"""
+        multiplier = 2 if critical else 1
+        rolls = RuleEngine.roll_dice(dice_sides, dice_count * multiplier, rng)
+        total = sum(rolls) + (modifier * multiplier)
+        
+        return {
+            "rolls": rolls,
+            "modifier": modifier,
+            "total": total,
+            "critical": critical
+        }
+    
+    @staticmethod
+    def skill_check(ability_modifier: int, proficiency_bonus: int = 0,
+                   difficulty_class: int = 10, advantage: bool = False,
+                   rng: Optional[np.random.Generator] = None) -> Dict[str, Any]:
+        """Perform a skill check"""
+        roll1 = RuleEngine.roll_d20(rng)
+        roll2 = RuleEngine.roll_d20(rng) if advantage else None
+        
+        roll_used = max(roll1, roll2) if advantage else roll1
+        total = roll_used + ability_modifier + proficiency_bonus
+        
+        success = total >= difficulty_class
+        
+        return {
+            "roll": roll_used,
+            "modifier": ability_modifier,
+            "proficiency": proficiency_bonus,
+            "total": total,
+            "dc": difficulty_class,
+            "success": success,
+            "advantage_roll": roll2 if advantage else None
+        }
+    
+    # ---------- Batch (vectorized) rolls ----------
+    
+    @staticmethod
+    def roll_dice_batch(sides: int, count: int = 1, size: Tuple[int, ...] = (),
+                        rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """Roll `count` dice for every element of `size`: returns shape size + (count,)"""
+        rng = rng if rng is not None else _batch_rng
+        return rng.integers(1, sides + 1, size=tuple(size) + (count,))
+    
+    @staticmethod
+    def _d20_batch(shape: Tuple[int, ...], advantage: bool,
+                   rng: Optional[np.random.Generator]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Roll a d20 (two with advantage) per element: returns (roll_used, advantage_roll)"""
+        rolls = RuleEngine.roll_dice_batch(20, 2 if advantage else 1, shape, rng)
+        if advantage:
+            return rolls.max(axis=-1), rolls[..., 1]
+        return rolls[..., 0], None
+    
+    @staticmethod
+    def attack_roll_batch(attacker_levels, attacker_modifiers, defender_acs,
+                          advantage: bool = False,
+                          rng: Optional[np.random.Generator] = None) -> Dict[str, Any]:
+        """Resolve N attackers against M defenders at once
+        
+        attacker_levels and attacker_modifiers have shape (N,) (or are scalars),
+        defender_acs has shape (M,); every result array has shape (N, M).
+        """
+        levels = np.atleast_1d(np.asarray(attacker_levels))
+        modifiers = np.atleast_1d(np.asarray(attacker_modifiers))
+        levels, modifiers = np.broadcast_arrays(levels, modifiers)
+        acs = np.atleast_1d(np.asarray(defender_acs))
+        
+        roll_used, advantage_roll = RuleEngine._d20_batch((levels.shape[0], acs.shape[0]), advantage, rng)
+        total = roll_used + modifiers[:, None] + (levels[:, None] // 4)  # Proficiency bonus
+        
+        return {
+            "roll": roll_used,
+            "modifier": np.broadcast_to(modifiers[:, None], total.shape),
+            "total": total,
+            "hit": total >= acs[None, :],
+            "critical": roll_used == 20,
+            "advantage_roll": advantage_roll
+        }
+    
+    @staticmethod
+    def damage_roll_batch(dice_count: int, dice_sides: int, modifier=0, critical=False,
+                          size: Optional[Tuple[int, ...]] = None,
+                          rng: Optional[np.random.Generator] = None) -> Dict[str, Any]:
+        """Roll damage for many hits at once
+        
+        modifier and critical may be scalars or arrays (broadcast together, or
+        to `size`). With an array `critical`, each element rolls only the dice
+        it needs, as damage_roll would; `rolls` then has room for the doubled
+        dice and holds 0 in the slots of the non-critical elements.
+        """
+        modifier = np.asarray(modifier)
+        critical = np.asarray(critical, dtype=bool)
+        shape = tuple(size) if size is not None else np.broadcast_shapes(modifier.shape, critical.shape)
+        
+        if critical.ndim == 0:
+            multiplier = 2 if critical else 1
+            rolls = RuleEngine.roll_dice_batch(dice_sides, dice_count * multiplier, shape, rng)
+            total = rolls.sum(axis=-1) + modifier * multiplier
+        else:
+            critical = np.broadcast_to(critical, shape)
+            counts = np.where(critical, dice_count * 2, dice_count)
+            drawn = RuleEngine.roll_dice_batch(dice_sides, int(counts.sum()), (), rng)
+            rolls = np.zeros(shape + (dice_count * 2,), dtype=drawn.dtype)
+            # Boolean assignment fills in C order: each element's dice in turn, as the scalar rolls draw them
+            rolls[np.arange(dice_count * 2) < counts[..., None]] = drawn
+            total = rolls.sum(axis=-1) + modifier * np.where(critical, 2, 1)
+        
+        return {
+            "rolls": rolls,
+            "modifier": modifier,
+            "total": total,
+            "critical": critical
+        }
+    
+    @staticmethod
+    def skill_check_batch(ability_modifiers, proficiency_bonus=0, difficulty_classes=10,
+                          advantage: bool = False, size: Optional[Tuple[int, ...]] = None,
+                          rng: Optional[np.random.Generator] = None) -> Dict[str, Any]:
+        """Perform many skill checks at once (arguments broadcast together, or to `size`)"""
+        modifiers = np.asarray(ability_modifiers)
+        proficiency = np.asarray(proficiency_bonus)
+        dcs = np.asarray(difficulty_classes)
+        shape = tuple(size) if size is not None else np.broadcast_shapes(modifiers.shape, proficiency.shape, dcs.shape)
+        
+        roll_used, advantage_roll = RuleEngine._d20_batch(shape, advantage, rng)
+        total = roll_used + modifiers + proficiency
+        
+        return {
+            "roll": roll_used,
+            "modifier": modifiers,
+            "proficiency": proficiency,
+            "total": total,
+            "dc": dcs,
+            "success": total >= dcs,
+            "advantage_roll": advantage_roll
+        }
+    
+    # ---------- Exact probabilities (memoized) ----------
+    
+    @staticmethod
+    @lru_cache(maxsize=PROBABILITY_CACHE_SIZE)
+    def d20_pmf(advantage: bool = False) -> np.ndarray:
+        """Exact P(roll_used == k) for k = 1..20 (at index k - 1)"""
+        faces = np.arange(1, 21)
+        if advantage:
+            return _readonly((faces ** 2 - (faces - 1) ** 2) / 400)  # Higher of two d20s
+        return _readonly(np.full(20, 1 / 20))
+    
+    @staticmethod
+    @lru_cache(maxsize=PROBABILITY_CACHE_SIZE)
+    def hit_probability(attacker_level: int, attacker_modifier: int,
+                        defender_ac: int, advantage: bool = False) -> float:
+        """Exact chance that attack_roll hits"""
+        needed = defender_ac - attacker_modifier - attacker_level // 4  # Lowest d20 that hits
+        return min(float(RuleEngine.d20_pmf(advantage)[max(needed, 1) - 1:].sum()), 1.0)
+    
+    @staticmethod
+    def crit_probability(advantage: bool = False) -> float:
+        """Exact chance that attack_roll is a critical (natural 20)"""
+        return float(RuleEngine.d20_pmf(advantage)[19])
+    
+    @staticmethod
+    @lru_cache(maxsize=PROBABILITY_CACHE_SIZE)
+    def damage_distribution(dice_count: int, dice_sides: int, modifier: int = 0,
+                            critical: bool = False) -> DamageDistribution:
+        """Exact distribution of damage_roll's total, by convolving the dice"""
+        multiplier = 2 if critical else 1
+        die = np.full(dice_sides, 1 / dice_sides)
+        pmf = np.ones(1)
+        for _ in range(dice_count * multiplier):
+            pmf = np.convolve(pmf, die)
+        lowest = dice_count * multiplier + modifier * multiplier
+        totals = np.arange(lowest, lowest + pmf.size)
+        return DamageDistribution(
+            totals=_readonly(totals),
+            pmf=_readonly(pmf),
+            cdf=_readonly(np.minimum(np.cumsum(pmf), 1.0)),
+            mean=float(totals @ pmf)
+        )
+    
+    @staticmethod
+    @lru_cache(maxsize=PROBABILITY_CACHE_SIZE)
+    def expected_attack_damage(attacker_level: int, attacker_modifier: int, defender_ac: int,
+                               dice_count: int, dice_sides: int, damage_modifier: int = 0,
+                               advantage: bool = False) -> float:
+        """Expected damage of one attack (misses count as 0, crits roll double)"""
+        pmf = RuleEngine.d20_pmf(advantage)
+        needed = max(defender_ac - attacker_modifier - attacker_level // 4, 1)
+        normal_hit = float(pmf[needed - 1:19].sum())
+        critical_hit = float(pmf[19]) if needed <= 20 else 0.0
+        return (normal_hit * RuleEngine.damage_distribution(dice_count, dice_sides, damage_modifier).mean
+                + critical_hit * RuleEngine.damage_distribution(dice_count, dice_sides, damage_modifier, True).mean)
+    
+    @staticmethod
+    @lru_cache(maxsize=PROBABILITY_CACHE_SIZE)
+    def skill_check_probability(ability_modifier: int, proficiency_bonus: int = 0,
+                                difficulty_class: int = 10, advantage: bool = False) -> float:
+        """Exact chance that skill_check succeeds"""
+        needed = difficulty_class - ability_modifier - proficiency_bonus
+        return min(float(RuleEngine.d20_pmf(advantage)[max(needed, 1) - 1:].sum()), 1.0)
+    
+    @staticmethod
+    def calculate_hp(max_hp: int, current_hp: int, damage: int) -> int:
+        """Apply damage/healing"""
+        return min(max_hp, max(0, current_hp - damage))
+    
+    @staticmethod
+    def calculate_xp(monster_cr: int) -> int:
+        """Calculate XP reward based on monster CR"""
+        xp_table = {
+            0: 10, 1: 200, 2: 450, 3: 700, 4: 1100,
+            5: 1800, 6: 2300, 7: 2900, 8: 3900, 9: 5000
+        }
+        return xp_table.get(min(monster_cr, 9), monster_cr * 1000)
+
+
+def attack_odds(character: "Character", monster: "Monster") -> Dict[str, float]:
+    """Exact odds of the character's attack (d20 + STR vs AC, 1d6 + STR) on a monster"""
+    strength = character.get_modifier("strength")
+    ac = monster.ac
+    return {
+        "hit_chance": RuleEngine.hit_probability(character.level, strength, ac),
+        "expected_damage": RuleEngine.expected_attack_damage(character.level, strength, ac, 1, 6, strength)
+    }
+
+
+def check_odds(character: "Character", ability: str, dc: int) -> float:
+    """Exact chance the character passes an ability check (proficiency = level // 4)"""
+    return RuleEngine.skill_check_probability(character.get_modifier(ability), character.level // 4, dc)
+
+
+class Record:
+    """Base for the small objects kept per session
+    
+    Subclasses list their fields in __slots__, so instances carry no __dict__,
+    and pickle as a plain tuple of field values (several times faster than
+    the default protocol for slotted objects). Unpickling also accepts the
+    dict state of sessions saved before the classes had slots.
+    """
+    __slots__ = ()
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._values = operator.attrgetter(*cls.__slots__)
+    
+    def __reduce_ex__(self, protocol):
+        return copyreg.__newobj__, (type(self),), self._values(self)
+    
+    def __setstate__(self, state):
+        for name, value in (state.items() if isinstance(state, dict) else zip(self.__slots__, state)):
+            setattr(self, name, value)
+
+
+class Monster(Record):
+    """A monster's stat block (MONSTER_TYPES holds templates; spawn copies them)"""
+    __slots__ = ("name", "hp", "max_hp", "ac", "cr")
+    
+    def __init__(self, name: str = "Monster", hp: int = 0, max_hp: int = 20, ac: int = 12, cr: float = 1):
+        self.name = name
+        self.hp = hp
+        self.max_hp = max_hp
+        self.ac = ac
+        self.cr = cr
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Monster":
+        return cls(data.get("name", "Monster"), data.get("hp", 0), data.get("max_hp", 20),
+                   data.get("ac", 12), data.get("cr", 1))
+    
+    def copy(self) -> "Monster":
+        return Monster(self.name, self.hp, self.max_hp, self.ac, self.cr)
+    
+    def to_dict(self) -> Dict:
+        """Convert to dictionary"""
+        return {"name": self.name, "hp": self.hp, "max_hp": self.max_hp, "ac": self.ac, "cr": self.cr}
+
+
+# Wandering monsters that can be encountered while traveling
+MONSTER_TYPES = (
+    Monster("Goblin", hp=10, max_hp=10, ac=12, cr=0),
+    Monster("Orc", hp=15, max_hp=15, ac=13, cr=1),
+    Monster("Skeleton", hp=13, max_hp=13, ac=13, cr=0.25),
+    Monster("Wolf", hp=11, max_hp=11, ac=13, cr=0.25),
+)
+
+
+class Character(Record):
+    """Player character"""
+    __slots__ = ("name", "level", "max_hp", "current_hp", "ac", "strength", "dexterity", "constitution",
+                 "intelligence", "wisdom", "charisma", "xp", "xp_to_next_level")
+    
+    def __init__(self):
+        self.name = "Adventurer"
+        self.level = 1
+        self.max_hp = 20
+        self.current_hp = 20
+        self.ac = 15
+        self.strength = 15
+        self.dexterity = 14
+        self.constitution = 13
+        self.intelligence = 12
+        self.wisdom = 10
+        self.charisma = 8
+        self.xp = 0
+        self.xp_to_next_level = 300
+    
+    def get_modifier(self, ability: str) -> int:
+        """Get ability modifier"""
+        score = getattr(self, ability.lower(), 10)
+        return RuleEngine.calculate_modifier(score)
+    
+    def level_up(self, rng: Optional[np.random.Generator] = None):
+        """Level up character"""
+        self.level += 1
+        self.max_hp += RuleEngine.roll_d6(1, rng) + RuleEngine.calculate_modifier(self.constitution)
+        self.current_hp = self.max_hp
+        self.xp_to_next_level = 300 * self.level
+    
+    def add_xp(self, amount: int, rng: Optional[np.random.Generator] = None):
+        """Add XP and check for level up"""
+        self.xp += amount
+        while self.xp >= self.xp_to_next_level:
+            self.level_up(rng)
+    
+    def to_dict(self) -> Dict:
+        """Convert to dictionary"""
+        return {
+            "name": self.name,
+            "level": self.level,
+            "max_hp": self.max_hp,
+            "current_hp": self.current_hp,
+            "ac": self.ac,
+            "strength": self.strength,
+            "dexterity": self.dexterity,
+            "constitution": self.constitution,
+            "intelligence": self.intelligence,
+            "wisdom": self.wisdom,
+            "charisma": self.charisma,
+            "xp": self.xp,
+            "xp_to_next_level": self.xp_to_next_level
+        }
@@ -0,0 +1,160 @@
+"""
+AI Dungeon Master - LLM Request Scheduler
+Per-provider concurrency caps with a bounded priority queue, queue-time
+deadlines and fast rejection when a provider is saturated
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+# Priorities: lower numbers are served first
+INTERACTIVE = 0  # A player is waiting on this turn
+BACKGROUND = 1  # Summaries and other work nobody is waiting on
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # In-flight requests per provider
+LLM_CONCURRENCY = os.getenv("LLM_CONCURRENCY", "")  # Per-provider overrides, e.g. "ollama=1,openai=16"
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "32"))  # Waiting requests per provider
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))  # Max seconds an interactive turn waits
+LLM_BACKGROUND_QUEUE_TIMEOUT = float(os.getenv("LLM_BACKGROUND_QUEUE_TIMEOUT", "60"))
+
+
+class SchedulerRejected(Exception):
+    """A request was turned away instead of queued (or waited too long)"""
+    status_code = 503
+    retry_after = 1  # Seconds a client should wait before retrying
+
+
+class SchedulerBusy(SchedulerRejected):
+    """The provider's queue is full"""
+    status_code = 429
+
+
+class QueueTimeout(SchedulerRejected):
+    """The request's queue-time deadline passed before a slot opened"""
+    status_code = 503
+
+
+class ConcurrencyLimiter:
+    """At most `limit` holders at once; others wait in priority order
+
+    Waiters are served by priority, then arrival. When the queue is full a
+    new request is rejected right away, unless it outranks a queued one, in
+    which case the lowest-priority, most recent waiter is rejected instead.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters: List[Any] = []  # Heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        """Wait for a slot; raises SchedulerBusy or QueueTimeout instead of waiting forever"""
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return
+        if self.queued >= self.max_queue:
+            self._make_room(priority)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise QueueTimeout(f"{self.name} is overloaded: no slot within {timeout:g}s") from None
+        except asyncio.CancelledError:
+            # A slot may have been handed over just as we gave up: pass it on
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            raise
+
+    def release(self):
+        """Free a slot, handing it straight to the next waiter if there is one"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _make_room(self, priority: int):
+        waiting = [entry for entry in self._waiters if not entry[2].done()]
+        victim = max(waiting, key=lambda entry: entry[:2], default=None)
+        self.rejected += 1
+        if victim is None or victim[0] <= priority:
+            raise SchedulerBusy(f"{self.name} is saturated ({self.active} running, {len(waiting)} queued)")
+        victim[2].set_exception(SchedulerBusy(f"{self.name} is saturated: bumped by a higher-priority request"))
+
+
+class LLMScheduler:
+    """One ConcurrencyLimiter per provider"""
+
+    def __init__(self, default_limit: int = LLM_MAX_CONCURRENCY, limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = LLM_QUEUE_SIZE):
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self.max_queue = max_queue
+        self._limiters: Dict[str, ConcurrencyLimiter] = {}
+
+    def limiter(self, name: str) -> ConcurrencyLimiter:
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            limit = self.limits.get(name, self.default_limit)
+            limiter = self._limiters[name] = ConcurrencyLimiter(name, limit, self.max_queue)
+        return limiter
+
+    async def acquire(self, name: str, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        await self.limiter(name).acquire(priority, timeout)
+
+    def release(self, name: str):
+        self.limiter(name).release()
+
+    @asynccontextmanager
+    async def slot(self, name: str, priority: int = INTERACTIVE,
+                   timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Hold one of the provider's slots for the duration of the block"""
+        await self.acquire(name, priority, timeout)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Load per provider"""
+        return [{
+            "provider": name,
+            "limit": limiter.limit,
+            "active": limiter.active,
+            "queued": limiter.queued,
+            "rejected": limiter.rejected,
+            "timed_out": limiter.timed_out,
+        } for name, limiter in self._limiters.items()]
+
+
+def parse_limits(text: str) -> Dict[str, int]:
+    """Parse "ollama=1,openai=16" into {"ollama": 1, "openai": 16}"""
+    limits = {}
+    for part in text.split(","):
+        if "=" in part:
+            name, limit = part.split("=", 1)
+            limits[name.strip().lower()] = int(limit)
+    return limits
+
+
+def create_llm_scheduler() -> LLMScheduler:
+    """Create the scheduler configured by the LLM_* environment variables"""
+    return LLMScheduler(LLM_MAX_CONCURRENCY, parse_limits(LLM_CONCURRENCY), LLM_QUEUE_SIZE)
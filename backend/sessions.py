@@ -0,0 +1,478 @@
+"""
+AI Dungeon Master - Session Storage
+Bounded in-memory session cache with SQLite persistence for evicted sessions,
+and a SQLite store shared by several worker processes
+"""
+
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+
+def serialize_state(state: Any) -> bytes:
+    """Serialize a game state for storage"""
+    return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def deserialize_state(data: bytes) -> Any:
+    """Restore a game state written by serialize_state"""
+    return pickle.loads(data)
+
+
+class VersionConflict(Exception):
+    """A session was changed (by another worker) after this worker loaded it"""
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Session {session_id} was changed by another request; reload and retry")
+        self.session_id = session_id
+
+
+class SessionStore:
+    """Interface for game session storage"""
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """Get a session's game state, or None if it doesn't exist"""
+        raise NotImplementedError
+
+    def put(self, session_id: str, state: Any):
+        """Store (or update) a session's game state"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        """Remove a session"""
+        raise NotImplementedError
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        """Release storage resources"""
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions persisted as pickled rows in a SQLite database
+
+    Every write bumps the row's revision, so several processes can share the
+    database and detect each other's writes (see put_versioned).
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; commits skip the fsync
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL, "
+            "revision INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+
+    def get(self, session_id: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return deserialize_state(row[0]) if row else None
+
+    def get_versioned(self, session_id: str) -> Optional[Tuple[Any, int]]:
+        """A session's game state and revision, or None if it doesn't exist"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, revision FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return (deserialize_state(row[0]), row[1]) if row else None
+
+    def revision(self, session_id: str) -> Optional[int]:
+        """A session's current revision (cheap: nothing is unpickled)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT revision FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, session_id: str, state: Any):
+        self.put_versioned(session_id, state)
+
+    def put_versioned(self, session_id: str, state: Any, expected: Optional[int] = None) -> int:
+        """Store a session's state and return its new revision
+
+        With `expected`, the write only happens if the row is still at that
+        revision, and raises VersionConflict otherwise. Without it, the write
+        always wins.
+        """
+        data = serialize_state(state)
+        now = time.time()
+        with self._lock:
+            if expected is None:
+                cursor = self._conn.execute(
+                    "INSERT INTO sessions (session_id, data, updated_at, revision) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT (session_id) DO UPDATE SET data = excluded.data, "
+                    "updated_at = excluded.updated_at, revision = revision + 1",
+                    (session_id, data, now)
+                )
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE sessions SET data = ?, updated_at = ?, revision = revision + 1 "
+                    "WHERE session_id = ? AND revision = ?",
+                    (data, now, session_id, expected)
+                )
+            if cursor.rowcount == 0:
+                self._conn.rollback()
+                raise VersionConflict(session_id)
+            # Still inside the write transaction, so this is the revision just written
+            revision = self._conn.execute(
+                "SELECT revision FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            self._conn.commit()
+        return revision
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MemorySessionStore(SessionStore):
+    """In-memory LRU cache bounded by session count, bytes and idle time
+
+    Sessions pushed out of memory are written to the backing store (if any)
+    and loaded back transparently the next time they are requested. Sessions
+    that `in_use` reports as busy (a turn is changing them) are never evicted,
+    so a half-applied turn is never written out.
+    """
+
+    def __init__(self, max_sessions: int = 1000, max_bytes: int = 0,
+                 ttl_seconds: float = 1800, backing: Optional[SessionStore] = None,
+                 in_use: Optional[Callable[[str], bool]] = None):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes  # 0 = no byte limit (sizes aren't measured)
+        self.ttl_seconds = ttl_seconds  # 0 = never evict idle sessions
+        self.backing = backing
+        self.in_use = in_use
+        self.total_bytes = 0
+        self.evicted_count = 0
+        self._entries = OrderedDict()  # session_id -> [state, last_access, size]
+        self._spilling: Dict[str, Any] = {}  # Evicted, but not yet written to the backing store
+        self._lock = threading.RLock()
+
+    def get(self, session_id: str) -> Optional[Any]:
+        evicted = []
+        with self._lock:
+            self._evict_idle(evicted)
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry[1] = time.monotonic()
+                self._entries.move_to_end(session_id)
+                state = entry[0]
+            else:
+                state = self._spilling.get(session_id)
+        self._spill(evicted)
+        if state is not None:
+            if entry is None:
+                self._admit(session_id, state)  # Evicted moments ago: take it back before it's reloaded
+            return state
+        if self.backing is None:
+            return None
+        state = self.backing.get(session_id)
+        if state is not None:
+            self._admit(session_id, state)
+        return state
+
+    def put(self, session_id: str, state: Any):
+        self._admit(session_id, state)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self.total_bytes -= entry[2]
+            self._spilling.pop(session_id, None)
+        if self.backing is not None:
+            self.backing.delete(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id in self._entries or session_id in self._spilling:
+                return True
+        return self.backing is not None and session_id in self.backing
+
+    def __len__(self) -> int:
+        """Number of sessions currently held in memory"""
+        with self._lock:
+            return len(self._entries)
+
+    def close(self):
+        # Flush everything still in memory so no session is lost on shutdown
+        with self._lock:
+            entries = [(session_id, entry[0]) for session_id, entry in self._entries.items()]
+            entries.extend(self._spilling.items())
+            self._entries.clear()
+            self._spilling.clear()
+            self.total_bytes = 0
+        if self.backing is not None:
+            for session_id, state in entries:
+                self.backing.put(session_id, state)
+            self.backing.close()
+
+    def _admit(self, session_id: str, state: Any):
+        size = len(serialize_state(state)) if self.max_bytes else 0
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self.total_bytes -= old[2]
+            self._entries[session_id] = [state, time.monotonic(), size]
+            self.total_bytes += size
+            self._evict_over_capacity(evicted)
+        self._spill(evicted)
+
+    def _busy(self, session_id: str) -> bool:
+        return self.in_use is not None and self.in_use(session_id)
+
+    def _evict_idle(self, evicted: List[Tuple[str, Any]]):
+        if not self.ttl_seconds:
+            return
+        now = time.monotonic()
+        cutoff = now - self.ttl_seconds
+        # Entries are in access order, so idle ones are at the front
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if entry[1] > cutoff:
+                break
+            if self._busy(session_id):
+                entry[1] = now  # A turn is running on it, so it isn't idle
+                self._entries.move_to_end(session_id)
+                continue
+            evicted.append(self._evict(session_id))
+
+    def _evict_over_capacity(self, evicted: List[Tuple[str, Any]]):
+        self._evict_idle(evicted)
+        skipped = 0  # Busy sessions passed over; once all of them are, stay over capacity for now
+        while skipped < len(self._entries) and (len(self._entries) > self.max_sessions or (
+                self.max_bytes and self.total_bytes > self.max_bytes and len(self._entries) > 1)):
+            session_id = next(iter(self._entries))
+            if self._busy(session_id):
+                self._entries.move_to_end(session_id)
+                skipped += 1
+                continue
+            evicted.append(self._evict(session_id))
+
+    def _evict(self, session_id: str) -> Tuple[str, Any]:
+        state, _, size = self._entries.pop(session_id)
+        self.total_bytes -= size
+        self.evicted_count += 1
+        if self.backing is not None:
+            self._spilling[session_id] = state
+        return session_id, state
+
+    def _spill(self, evicted: List[Tuple[str, Any]]):
+        """Write evicted sessions to the backing store; called without the lock, since pickling is slow"""
+        if self.backing is None:
+            return
+        for session_id, state in evicted:
+            with self._lock:
+                if self._spilling.get(session_id) is not state:
+                    continue  # Deleted or replaced meanwhile
+                if session_id in self._entries:
+                    del self._spilling[session_id]  # Back in memory; written on its next eviction
+                    continue
+            self.backing.put(session_id, state)
+            with self._lock:
+                if self._spilling.get(session_id) is state:
+                    del self._spilling[session_id]
+
+
+class SharedSessionStore(SessionStore):
+    """Sessions shared by worker processes through one SQLite database
+
+    Each process keeps recently used sessions unpickled in a small LRU cache
+    and checks the row's revision before handing one out, so a session changed
+    by another worker is reloaded. Writes are compare-and-set: saving a state
+    this process loaded fails with VersionConflict if another worker saved
+    the session in the meantime, instead of silently overwriting its turn.
+    The revision each state was loaded at is kept for as long as the state
+    object lives, even after it leaves the cache, so states must be
+    weak-referenceable (GameState is; plain dicts are not).
+    """
+
+    def __init__(self, backing: SQLiteSessionStore, max_cached: int = 1000):
+        self.backing = backing
+        self.max_cached = max_cached
+        self.conflict_count = 0
+        self._cached: "OrderedDict[str, List[Any]]" = OrderedDict()  # session_id -> [state, revision]
+        # id(state) -> (weak reference to the state, session_id, revision it was loaded or last saved at)
+        self._revisions: Dict[int, Tuple[weakref.ref, str, int]] = {}
+        self._lock = threading.RLock()  # Reentrant: a state collected while it is held calls _forget
+
+    def get(self, session_id: str) -> Optional[Any]:
+        revision = self.backing.revision(session_id)
+        with self._lock:
+            entry = self._cached.get(session_id)
+            if revision is None:
+                self._cached.pop(session_id, None)
+                return None
+            if entry is not None and entry[1] == revision:
+                self._cached.move_to_end(session_id)
+                return entry[0]
+        loaded = self.backing.get_versioned(session_id)
+        if loaded is None:
+            return None
+        self._remember(session_id, *loaded)
+        return loaded[0]
+
+    def put(self, session_id: str, state: Any):
+        # A state loaded through this store is saved only if nobody saved the session since;
+        # any other state (a new game, a restored session) replaces it outright
+        with self._lock:
+            known = self._revisions.get(id(state))
+        expected = None
+        if known is not None and known[0]() is state and known[1] == session_id:
+            expected = known[2]
+        try:
+            revision = self.backing.put_versioned(session_id, state, expected)
+        except VersionConflict:
+            with self._lock:
+                self._cached.pop(session_id, None)  # The cached copy holds the losing turn
+                self.conflict_count += 1
+            raise
+        self._remember(session_id, state, revision)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._cached.pop(session_id, None)
+        self.backing.delete(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.backing
+
+    def __len__(self) -> int:
+        return len(self.backing)
+
+    def close(self):
+        with self._lock:
+            self._cached.clear()
+        self.backing.close()
+
+    def _remember(self, session_id: str, state: Any, revision: int):
+        with self._lock:
+            self._cached[session_id] = [state, revision]
+            self._cached.move_to_end(session_id)
+            self._track(state, session_id, revision)
+            while len(self._cached) > self.max_cached:
+                self._cached.popitem(last=False)  # Already written through; nothing to save
+
+    def _track(self, state: Any, session_id: str, revision: int):
+        """Record the revision a state is at, for as long as the state object lives (call with the lock held)"""
+        key = id(state)
+        known = self._revisions.get(key)
+        if known is not None and known[0]() is state:
+            ref = known[0]
+        else:
+            ref = weakref.ref(state, lambda ref: self._forget(key, ref))
+        self._revisions[key] = (ref, session_id, revision)
+
+    def _forget(self, key: int, ref: weakref.ref):
+        """Drop a garbage-collected state's revision (unless its id was already reused)"""
+        with self._lock:
+            known = self._revisions.get(key)
+            if known is not None and known[0] is ref:
+                del self._revisions[key]
+
+
+class SessionLocks:
+    """One asyncio lock per active session
+
+    Turns within a session run one at a time in arrival order (asyncio locks
+    are FIFO), while different sessions never wait on each other. A lock is
+    dropped as soon as no request holds or waits for it.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, List[Any]] = {}  # session_id -> [lock, holders + waiters]
+
+    async def acquire(self, session_id: str):
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._forget(session_id, entry)
+            raise
+
+    def release(self, session_id: str):
+        entry = self._locks[session_id]
+        entry[0].release()
+        self._forget(session_id, entry)
+
+    @asynccontextmanager
+    async def hold(self, session_id: str) -> AsyncIterator[None]:
+        await self.acquire(session_id)
+        try:
+            yield
+        finally:
+            self.release(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        """Whether a request holds or is waiting for the session's lock"""
+        return session_id in self._locks
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def _forget(self, session_id: str, entry: List[Any]):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[session_id]
+
+
+def create_session_store(in_use: Optional[Callable[[str], bool]] = None) -> SessionStore:
+    """Create the session store configured by the SESSION_* environment variables
+
+    `in_use` tells the in-memory store which sessions a turn is working on,
+    so it doesn't evict them.
+    """
+    backend = os.getenv("SESSION_STORE", "memory").lower()
+    db_path = os.getenv("SESSION_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.db"))
+    if backend == "sqlite":
+        return SQLiteSessionStore(db_path)
+    if backend == "shared":
+        return SharedSessionStore(SQLiteSessionStore(db_path), max_cached=int(os.getenv("SESSION_MAX", "1000")))
+    if backend == "memory":
+        spill = os.getenv("SESSION_SPILL", "true").lower() in ("1", "true", "yes")
+        return MemorySessionStore(
+            max_sessions=int(os.getenv("SESSION_MAX", "1000")),
+            max_bytes=int(os.getenv("SESSION_MAX_BYTES", "0")),
+            ttl_seconds=float(os.getenv("SESSION_TTL", "1800")),
+            backing=SQLiteSessionStore(db_path) if spill else None,
+            in_use=in_use
+        )
+    raise ValueError(f"Unknown session store: {backend}. Use: memory, sqlite or shared")
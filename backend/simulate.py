@@ -0,0 +1,226 @@
+"""
+AI Dungeon Master - Encounter Balance Simulator
+Monte Carlo combat between a Character and a list of monsters, vectorized
+over trials with RuleEngine batch rolls
+
+Usage:
+    python simulate.py --levels 1-20 --monsters Goblin,Orc --trials 200000 --workers 4
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from rules import MONSTER_TYPES, Character, RuleEngine
+
+
+# How monsters hit back (the game itself doesn't roll monster attacks yet)
+MONSTER_ATTACKS = {
+    "Goblin": {"attack_bonus": 4, "damage_dice": 1, "damage_sides": 6, "damage_bonus": 2},
+    "Orc": {"attack_bonus": 5, "damage_dice": 1, "damage_sides": 12, "damage_bonus": 3},
+    "Skeleton": {"attack_bonus": 4, "damage_dice": 1, "damage_sides": 6, "damage_bonus": 2},
+    "Wolf": {"attack_bonus": 4, "damage_dice": 2, "damage_sides": 4, "damage_bonus": 2},
+}
+DEFAULT_ATTACK = {"attack_bonus": 3, "damage_dice": 1, "damage_sides": 6, "damage_bonus": 1}
+
+SECONDS_PER_ROUND = 6  # One combat round of in-game time
+MAX_ROUNDS = 200
+MAX_LEVEL = 20
+STATS = ("strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma")
+STAT_RANGE = (3, 30)  # Lowest and highest ability score accepted
+
+
+def monster_stats(name: str) -> Dict[str, Any]:
+    """Stat block for a monster type, including its attack profile"""
+    for monster in MONSTER_TYPES:
+        if monster.name.lower() == name.lower():
+            stats = monster.to_dict()
+            stats.update(MONSTER_ATTACKS.get(monster.name, DEFAULT_ATTACK))
+            return stats
+    known = ", ".join(m.name for m in MONSTER_TYPES)
+    raise ValueError(f"Unknown monster: {name}. Use: {known}")
+
+
+def character_at_level(level: int, stats: Optional[Dict[str, int]] = None) -> Character:
+    """A default Character at the given level (max HP is rolled per trial)"""
+    if not 1 <= level <= MAX_LEVEL:
+        raise ValueError(f"Level must be between 1 and {MAX_LEVEL}, not {level}")
+    character = Character()
+    for ability, score in (stats or {}).items():
+        if ability not in STATS:
+            raise ValueError(f"Unknown stat: {ability}. Use: {', '.join(STATS)}")
+        if not STAT_RANGE[0] <= score <= STAT_RANGE[1]:
+            raise ValueError(f"{ability} must be between {STAT_RANGE[0]} and {STAT_RANGE[1]}, not {score}")
+        setattr(character, ability, score)
+    character.level = level
+    return character
+
+
+def simulate_encounter(character: Character, monsters: Sequence[Dict[str, Any]],
+                       trials: int, rng: np.random.Generator,
+                       max_rounds: int = MAX_ROUNDS) -> Dict[str, Any]:
+    """Fight `monsters` one after another, `trials` times at once
+
+    Each round the character attacks the current monster (d20 + STR +
+    proficiency vs AC, 1d6 + STR damage, as in the game), then the monster
+    attacks back if it survived.
+    """
+    level = character.level
+    strength = character.get_modifier("strength")
+    constitution = character.get_modifier("constitution")
+
+    # Max HP as Character.level_up would roll it: 20 + (d6 + CON) per level gained
+    max_hp = np.full(trials, character.max_hp, dtype=np.int64)
+    if level > 1:
+        max_hp += RuleEngine.roll_dice_batch(6, level - 1, (trials,), rng).sum(axis=-1) + constitution * (level - 1)
+    hp = max_hp.copy()
+
+    monster_ac = np.array([m["ac"] for m in monsters])
+    monster_hp_table = np.array([m["max_hp"] for m in monsters])
+    monster_xp = np.array([RuleEngine.calculate_xp(m.get("cr", 1)) for m in monsters])
+    attack_bonus = np.array([m["attack_bonus"] for m in monsters])
+
+    current = np.zeros(trials, dtype=np.int64)  # Index of the monster being fought
+    monster_hp = np.full(trials, monster_hp_table[0])
+    xp = np.zeros(trials, dtype=np.int64)
+    rounds = np.zeros(trials, dtype=np.int64)
+    won = np.zeros(trials, dtype=bool)
+    active = np.ones(trials, dtype=bool)
+
+    for _ in range(max_rounds):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        rounds[idx] += 1
+        target = current[idx]
+
+        # Character attacks
+        attack = RuleEngine.attack_roll_batch(level, strength, monster_ac[target], rng=rng)
+        hit = attack["hit"][0]
+        damage = RuleEngine.damage_roll_batch(1, 6, strength, critical=attack["critical"][0], rng=rng)["total"]
+        monster_hp[idx] -= np.where(hit, np.maximum(damage, 0), 0)
+
+        # Defeated monsters give XP and the next one steps up
+        killed = idx[monster_hp[idx] <= 0]
+        xp[killed] += monster_xp[current[killed]]
+        current[killed] += 1
+        cleared = killed[current[killed] >= len(monsters)]
+        won[cleared] = True
+        active[cleared] = False
+        next_up = killed[current[killed] < len(monsters)]
+        monster_hp[next_up] = monster_hp_table[current[next_up]]
+
+        # Surviving monsters attack back
+        alive = idx[(monster_hp[idx] > 0) & active[idx]]
+        if alive.size == 0:
+            continue
+        fighter = current[alive]
+        roll = RuleEngine.roll_dice_batch(20, 1, (alive.size,), rng)[:, 0]
+        monster_hit = (roll + attack_bonus[fighter] >= character.ac) | (roll == 20)
+        for i, monster in enumerate(monsters):
+            # Dice counts differ per monster, so roll damage per monster type
+            mask = monster_hit & (fighter == i)
+            if not mask.any():
+                continue
+            hp[alive[mask]] -= RuleEngine.damage_roll_batch(
+                monster["damage_dice"], monster["damage_sides"], monster["damage_bonus"],
+                critical=roll[mask] == 20, rng=rng
+            )["total"]
+        dead = alive[hp[alive] <= 0]
+        active[dead] = False
+
+    hp_lost = max_hp - np.clip(hp, 0, None)
+    mean_rounds = float(rounds.mean())
+    minutes = mean_rounds * SECONDS_PER_ROUND / 60
+    return {
+        "level": level,
+        "monsters": [m["name"] for m in monsters],
+        "trials": trials,
+        "win_probability": float(won.mean()),
+        "expected_rounds": mean_rounds,
+        "expected_rounds_when_won": float(rounds[won].mean()) if won.any() else None,
+        "expected_hp_lost": float(hp_lost.mean()),
+        "expected_hp_lost_fraction": float((hp_lost / max_hp).mean()),
+        "expected_xp": float(xp.mean()),
+        "xp_per_minute": float(xp.mean() / minutes) if minutes else 0.0,
+        "unfinished": int(active.sum()),  # Still fighting after max_rounds
+    }
+
+
+def _run_level(args) -> Dict[str, Any]:
+    level, monster_names, trials, stats, seed_sequence = args
+    monsters = [monster_stats(name) for name in monster_names]
+    character = character_at_level(level, stats)
+    return simulate_encounter(character, monsters, trials, np.random.default_rng(seed_sequence))
+
+
+def sweep(levels: Sequence[int], monster_names: Sequence[str], trials: int = 100_000,
+          stats: Optional[Dict[str, int]] = None,
+          seed: Union[int, np.random.SeedSequence, None] = None,
+          workers: int = 1) -> List[Dict[str, Any]]:
+    """Simulate the encounter at every level, in parallel across processes
+
+    Each level gets its own independent random stream spawned from `seed` (an
+    int, or a SeedSequence such as one from GameState.spawn_seeds), so results
+    are reproducible regardless of the number of workers.
+    """
+    for name in monster_names:
+        monster_stats(name)  # Fail fast on unknown monsters
+    for level in levels:
+        character_at_level(level, stats)  # And on levels or stats out of range, before any worker starts
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    streams = seed.spawn(len(levels))
+    jobs = [(level, list(monster_names), trials, stats, stream) for level, stream in zip(levels, streams)]
+    if workers <= 1:
+        return [_run_level(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_level, jobs))
+
+
+def parse_levels(text: str) -> List[int]:
+    """Parse "5", "1-20" or "1,5,10" into a list of levels"""
+    levels = []
+    for part in text.split(","):
+        if "-" in part:
+            low, high = part.split("-")
+            levels.extend(range(int(low), int(high) + 1))
+        else:
+            levels.append(int(part))
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo encounter balance simulator")
+    parser.add_argument("--levels", default="1-20", help='Character levels, e.g. "1-20" or "1,5,10"')
+    parser.add_argument("--monsters", default="Goblin", help="Comma-separated monsters fought in order")
+    parser.add_argument("--trials", type=int, default=100_000, help="Combats per level")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+    parser.add_argument("--stat", action="append", default=[], metavar="ABILITY=SCORE",
+                        help="Override a character stat, e.g. --stat strength=16 --stat ac=17")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    stats = {key.lower(): int(value) for key, value in (s.split("=") for s in args.stat)}
+    started = time.perf_counter()
+    results = sweep(parse_levels(args.levels), args.monsters.split(","), args.trials,
+                    stats, args.seed, args.workers)
+    elapsed = time.perf_counter() - started
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'Level':>5} {'Win %':>7} {'Rounds':>7} {'HP lost':>8} {'XP':>8} {'XP/min':>8}")
+    for r in results:
+        print(f"{r['level']:>5} {r['win_probability'] * 100:>6.1f}% {r['expected_rounds']:>7.2f} "
+              f"{r['expected_hp_lost']:>8.2f} {r['expected_xp']:>8.1f} {r['xp_per_minute']:>8.1f}")
+    print(f"\n{len(results) * args.trials:,} combats in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
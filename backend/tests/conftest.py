@@ -0,0 +1,44 @@
+"""
+AI Dungeon Master - Test setup
+Makes the backend modules importable when pytest runs from anywhere, and
+provides the app fully offline for tests that need it
+"""
+
+import os
+import sys
+
+import pytest
+
+os.environ.update(AI_PROVIDER="stub", AI_PROVIDERS="stub", SUMMARY_ENABLED="false", EVENT_LOG="false",
+                  SESSION_STORE="memory", SESSION_SPILL="false", TRACE_LOG="", LLM_WARMUP="false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """The app module, imported on first use (most tests don't need it)"""
+    import app as game
+    from failover import FailoverChain
+
+    # A .env file is loaded with override=True, so pin the offline setup on the module too
+    game.AI_PROVIDERS[:] = ["stub"]
+    game.narrative_chain = FailoverChain(game.provider_registry, ["stub"], scheduler=game.llm_scheduler)
+    game.SUMMARY_ENABLED = False
+    return game
+
+
+@pytest.fixture
+def game(app_module, monkeypatch):
+    """The offline app with a fresh in-memory session store and no event log"""
+    from sessions import MemorySessionStore
+
+    monkeypatch.setattr(app_module, "session_store", MemorySessionStore())
+    monkeypatch.setattr(app_module, "event_log", None)
+    return app_module
+
+
+@pytest.fixture
+def client(game):
+    from fastapi.testclient import TestClient
+
+    return TestClient(game.app)
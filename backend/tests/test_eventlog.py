@@ -0,0 +1,75 @@
+"""
+AI Dungeon Master - Event log tests
+"""
+
+import pytest
+
+from eventlog import EventLog
+
+
+def test_loads_the_nearest_snapshot_at_or_before_a_turn(tmp_path):
+    log = EventLog(str(tmp_path), snapshot_every=5)
+    log.start("s", {"type": "new_game", "seed": 1})
+    for turn in (5, 10, 15):
+        log.save_snapshot("s", {"turn": turn}, turn, offset=turn * 100)
+    assert log.load_snapshot("s") == ({"turn": 15}, 1500)
+    assert log.load_snapshot("s", max_turn=12) == ({"turn": 10}, 1000)
+    assert log.load_snapshot("s", max_turn=10) == ({"turn": 10}, 1000)
+    assert log.load_snapshot("s", max_turn=4) is None
+
+
+def test_new_game_discards_old_snapshots(tmp_path):
+    log = EventLog(str(tmp_path), snapshot_every=5)
+    log.start("s", {"type": "new_game", "seed": 1})
+    log.save_snapshot("s", {"turn": 5}, 5, offset=100)
+    log.start("s", {"type": "new_game", "seed": 2})
+    assert log.load_snapshot("s") is None
+    assert list(log.read("s")) == [{"type": "new_game", "seed": 2}]
+
+
+def without_timestamps(value):
+    """A state as far as the rules go (replay re-stamps history and notes with the time it ran)"""
+    if isinstance(value, dict):
+        return {key: without_timestamps(item) for key, item in value.items() if key != "timestamp"}
+    if isinstance(value, list):
+        return [without_timestamps(item) for item in value]
+    return value
+
+
+ACTIONS = ["look around", "attack the goblin", "search the room", "cast a spell", "rest"]
+
+
+@pytest.fixture
+def played(client, game, monkeypatch, tmp_path):
+    """A 23-turn session logged with a snapshot every 5 turns, and its state after each turn"""
+    monkeypatch.setattr(game, "event_log", EventLog(str(tmp_path), snapshot_every=5))
+    assert client.post("/api/new-game/s").status_code == 200
+    states = {0: without_timestamps(client.get("/api/game-state/s").json())}
+    for turn in range(1, 24):
+        response = client.post("/api/action", json={"action": ACTIONS[turn % len(ACTIONS)], "session_id": "s"})
+        assert response.status_code == 200
+        states[turn] = without_timestamps(client.get("/api/game-state/s").json())
+    return states
+
+
+@pytest.mark.parametrize("turn", [3, 5, 7, 12, 20, 23])
+def test_replay_to_a_turn_matches_the_game_as_played(client, game, played, monkeypatch, turn):
+    offsets = []
+    read = game.event_log.read
+    monkeypatch.setattr(game.event_log, "read", lambda session_id, offset=0: offsets.append(offset) or
+                        read(session_id, offset))
+    response = client.get("/api/replay/s", params={"turn": turn})
+    assert response.status_code == 200
+    assert without_timestamps(response.json()) == played[turn]
+    assert (offsets[0] > 0) == (turn >= 5)  # Started from a snapshot once there was one
+
+
+def test_replay_sorts_turns_appended_out_of_order(game, played):
+    path = game.event_log._base_path("s") + ".jsonl"
+    with open(path, "rb") as f:
+        lines = f.readlines()
+    lines[-1], lines[-2] = lines[-2], lines[-1]  # Two workers finished their turns in the other order
+    with open(path, "wb") as f:
+        f.writelines(lines)
+    state = without_timestamps(game.restore_session("s", turn=23).to_dict())
+    assert {key: state[key] for key in played[23]} == played[23]
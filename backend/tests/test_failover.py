@@ -0,0 +1,127 @@
+"""
+AI Dungeon Master - Provider failover tests
+"""
+
+import asyncio
+
+import pytest
+
+from failover import CircuitBreaker, FailoverChain, ProvidersUnavailable
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def open_breaker(reset_timeout: float = 30) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=reset_timeout)
+    breaker.record_failure()
+    breaker.opened_at -= reset_timeout  # As if the reset timeout had passed
+    return breaker
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = open_breaker()
+    assert breaker.state == "half_open"
+    assert breaker.allow() and not breaker.allow()  # Only one trial at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0 and breaker.allow()
+
+
+def test_failed_trial_reopens():
+    breaker = open_breaker()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_released_trial_can_be_claimed_again():
+    breaker = open_breaker()
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open" and breaker.allow()
+
+
+class Provider:
+    model = "test"
+
+    def __init__(self, name, delay=0.0, fails=False):
+        self.name = name
+        self.delay = delay
+        self.fails = fails
+        self.closed = False
+
+    async def complete(self, system_prompt, user_prompt):
+        await asyncio.sleep(self.delay)
+        if self.fails:
+            raise RuntimeError(f"{self.name} is down")
+        return self.name
+
+    async def stream(self, system_prompt, user_prompt):
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fails:
+                raise RuntimeError(f"{self.name} is down")
+            yield self.name
+        finally:
+            self.closed = True
+
+
+class Registry:
+    def __init__(self, *providers):
+        self.providers = {provider.name: provider for provider in providers}
+
+    def get(self, name):
+        if name not in self.providers:
+            raise ValueError(f"{name} is not configured")
+        return self.providers[name]
+
+
+def test_fails_over_to_the_next_provider():
+    chain = FailoverChain(Registry(Provider("a", fails=True), Provider("b")), ["a", "b"])
+    assert asyncio.run(chain.complete("system", "user")) == "b"
+    assert chain.breakers["a"].failures == 1 and chain.breakers["b"].failures == 0
+
+
+def test_open_breaker_is_skipped():
+    a = Provider("a")
+    chain = FailoverChain(Registry(a, Provider("b")), ["a", "b"])
+    chain.breakers["a"] = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    chain.breakers["a"].record_failure()
+    assert asyncio.run(chain.complete("system", "user")) == "b"
+
+
+def test_provider_lookup_failure_ends_the_half_open_trial():
+    chain = FailoverChain(Registry(), ["a"])
+    chain.breakers["a"] = open_breaker()
+    with pytest.raises(ProvidersUnavailable):
+        asyncio.run(chain.complete("system", "user"))
+    assert chain.breakers["a"].state == "open" and not chain.breakers["a"]._trial_running
+
+
+def test_hedge_loser_is_cancelled_and_closed():
+    slow, fast = Provider("slow", delay=1.0), Provider("fast", delay=0.01)
+    chain = FailoverChain(Registry(slow, fast), ["slow", "fast"], hedge=True, hedge_min_samples=1)
+    chain.latency[("slow", "first_chunk")].add(0.02)  # Usually answers in 20 ms
+
+    async def run():
+        chunks = [chunk async for chunk in chain.stream("system", "user")]
+        await asyncio.sleep(0)  # Let the cancelled attempt finish unwinding
+        return chunks
+
+    assert asyncio.run(run()) == ["fast"]
+    assert chain.hedged_count == 1 and slow.closed and fast.closed
+    assert chain.breakers["slow"].failures == 0 and not chain.breakers["slow"]._trial_running
@@ -0,0 +1,104 @@
+"""
+AI Dungeon Master - Intent classifier tests
+"""
+
+import pytest
+
+from intents import INTENT_PRIORITY, classify, items_used
+
+
+@pytest.mark.parametrize("action, intent", [
+    ("pet help me", "pet_ability"),            # pet_ability before pet
+    ("attack the goblin to the north", "combat"),  # combat before movement
+    ("climb the wall and go north", "skill_dexterity"),
+    ("search the room then walk east", "skill_wisdom"),
+    ("walk north to train", "movement"),       # movement before training
+    ("train then rest", "training"),
+    ("rest with my companion", "rest"),        # rest before pet
+    ("summon a companion", "pet"),
+    ("sing a song", "action"),
+])
+def test_priority_order(action, intent):
+    assert classify(action).name == intent
+
+
+def test_priority_lists_every_intent_once():
+    assert len(set(INTENT_PRIORITY)) == len(INTENT_PRIORITY)
+    assert INTENT_PRIORITY.index("pet_ability") < INTENT_PRIORITY.index("pet")
+
+
+@pytest.mark.parametrize("action, intent", [
+    ("moving forward", "movement"),    # Dropped "e"
+    ("hitting the orc", "combat"),     # Doubled consonant
+    ("practicing", "training"),
+    ("practiced archery", "training"),
+    ("he attacks", "combat"),
+    ("searching the room", "skill_wisdom"),
+    ("the pet helps", "pet_ability"),  # Inflected last word of a phrase
+])
+def test_inflected_keywords(action, intent):
+    assert classify(action).name == intent
+
+
+@pytest.mark.parametrize("action", ["look at the goblin", "admire the golden idol", "a headache", "pick a petal"])
+def test_keywords_match_whole_words_only(action):
+    assert classify(action).name == "action"
+
+
+@pytest.mark.parametrize("action, direction", [
+    ("go north", "north"),
+    ("walk east then north", "east"),  # First direction mentioned
+    ("move forward", None),
+])
+def test_direction(action, direction):
+    assert classify(action).direction == direction
+
+
+@pytest.mark.parametrize("action, ability", [
+    ("train strength", "strength"),
+    ("practice dodging", "dexterity"),
+    ("study and lift weights", "strength"),  # Several abilities: the first in ABILITIES order
+    ("train", None),
+])
+def test_ability(action, ability):
+    assert classify(action).ability == ability
+
+
+@pytest.mark.parametrize("action, item", [
+    ("use the rope", "rope"),
+    ("use healing potion", "healing potion"),
+    ("drink the potion of healing", "potion of healing"),
+    ("give the merchant my torch", "torch"),  # Recipient first: the item is the second phrase
+    ("give Aldric the torch", "torch"),
+    ("give him the torch", "torch"),
+    ("give the torch to the merchant", "torch"),
+    ("throw my dagger at the goblin", "dagger"),
+    ("hand over the sword.", "sword"),
+    ("drop it", None),
+    ("go north", None),
+])
+def test_item(action, item):
+    assert classify(action).item == item
+
+
+INVENTORY = ["Rope", "Flint and Steel", "Map of the Region", "Healing Potion", "50 Gold Pieces"]
+
+
+@pytest.mark.parametrize("action, used", [
+    ("use the flint and steel", ["Flint and Steel"]),  # "and" inside the name
+    ("use the map of the region", ["Map of the Region"]),  # "the" inside the name
+    ("show the guard my map of the region", ["Map of the Region"]),
+    ("give the merchant 50 gold pieces and the rope", ["Rope", "50 Gold Pieces"]),
+    ("drink the potion", ["Healing Potion"]),  # No whole name: the object names part of one
+    ("use the ropes", []),
+    ("look at the rope", []),  # No item-use verb
+    ("drop it", []),
+])
+def test_items_used(action, used):
+    assert items_used(classify(action), INVENTORY) == used
+
+
+def test_flags():
+    intent = classify("return to the village")
+    assert intent.name == "movement" and intent.safe_destination and not intent.leaving
+    assert classify("flee the cave").leaving
@@ -0,0 +1,25 @@
+"""
+AI Dungeon Master - Prompt builder tests
+"""
+
+from prompt import PromptBuilder, PromptSection
+
+
+def build(budget, sections):
+    return PromptBuilder(system_prompt="", budget=budget, counter=len).build(sections)
+
+
+def test_trims_highest_priority_number_first():
+    sections = [
+        PromptSection(["ACTION"]),
+        PromptSection(["old", "new"], header="HISTORY:", priority=2, keep="last"),
+        PromptSection(["torch"], priority=1),
+    ]
+    assert build(100, sections) == "ACTION\n\nHISTORY:\nold\nnew\n\ntorch"
+    assert build(26, sections) == "ACTION\n\nHISTORY:\nnew\n\ntorch"
+    assert build(14, sections) == "ACTION\n\ntorch"  # Header dropped with its last line
+
+
+def test_header_of_empty_section_costs_nothing():
+    sections = [PromptSection(["abcde"]), PromptSection([], header="H" * 20), PromptSection(["xyz"], priority=1)]
+    assert build(12, sections) == "abcde\n\nxyz"
@@ -0,0 +1,189 @@
+"""
+AI Dungeon Master - LLM request scheduler tests
+"""
+
+import asyncio
+
+import pytest
+
+from failover import FailoverChain, ProvidersUnavailable, reserved_provider
+from scheduler import (BACKGROUND, INTERACTIVE, ConcurrencyLimiter, LLMScheduler, QueueTimeout, SchedulerBusy,
+                       parse_limits)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_full_queue_rejects_with_429():
+    async def run():
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await settle()
+        with pytest.raises(SchedulerBusy) as rejected:
+            await limiter.acquire()
+        limiter.release()  # Handed straight to the waiter
+        await waiter
+        return rejected.value, limiter
+
+    error, limiter = asyncio.run(run())
+    assert error.status_code == 429 and error.retry_after
+    assert limiter.rejected == 1 and limiter.active == 1
+
+
+def test_queue_deadline_rejects_with_503():
+    async def run():
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=4)
+        await limiter.acquire()
+        with pytest.raises(QueueTimeout) as timed_out:
+            await limiter.acquire(timeout=0.01)
+        return timed_out.value, limiter
+
+    error, limiter = asyncio.run(run())
+    assert error.status_code == 503 and limiter.timed_out == 1 and limiter.queued == 0
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    async def run():
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=8)
+        served = []
+
+        async def turn(name, priority):
+            await limiter.acquire(priority)
+            served.append(name)
+            limiter.release()
+
+        await limiter.acquire()
+        tasks = []
+        for name, priority in [("summary 1", BACKGROUND), ("player 1", INTERACTIVE),
+                               ("summary 2", BACKGROUND), ("player 2", INTERACTIVE)]:
+            tasks.append(asyncio.create_task(turn(name, priority)))
+            await settle()
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return served, limiter
+
+    served, limiter = asyncio.run(run())
+    assert served == ["player 1", "player 2", "summary 1", "summary 2"]
+    assert limiter.active == 0
+
+
+def test_interactive_request_bumps_queued_background_work():
+    async def run():
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=2)
+        await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire(BACKGROUND))
+        await settle()
+        last = asyncio.create_task(limiter.acquire(BACKGROUND))
+        await settle()
+        player = asyncio.create_task(limiter.acquire(INTERACTIVE))
+        await settle()
+        bumped = last.exception() if last.done() else None
+        with pytest.raises(SchedulerBusy):  # Background work can't bump anything
+            await limiter.acquire(BACKGROUND)
+        limiter.release()
+        await player
+        return first.done(), bumped
+
+    first_done, bumped = asyncio.run(run())
+    assert isinstance(bumped, SchedulerBusy)  # The most recent background waiter was rejected
+    assert not first_done  # The player went first
+
+
+def test_cancelled_waiter_passes_its_slot_on():
+    async def run():
+        limiter = ConcurrencyLimiter("test", limit=1, max_queue=4)
+        await limiter.acquire()
+        gone = asyncio.create_task(limiter.acquire())
+        await settle()
+        limiter.release()  # Handed to `gone`...
+        gone.cancel()  # ...which gives up before it runs
+        await asyncio.gather(gone, return_exceptions=True)
+        return limiter.active
+
+    assert asyncio.run(run()) == 0
+
+
+def test_parse_limits():
+    assert parse_limits("ollama=1, OpenAI=16,bad") == {"ollama": 1, "openai": 16}
+
+
+class Provider:
+    model = "test"
+
+    def __init__(self, name, fails=False):
+        self.name = name
+        self.fails = fails
+
+    async def complete(self, system_prompt, user_prompt):
+        await asyncio.sleep(0.01)
+        if self.fails:
+            raise RuntimeError(f"{self.name} is down")
+        return self.name
+
+    async def stream(self, system_prompt, user_prompt):
+        await asyncio.sleep(0.01)
+        if self.fails:
+            raise RuntimeError(f"{self.name} is down")
+        yield self.name
+        yield "!"
+
+
+class Registry:
+    def __init__(self, *providers):
+        self.providers = {provider.name: provider for provider in providers}
+
+    def get(self, name):
+        return self.providers[name]
+
+
+def test_failover_takes_a_slot_on_the_provider_it_uses():
+    scheduler = LLMScheduler(default_limit=2, max_queue=4)
+    chain = FailoverChain(Registry(Provider("a", fails=True), Provider("b")), ["a", "b"], scheduler=scheduler)
+
+    async def turn():
+        reserved = await chain.reserve()
+        token = reserved_provider.set(reserved)
+        try:
+            assert reserved == "a" and scheduler.limiter("a").active == 1
+            assert await chain.complete("system", "user") == "b"
+            assert scheduler.limiter("b").active == 0  # Freed once the reply is in
+            async for _ in chain.stream("system", "user"):
+                assert scheduler.limiter("b").active == 1  # Held while the stream runs
+        finally:
+            reserved_provider.reset(token)
+            chain.release(reserved)
+
+    asyncio.run(turn())
+    assert scheduler.limiter("a").active == 0 and scheduler.limiter("b").active == 0
+
+
+def test_saturated_fallback_is_skipped_without_tripping_its_breaker():
+    scheduler = LLMScheduler(default_limit=1, max_queue=0)
+    chain = FailoverChain(Registry(Provider("a", fails=True), Provider("b")), ["a", "b"], scheduler=scheduler)
+
+    async def run():
+        await scheduler.acquire("b")  # Someone else holds b's only slot
+        return await chain.complete("system", "user")
+
+    with pytest.raises(ProvidersUnavailable, match="saturated"):
+        asyncio.run(run())
+    assert chain.breakers["b"].failures == 0 and not chain.breakers["b"]._trial_running
+
+
+def test_saturated_provider_rejects_the_turn_before_it_runs(client, game):
+    limiter = game.llm_scheduler.limiter("stub")
+    assert client.post("/api/new-game/s").status_code == 200
+    state = client.get("/api/game-state/s").json()
+    full = limiter.max_queue
+    limiter.max_queue = 0
+    limiter.active += limiter.limit
+    try:
+        response = client.post("/api/action", json={"action": "attack the goblin", "session_id": "s"})
+    finally:
+        limiter.active -= limiter.limit
+        limiter.max_queue = full
+    assert response.status_code == 429 and response.headers["Retry-After"]
+    assert client.get("/api/game-state/s").json() == state  # Rejected before any rules ran
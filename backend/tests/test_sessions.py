@@ -0,0 +1,168 @@
+"""
+AI Dungeon Master - Session store tests
+"""
+
+import threading
+
+import pytest
+
+from sessions import MemorySessionStore, SessionStore, SharedSessionStore, SQLiteSessionStore, VersionConflict
+
+
+class DictStore(SessionStore):
+    """Backing store in a dict, with a hook that runs while a session is being written"""
+
+    def __init__(self, on_put=None):
+        self.data = {}
+        self.on_put = on_put
+
+    def get(self, session_id):
+        return self.data.get(session_id)
+
+    def put(self, session_id, state):
+        if self.on_put is not None:
+            self.on_put(session_id, state)
+        self.data[session_id] = state
+
+    def delete(self, session_id):
+        self.data.pop(session_id, None)
+
+    def __len__(self):
+        return len(self.data)
+
+
+def test_evicts_least_recently_used_to_backing_store(tmp_path):
+    backing = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    store = MemorySessionStore(max_sessions=2, backing=backing)
+    for session_id in ("a", "b", "c"):
+        store.put(session_id, {"id": session_id})
+    assert len(store) == 2 and "a" in backing and store.evicted_count == 1
+    assert store.get("a") == {"id": "a"}  # Loaded back transparently
+
+
+def test_busy_sessions_are_not_evicted():
+    busy = {"a"}
+    backing = DictStore()
+    store = MemorySessionStore(max_sessions=2, backing=backing, in_use=busy.__contains__)
+    for session_id in ("a", "b", "c"):
+        store.put(session_id, {"id": session_id})
+    assert "a" not in backing and "b" in backing  # The oldest idle session went instead
+    assert store.get("a") == {"id": "a"} and len(store) == 2
+
+
+def test_over_capacity_while_every_session_is_busy():
+    store = MemorySessionStore(max_sessions=1, backing=DictStore(), in_use=lambda session_id: True)
+    store.put("a", {"id": "a"})
+    store.put("b", {"id": "b"})
+    assert len(store) == 2 and store.evicted_count == 0
+
+
+def test_busy_session_is_not_idle():
+    busy = {"a"}
+    backing = DictStore()
+    store = MemorySessionStore(ttl_seconds=60, backing=backing, in_use=busy.__contains__)
+    store.put("a", {"id": "a"})
+    store.put("b", {"id": "b"})
+    for entry in store._entries.values():
+        entry[1] -= 120  # Both untouched for two minutes
+    store.get("missing")
+    assert set(backing.data) == {"b"} and len(store) == 1
+
+
+def test_session_being_spilled_is_served_from_memory():
+    seen = []
+    readers = []
+
+    def on_put(session_id, state):
+        if readers:
+            return  # (Taking the session back spills the other one: don't read that too)
+        readers.append(session_id)
+        # Another thread asks for the session while it is being written: it must not wait for
+        # the store lock (the write happens outside it) and must get the very same state
+        reader = threading.Thread(target=lambda: seen.append(store.get(session_id)))
+        reader.start()
+        reader.join(timeout=5)
+        assert not reader.is_alive(), "spill ran under the store lock"
+
+    store = MemorySessionStore(max_sessions=1, backing=DictStore(on_put))
+    a = {"id": "a"}
+    store.put("a", a)
+    store.put("b", {"id": "b"})
+    assert seen[0] is a
+
+
+class State(dict):
+    """A weak-referenceable state, as the shared store requires"""
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two worker processes' shared stores on one database"""
+    path = str(tmp_path / "shared.db")
+    return (SharedSessionStore(SQLiteSessionStore(path), max_cached=1),
+            SharedSessionStore(SQLiteSessionStore(path)))
+
+
+def test_shared_store_sees_other_workers_writes(workers):
+    a, b = workers
+    a.put("s", State(turn=0))
+    state = b.get("s")
+    state["turn"] = 1
+    b.put("s", state)
+    assert a.get("s") == {"turn": 1}
+
+
+def test_stale_write_conflicts(workers):
+    a, b = workers
+    a.put("s", State(turn=0))
+    mine, theirs = a.get("s"), b.get("s")
+    theirs["turn"] = 1
+    b.put("s", theirs)
+    mine["turn"] = 2
+    with pytest.raises(VersionConflict):
+        a.put("s", mine)
+    assert a.get("s") == {"turn": 1} and a.conflict_count == 1
+
+
+def test_stale_write_conflicts_after_cache_eviction(workers):
+    a, b = workers
+    a.put("s", State(turn=0))
+    mine = a.get("s")
+    a.put("other", State())  # Pushes "s" out of a's one-entry cache
+    assert "s" not in a._cached
+    theirs = b.get("s")
+    theirs["turn"] = 1
+    b.put("s", theirs)
+    mine["turn"] = 2
+    with pytest.raises(VersionConflict):
+        a.put("s", mine)
+
+
+def test_new_state_replaces_session(workers):
+    a, b = workers
+    a.put("s", State(turn=5))
+    b.put("s", State(turn=0))  # A new game: never loaded, so written outright
+    assert a.get("s") == {"turn": 0}
+
+
+def test_turn_that_lost_a_race_gets_409(client, game, monkeypatch, tmp_path):
+    path = str(tmp_path / "shared.db")
+    monkeypatch.setattr(game, "session_store", SharedSessionStore(SQLiteSessionStore(path), max_cached=1))
+    other_worker = SharedSessionStore(SQLiteSessionStore(path))
+    assert client.post("/api/new-game/s").status_code == 200
+    narrate = game.generate_narrative
+
+    async def racing_narrative(action, events, game_state):
+        # While this turn waits on the LLM, another worker finishes a turn on the same
+        # session and this worker's cache drops the session
+        other_worker.put("s", other_worker.get("s"))
+        game.session_store._cached.clear()
+        return await narrate(action, events, game_state)
+
+    monkeypatch.setattr(game, "generate_narrative", racing_narrative)
+    response = client.post("/api/action", json={"action": "look around", "session_id": "s"})
+    assert response.status_code == 409
+
+    monkeypatch.setattr(game, "generate_narrative", narrate)
+    response = client.post("/api/action", json={"action": "look around", "session_id": "s"})
+    assert response.status_code == 200  # Reloaded, so the retry goes through
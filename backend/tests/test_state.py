@@ -0,0 +1,93 @@
+"""
+AI Dungeon Master - State version, delta and ETag tests
+"""
+
+import copy
+
+import orjson
+import pytest
+
+ACTIONS = ["look around", "attack the goblin", "search the room", "pick up the torch", "rest"]
+
+
+def apply_delta(state, ops):
+    """Apply delta ops the way the frontend does (applyStateDelta in App.jsx)"""
+    state = copy.deepcopy(state)
+    for op in ops:
+        *keys, last = op["path"].split("/")[1:]
+        target = state
+        for key in keys:
+            target = target.setdefault(key, {})
+        target[last] = op["value"]
+    return state
+
+
+def as_json(state):
+    return orjson.loads(orjson.dumps(state))
+
+
+def play(game, game_state, actions):
+    for action in actions:
+        events, used_items = game.apply_action_rules(action, game_state)
+        game.finish_action(action, events, "Nothing stirs.", used_items, game_state)
+
+
+def test_delta_rebuilds_the_state(game):
+    game_state = game.GameState(seed=7)
+    old = as_json(game_state.commit())
+    since = game_state.version
+    play(game, game_state, ACTIONS)
+    game_state.character.current_hp -= 3
+    game_state.character.xp += 50
+    new = game_state.commit()
+    ops = game_state.delta_since(since, game_state.state_id, new)
+    assert {"/character/current_hp", "/character/xp", "/game_history"} <= {op["path"] for op in ops}
+    assert apply_delta(old, ops) == as_json(new)
+
+
+def test_unchanged_state_keeps_its_version(game):
+    game_state = game.GameState(seed=7)
+    state = game_state.commit()
+    version = game_state.version
+    assert game_state.commit() == state and game_state.version == version
+    assert game_state.delta_since(version, game_state.state_id, state) == []
+
+
+@pytest.mark.parametrize("state_id, since", [("another game", 0), (None, 0), ("same", 99), ("same", -1)])
+def test_delta_needs_a_copy_of_this_game(game, state_id, since):
+    game_state = game.GameState(seed=7)
+    state = game_state.commit()
+    state_id = game_state.state_id if state_id == "same" else state_id
+    assert game_state.delta_since(since, state_id, state) is None
+
+
+def test_turns_send_deltas_the_client_can_apply(client, game):
+    started = client.post("/api/new-game/s").json()
+    state, version = started["game_state"], {"since_version": started["version"], "state_id": started["state_id"]}
+    for action in ACTIONS:
+        result = client.post("/api/action", json={"action": action, "session_id": "s", **version}).json()
+        assert "game_state" not in result
+        assert result["game_state_delta"]["base_version"] == version["since_version"]
+        state = apply_delta(state, result["game_state_delta"]["ops"])
+        version["since_version"] = result["version"]
+    assert state == as_json(game.session_store.get("s").to_dict())
+
+
+def test_client_from_another_game_gets_the_full_state(client):
+    client.post("/api/new-game/s")
+    result = client.post("/api/action", json={"action": "look around", "session_id": "s",
+                                               "since_version": 0, "state_id": "another game"}).json()
+    assert "game_state_delta" not in result and result["game_state"]["character"]
+
+
+def test_game_state_is_not_resent_while_unchanged(client):
+    client.post("/api/new-game/s")
+    first = client.get("/api/game-state/s")
+    etag = first.headers["ETag"]
+    unchanged = client.get("/api/game-state/s", headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304 and unchanged.headers["ETag"] == etag and not unchanged.content
+
+    client.post("/api/action", json={"action": "attack the goblin", "session_id": "s"})
+    changed = client.get("/api/game-state/s", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    assert changed.json() != first.json()
@@ -0,0 +1,209 @@
+"""
+AI Dungeon Master - Request Tracing
+Lightweight per-request phase spans, reported in a Server-Timing header,
+an optional sampled JSONL trace log and opt-in cProfile dumps
+"""
+
+import contextvars
+import cProfile
+import inspect
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime
+from functools import partial, wraps
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+TRACE_LOG = os.getenv("TRACE_LOG", "")  # JSONL file for trace records ("" = off)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))  # Share of requests logged
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))  # Always log requests slower than this (0 = off)
+TRACE_PROFILE = os.getenv("TRACE_PROFILE", "false").lower() in ("1", "true", "yes")  # Honour X-Profile: 1
+TRACE_PROFILE_RATE = float(os.getenv("TRACE_PROFILE_RATE", "0"))  # Share of requests profiled
+TRACE_PROFILE_DIR = os.getenv("TRACE_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_profiling = False  # Only one request is profiled at a time
+# Profile dumps and trace records are written off the event loop, one at a time, in order
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-writer")
+
+
+class Trace:
+    """Phase timings for one request"""
+
+    def __init__(self, method: str, path: str, sampled: bool = False, profile: bool = False):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.route = path  # Replaced by the route template once routing is done
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}  # name -> [total seconds, count]
+        self.profiles: Optional[List[cProfile.Profile]] = [] if profile else None
+        self._lock = threading.Lock()  # Spans also close on worker threads
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.spans.get(name)
+            if entry is None:
+                self.spans[name] = [seconds, 1]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+
+    def phases(self) -> Dict[str, float]:
+        """Milliseconds per phase; `validate` is request parsing plus response validation"""
+        with self._lock:
+            phases = {name: total * 1000 for name, (total, _) in self.spans.items()}
+        if "route" in phases and "endpoint" in phases:
+            phases["validate"] = phases.pop("route") - phases["endpoint"]
+        return phases
+
+    def server_timing(self) -> str:
+        """Server-Timing header value for the phases finished so far"""
+        phases = self.phases()
+        phases["total"] = (time.perf_counter() - self.started) * 1000
+        return ", ".join(f"{name};dur={ms:.2f}" for name, ms in phases.items())
+
+
+class Span:
+    """Times a block into the current trace; does nothing outside a traced request"""
+    __slots__ = ("name", "trace", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.started)
+
+
+def span(name: str) -> Span:
+    return Span(name)
+
+
+def bind(func: Callable) -> Callable:
+    """Wrap `func` to run on another thread inside the current trace (and its profiler)"""
+    context = contextvars.copy_context()
+    trace = context.get(_current)
+    if trace is None or trace.profiles is None:
+        return partial(context.run, func)
+
+    def run(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiler is active on this interpreter
+            return context.run(func, *args, **kwargs)
+        try:
+            return context.run(func, *args, **kwargs)
+        finally:
+            profile.disable()
+            trace.profiles.append(profile)
+    return run
+
+
+def start_trace(method: str, path: str, headers: Any) -> Trace:
+    """Begin tracing a request and make it current; sampling and profiling are decided here"""
+    global _profiling
+    sampled = bool(TRACE_LOG) and random.random() < TRACE_SAMPLE_RATE
+    profile = not _profiling and (
+        (TRACE_PROFILE and headers.get("x-profile") == "1")
+        or (TRACE_PROFILE_RATE and random.random() < TRACE_PROFILE_RATE)
+    )
+    trace = Trace(method, path, sampled, bool(profile))
+    if profile:
+        main_profile = cProfile.Profile()
+        try:
+            main_profile.enable()
+            _profiling = True
+            trace.profiles.append(main_profile)
+        except ValueError:
+            trace.profiles = None
+    _current.set(trace)
+    return trace
+
+
+def finish_trace(trace: Trace, status: int):
+    """Stop profiling, then queue the trace record and profile dump if the request was picked
+
+    The files are written on a background thread, so the request never waits on them.
+    """
+    global _profiling
+    total_ms = (time.perf_counter() - trace.started) * 1000
+    profile_path = None
+    if trace.profiles is not None:
+        trace.profiles[0].disable()  # The event loop thread's profile
+        _profiling = False
+        route = trace.route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        profile_path = os.path.join(TRACE_PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{route}-{trace.id}.prof")
+
+    record = None
+    slow = TRACE_SLOW_MS and total_ms >= TRACE_SLOW_MS
+    if TRACE_LOG and (trace.sampled or slow or profile_path):
+        record = {
+            "trace_id": trace.id,
+            "timestamp": datetime.now().isoformat(),
+            "method": trace.method,
+            "route": trace.route,
+            "status": status,
+            "total_ms": round(total_ms, 3),
+            "phases": {name: round(ms, 3) for name, ms in trace.phases().items()},
+            "profile": profile_path,
+        }
+    if profile_path or record:
+        _writer.submit(_write_trace, trace.profiles, profile_path, record)
+
+
+def _write_trace(profiles: Optional[List[cProfile.Profile]], profile_path: Optional[str],
+                 record: Optional[Dict[str, Any]]):
+    try:
+        if profile_path:
+            os.makedirs(TRACE_PROFILE_DIR, exist_ok=True)
+            # Note: the event loop profile also covers whatever other requests ran meanwhile
+            pstats.Stats(*profiles).dump_stats(profile_path)
+        if record:
+            with open(TRACE_LOG, "a") as f:
+                f.write(json.dumps(record) + "\n")
+    except Exception as e:
+        print(f"⚠️  Could not write trace {profile_path or record['trace_id']}: {e}")
+
+
+def _traced_endpoint(endpoint: Callable) -> Callable:
+    if not inspect.iscoroutinefunction(endpoint):
+        return endpoint  # Only coroutine endpoints run in the request's context
+
+    @wraps(endpoint)
+    async def traced(*args, **kwargs):
+        with span("endpoint"):
+            return await endpoint(*args, **kwargs)
+    return traced
+
+
+class TracedRoute(APIRoute):
+    """Route that times the endpoint separately from request parsing and response validation"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _traced_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def traced_handler(request):
+            with span("route"):
+                return await handler(request)
+        return traced_handler
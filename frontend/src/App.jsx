@@ -83,6 +83,43 @@ function DiceRollAnimation({ event }) {
 
 const API_BASE = import.meta.env.VITE_API_BASE || 'http://localhost:8000'
 
+// Apply a game_state_delta (JSON-patch style "replace" ops) to a copy of the state
+function applyStateDelta(state, delta) {
+  const next = structuredClone(state)
+  for (const op of delta.ops) {
+    const keys = op.path.split('/').slice(1)
+    const last = keys.pop()
+    let target = next
+    for (const key of keys) target = target[key] ??= {}
+    target[last] = op.value
+  }
+  return next
+}
+
+// Read a text/event-stream response, calling onEvent(eventName, parsedData) per event
+async function readServerSentEvents(response, onEvent) {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      let event = 'message'
+      let data = ''
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim()
+        else if (line.startsWith('data:')) data += line.slice(5).trim()
+      }
+      if (data) onEvent(event, JSON.parse(data))
+    }
+  }
+}
+
 function App() {
   const [gameState, setGameState] = useState(null)
   const [action, setAction] = useState('')
@@ -93,6 +130,7 @@ function App() {
   const [pendingDiceRoll, setPendingDiceRoll] = useState(null)  // Track pending dice roll
   const narrativeEndRef = useRef(null)
   const actionInputRef = useRef(null)
+  const stateVersionRef = useRef(null)  // { state_id, version } of the game state we hold
 
   useEffect(() => {
     initializeGame()
@@ -109,7 +147,7 @@ function App() {
   const initializeGame = async () => {
     try {
       const response = await axios.post(`${API_BASE}/api/new-game/${sessionId}`)
-      await loadGameState()
+      updateGameState(response.data)
       // Use the random starting narrative from backend
       const startingNarrative = response.data.starting_narrative || 'Welcome, brave adventurer! Your journey begins...'
       setNarrative(startingNarrative)
@@ -118,13 +156,20 @@ function App() {
     }
   }
 
-  const loadGameState = async () => {
-    try {
-      const response = await axios.get(`${API_BASE}/api/game-state/${sessionId}`)
-      setGameState(response.data)
-    } catch (error) {
-      console.error('Failed to load game state:', error)
+  // Ask for a delta against the state we already hold
+  const versionParams = () => {
+    const current = stateVersionRef.current
+    return current ? { since_version: current.version, state_id: current.state_id } : {}
+  }
+
+  // Apply a turn result: either a full game_state or a delta against ours
+  const updateGameState = (result) => {
+    if (result.game_state_delta) {
+      setGameState(prev => applyStateDelta(prev, result.game_state_delta))
+    } else {
+      setGameState(result.game_state)
     }
+    stateVersionRef.current = { state_id: result.state_id, version: result.version }
   }
 
   const handleAction = async (e) => {
@@ -136,17 +181,37 @@ function App() {
     setLoading(true)
 
     try {
-      const response = await axios.post(`${API_BASE}/api/action`, {
-        action: actionText,
-        session_id: sessionId
+      // Stream the narrative: rule-engine events arrive first, then text as it is generated
+      const response = await fetch(`${API_BASE}/api/action/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ action: actionText, session_id: sessionId, ...versionParams() })
       })
+      if (!response.ok) throw new Error(`HTTP ${response.status}`)
+
+      let result = null
+      let streamedText = ''
+      setNarrative('')
+      await readServerSentEvents(response, (event, data) => {
+        if (event === 'events') {
+          setEvents(data || [])
+        } else if (event === 'token') {
+          streamedText += data.text
+          setNarrative(streamedText)
+        } else if (event === 'done') {
+          result = data
+        } else if (event === 'error') {
+          throw new Error(data.detail)
+        }
+      })
+      if (!result) throw new Error('Stream ended before the turn completed')
 
-      setNarrative(response.data.narrative)
-      setEvents(response.data.events || [])
-      setGameState(response.data.game_state)
+      setNarrative(result.narrative)
+      setEvents(result.events || [])
+      updateGameState(result)
       
       // Check if there's a pending dice roll
-      const diceEvent = response.data.events?.find(e => e.requires_dice)
+      const diceEvent = result.events?.find(e => e.requires_dice)
       if (diceEvent) {
         setPendingDiceRoll({
           type: diceEvent.type,
@@ -190,12 +255,13 @@ function App() {
       const response = await axios.post(`${API_BASE}/api/roll-dice`, {
         session_id: sessionId,
         roll_type: rollType,
-        context: context
+        context: context,
+        ...versionParams()
       })
       
       setNarrative(response.data.narrative)
       setEvents(response.data.events || [])
-      setGameState(response.data.game_state)
+      updateGameState(response.data)
       setPendingDiceRoll(null)
     } catch (error) {
       console.error('Dice roll failed:', error)